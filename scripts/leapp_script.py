@@ -1,20 +1,95 @@
+# The script is delivered as a single file in a signed playbook.
+# pylint: disable=too-many-lines
+import base64
+import argparse
+import collections
+import contextlib
+import errno
+import fcntl
+import functools
+import gzip
+import hashlib
+import heapq
+import io
 import json
 import logging
+import numbers
 import os
+import re
+import select
 import shutil
+import signal
+import sqlite3
 import sys
 import subprocess
+import threading
+import time
 
 from time import gmtime, strftime
 
 
-# SCRIPT_TYPE is either 'PREUPGRADE' or 'UPGRADE'
+def _get_int_content_var(name, default):
+    """
+    Read an integer content_var from the environment. The value is set in the
+    signed yaml envelope in content_vars and is prefixed with RHC_WORKER_ by
+    the worker. Invalid values fall back to the default.
+    """
+    value = os.environ.get("RHC_WORKER_%s" % name, "")
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+
+def _get_bool_content_var(name, default=False):
+    """Read a boolean content_var from the environment."""
+    value = os.environ.get("RHC_WORKER_%s" % name, "")
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "y")
+
+
+def _get_list_content_var(name):
+    """Read a comma separated list content_var from the environment."""
+    value = os.environ.get("RHC_WORKER_%s" % name, "")
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# SCRIPT_TYPE is either 'PREUPGRADE', 'UPGRADE' or 'PREUPGRADE_THEN_UPGRADE'
 # Value is set in signed yaml envelope in content_vars (RHC_WORKER_LEAPP_SCRIPT_TYPE)
 SCRIPT_TYPE = os.environ.get("RHC_WORKER_LEAPP_SCRIPT_TYPE", "None")
 IS_UPGRADE = SCRIPT_TYPE == "UPGRADE"
 IS_PREUPGRADE = SCRIPT_TYPE == "PREUPGRADE"
+# Run the pre-upgrade analysis and continue with the upgrade right away if it
+# found no inhibitors.
+IS_PREUPGRADE_THEN_UPGRADE = SCRIPT_TYPE == "PREUPGRADE_THEN_UPGRADE"
+ALLOWED_SCRIPT_TYPES = ["PREUPGRADE", "UPGRADE", "PREUPGRADE_THEN_UPGRADE"]
 JSON_REPORT_PATH = "/var/log/leapp/leapp-report.json"
 TXT_REPORT_PATH = "/var/log/leapp/leapp-report.txt"
+# Size of the chunks read from the leapp reports.
+REPORT_READ_CHUNK_SIZE = 64 * 1024
+# Maximum number of bytes of the leapp TXT report sent in the output, larger
+# reports are cut to a head and a tail window of half the size each. 0 sends
+# the whole report.
+REPORT_TXT_MAX_BYTES = _get_int_content_var(
+    "LEAPP_REPORT_TXT_MAX_BYTES", 8 * 1024 * 1024
+)
+# Encoding of the report fields in the final JSON block. "plain" keeps the
+# uncompressed 1.0 format, "gzip" sends `report` and `report_json` as gzip
+# compressed base64 strings in the 1.1 format.
+# Value is set in signed yaml envelope in content_vars (RHC_WORKER_LEAPP_REPORT_TRANSPORT)
+REPORT_TRANSPORT = (
+    os.environ.get("RHC_WORKER_LEAPP_REPORT_TRANSPORT", "plain").strip().lower()
+)
+REPORT_TRANSPORT_ENCODINGS = {"gzip": "gzip+base64"}
+# Format of the report entries in report_json. "default" sends the entries
+# verbatim, "compact" replaces the strings in the entries with indices into a
+# table of unique strings, see compact_report_entries.
+# Value is set in signed yaml envelope in content_vars (RHC_WORKER_LEAPP_REPORT_FORMAT)
+REPORT_FORMAT = (
+    os.environ.get("RHC_WORKER_LEAPP_REPORT_FORMAT", "default").strip().lower()
+)
+COMPACT_TASKS_FORMAT_ID = "oamg-compact-format"
 REBOOT_GUIDANCE_MESSAGE = "A reboot is required to continue. Please reboot your system."
 
 ALLOWED_RHEL_RELEASES = ["7", "8"]
@@ -35,20 +110,208 @@ STATUS_CODE_NAME_MAP = {
     "info": "INFO",
 }
 
+# Fields kept in each report entry sent in report_json, all fields are kept
+# when empty. E.g. "title,severity,groups,key,summary".
+REPORT_FIELDS = _get_list_content_var("LEAPP_REPORT_FIELDS")
+# Lowest severity of the report entries sent in report_json, one of the
+# STATUS_CODE keys. All entries are sent when empty or unknown.
+REPORT_MIN_SEVERITY = (
+    os.environ.get("RHC_WORKER_LEAPP_REPORT_MIN_SEVERITY", "").strip().lower()
+)
+# Maximum number of report entries sent in report_json, the most severe
+# entries are kept. 0 sends all entries.
+REPORT_MAX_ENTRIES = _get_int_content_var("LEAPP_REPORT_MAX_ENTRIES", 0)
+# Add an index of the report entries by group, severity and actor to
+# report_json.
+REPORT_INDEX = _get_bool_content_var("LEAPP_REPORT_INDEX")
+
 
 # Path to store the script logs
 LOG_DIR = "/var/log/leapp-insights-tasks"
 # Log filename for the script. It will be created based on the script type of
 # execution.
 LOG_FILENAME = "leapp-insights-tasks-%s.log" % (
-    "upgrade" if IS_UPGRADE else "preupgrade"
+    "upgrade" if IS_UPGRADE or IS_PREUPGRADE_THEN_UPGRADE else "preupgrade"
+)
+
+# Filename of the spool file that holds the complete output of the leapp
+# command.
+OUTPUT_SPOOL_FILENAME = "leapp-insights-tasks-%s-output.log" % (
+    "upgrade" if IS_UPGRADE or IS_PREUPGRADE_THEN_UPGRADE else "preupgrade"
+)
+# Number of trailing lines of a spooled command output kept in memory.
+OUTPUT_TAIL_LINES = _get_int_content_var("LEAPP_OUTPUT_TAIL_LINES", 200)
+
+# Events watched in the leapp output while the command runs. Each event is a
+# tuple of (name, pattern, keep), lines matching an event with keep set are
+# held in memory until the end of the run. The "value" group of the pattern,
+# if any, is reported in the progress frames.
+LEAPP_OUTPUT_EVENTS = [
+    ("reboot", re.escape(REBOOT_GUIDANCE_MESSAGE), True),
+    ("phase", r"^==> Processing phase `(?P<value>[^`]+)`", False),
+    ("actor", r"^====> \* (?P<value>\S+)", False),
+    ("inhibited", r"^\s*UPGRADE INHIBITED\s*$", True),
+    ("error", r"^\s*ERRORS\s*$|^Traceback \(most recent call last\):", True),
+]
+# Print progress frames for the leapp output events to stdout ahead of the
+# final JSON block.
+PROGRESS_FRAMES = _get_bool_content_var("LEAPP_PROGRESS_FRAMES")
+PROGRESS_FRAME_MARKER = "### PROGRESS ###"
+
+# Wall-clock deadlines in seconds for the commands run in each phase of the
+# script, 0 disables the deadline.
+COMMAND_TIMEOUTS = {
+    "setup": _get_int_content_var("LEAPP_SETUP_TIMEOUT", 3600),
+    "rhui": _get_int_content_var("LEAPP_RHUI_TIMEOUT", 3600),
+    "execute": _get_int_content_var("LEAPP_EXECUTE_TIMEOUT", 0),
+    "inventory": _get_int_content_var("LEAPP_INVENTORY_TIMEOUT", 900),
+    "preflight": _get_int_content_var("LEAPP_PREFLIGHT_TIMEOUT", 300),
+}
+# Seconds the whole run may take, usually the task timeout of the rhc worker,
+# 0 disables the budget. The deadlines of the commands are capped to the
+# remaining budget and the optional steps are skipped when it runs short.
+TIME_BUDGET = _get_int_content_var("LEAPP_TIME_BUDGET", 0)
+# Seconds of the budget kept for printing the result.
+TIME_BUDGET_RESERVE = 30
+# Seconds of the budget the optional steps need to be started.
+OPTIONAL_STEP_DURATIONS = {
+    "inventory": 120,
+}
+# Kill a command of any phase that produced no output for this many seconds,
+# 0 disables the stall detection.
+STALL_TIMEOUT = _get_int_content_var("LEAPP_STALL_TIMEOUT", 0)
+# Seconds between SIGTERM and SIGKILL when killing a timed out command.
+KILL_GRACE_PERIOD = 10
+# Maximum number of commands run concurrently by run_many.
+PROBE_PARALLELISM = _get_int_content_var("LEAPP_PROBE_PARALLELISM", 8)
+
+# Split the final JSON block into numbered frames of at most this many bytes,
+# each printed on its own line, 0 prints the JSON block in one piece.
+# Sizes below OUTPUT_FRAME_MIN_SIZE are raised to it.
+OUTPUT_FRAME_SIZE = _get_int_content_var("LEAPP_OUTPUT_FRAME_SIZE", 0)
+OUTPUT_FRAME_MIN_SIZE = 256
+OUTPUT_FRAME_MARKER = "### JSON FRAME ###"
+# Print the final JSON block without indentation and whitespace.
+OUTPUT_COMPACT = _get_bool_content_var("LEAPP_OUTPUT_COMPACT")
+# Size of the buffered chunks of the final JSON block written to stdout.
+OUTPUT_WRITE_BUFFER_SIZE = 64 * 1024
+
+SUBSCRIPTION_MANAGER_PATH = "/usr/sbin/subscription-manager"
+# Directory of the rpm database, its modification time tells when the set of
+# installed packages changed.
+RPMDB_PATH = "/var/lib/rpm"
+OS_RELEASE_PATH = "/etc/os-release"
+YUM_REPOS_DIR = "/etc/yum.repos.d"
+
+# Run the preflight checks before leapp and return an ERROR result without
+# running leapp when they find a blocker.
+PREFLIGHT_CHECKS = _get_bool_content_var("LEAPP_PREFLIGHT_CHECKS")
+# Minimal free space in bytes on the filesystems holding the paths.
+PREFLIGHT_MIN_FREE_SPACE = {
+    "/var": 3 * 1024**3,
+    "/boot": 100 * 1024**2,
+}
+# Data files leapp needs to plan the upgrade.
+LEAPP_FILES_DIR = "/etc/leapp/files"
+LEAPP_DATA_FILES = ["repomap.json", "pes-events.json"]
+# Releases leapp upgrades from, others need LEAPP_UNSUPPORTED=1. Set
+# LEAPP_SUPPORTED_SOURCE_RELEASES when the installed leapp-upgrade supports
+# other releases, e.g. "8.8,8.10".
+SUPPORTED_SOURCE_RELEASES = _get_list_content_var(
+    "LEAPP_SUPPORTED_SOURCE_RELEASES"
+) or ["7.9", "8.8", "8.10"]
+
+# Filename of the result of the last pre-upgrade analysis stored in LOG_DIR
+# together with the fingerprint of the system state it was computed for.
+PREUPGRADE_RESULT_FILENAME = "leapp-insights-tasks-preupgrade-result.json"
+# Seconds for which the stored pre-upgrade result is returned without running
+# the analysis again if the system state didn't change, 0 disables the cache.
+RESULT_CACHE_TTL = _get_int_content_var("LEAPP_RESULT_CACHE_TTL", 0)
+# Seconds for which an upgrade is refused because of the inhibitors of the
+# stored pre-upgrade result of the unchanged system, 0 means no limit.
+PREUPGRADE_RESULT_MAX_AGE = _get_int_content_var(
+    "LEAPP_PREUPGRADE_RESULT_MAX_AGE", 24 * 3600
+)
+# Files taken into the system fingerprint as editing them commonly resolves
+# inhibitors: the answers recorded with `leapp answer` and the configuration
+# checked by the leapp actors.
+FINGERPRINT_FILES = [
+    "/var/log/leapp/answerfile",
+    "/var/log/leapp/answerfile.userchoices",
+    "/etc/ssh/sshd_config",
+    "/etc/firewalld/firewalld.conf",
+    "/etc/fstab",
+    "/etc/default/grub",
+]
+# Changes on every boot of the system, e.g. into a newer kernel.
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+PROC_MODULES_PATH = "/proc/modules"
+# Filename of the digests of the report entries of the last run stored in
+# LOG_DIR, used to report the changes against the last run.
+ENTRY_DIGESTS_FILENAME = "leapp-insights-tasks-%s-entries.json" % (
+    "upgrade" if IS_UPGRADE or IS_PREUPGRADE_THEN_UPGRADE else "preupgrade"
+)
+# Send only the report entries added or changed since the last run together
+# with the keys of the removed entries.
+REPORT_DELTA = _get_bool_content_var("LEAPP_REPORT_DELTA")
+# Database of the past runs of the script stored in LOG_DIR, see the Run
+# history section of the README for the queries.
+HISTORY_DB_FILENAME = "leapp-insights-tasks-history.db"
+# Number of runs kept in the history database, 0 disables the history.
+HISTORY_RETENTION = _get_int_content_var("LEAPP_HISTORY_RETENTION", 100)
+# Filename of the checkpoints of the phases completed by the current run
+# stored in LOG_DIR. A retry on the unchanged system resumes from the first
+# incomplete phase.
+CHECKPOINTS_FILENAME = "leapp-insights-tasks-%s-checkpoints.json" % (
+    "upgrade" if IS_UPGRADE or IS_PREUPGRADE_THEN_UPGRADE else "preupgrade"
+)
+# Host-wide lock file in LOG_DIR held by the running operation. It also
+# passes the result of the operation to the invocations waiting for it.
+RUN_LOCK_FILENAME = "leapp-insights-tasks.lock"
+# Seconds to wait for the concurrent run of the same operation to finish.
+RUN_LOCK_TIMEOUT = _get_int_content_var("LEAPP_LOCK_TIMEOUT", 3600)
+# Seconds between the attempts to acquire the lock.
+RUN_LOCK_POLL_INTERVAL = 1
+# Resume a failed run from its checkpoints.
+RESUME_FROM_CHECKPOINTS = _get_bool_content_var("LEAPP_RESUME", True)
+# Seconds after which the checkpoints of a failed run are no longer resumed.
+CHECKPOINTS_MAX_AGE = _get_int_content_var("LEAPP_CHECKPOINTS_MAX_AGE", 24 * 3600)
+# Run the upgrade even if the stored pre-upgrade result of the unchanged
+# system reported inhibitors.
+IGNORE_PREUPGRADE_RESULT = _get_bool_content_var("LEAPP_IGNORE_PREUPGRADE_RESULT")
+# content_vars that only change how the result is delivered and so are left
+# out of the system state fingerprint.
+FINGERPRINT_IGNORED_CONTENT_VARS = (
+    "LEAPP_SCRIPT_TYPE",
+    "LEAPP_RESULT_CACHE_TTL",
+    "LEAPP_IGNORE_PREUPGRADE_RESULT",
+    "LEAPP_PREUPGRADE_RESULT_MAX_AGE",
+    "LEAPP_RESUME",
+    "LEAPP_CHECKPOINTS_MAX_AGE",
+    "LEAPP_HISTORY_RETENTION",
+    "LEAPP_LOCK_TIMEOUT",
+    "LEAPP_TIME_BUDGET",
+    "LEAPP_PREFLIGHT_CHECKS",
+    "LEAPP_REPORT_TRANSPORT",
+    "LEAPP_REPORT_FORMAT",
+    "LEAPP_OUTPUT_FRAME_SIZE",
+    "LEAPP_OUTPUT_COMPACT",
+    "LEAPP_OUTPUT_TAIL_LINES",
+    "LEAPP_PROGRESS_FRAMES",
+    "LEAPP_PROBE_PARALLELISM",
+    "LEAPP_SETUP_TIMEOUT",
+    "LEAPP_RHUI_TIMEOUT",
+    "LEAPP_EXECUTE_TIMEOUT",
+    "LEAPP_INVENTORY_TIMEOUT",
+    "LEAPP_PREFLIGHT_TIMEOUT",
+    "LEAPP_STALL_TIMEOUT",
 )
 
 # Path to the sos extras folder
 SOS_REPORT_FOLDER = "/etc/sos.extras.d"
 # Name of the file based on the task type for sos report
 SOS_REPORT_FILE = "leapp-insights-tasks-%s-logs" % (
-    "upgrade" if IS_UPGRADE else "preupgrade"
+    "upgrade" if IS_UPGRADE or IS_PREUPGRADE_THEN_UPGRADE else "preupgrade"
 )
 
 logger = logging.getLogger(__name__)
@@ -63,6 +326,19 @@ class ProcessError(Exception):
         self.report = report
 
 
+class ProcessTimeoutError(ProcessError):
+    """
+    Custom exception to report a command killed because it exceeded the
+    deadline of its phase or stopped producing output.
+    """
+
+    def __init__(self, message, report, phase, reason, timeout):
+        super(ProcessTimeoutError, self).__init__(message, report)
+        self.phase = phase
+        self.reason = reason
+        self.timeout = timeout
+
+
 class OutputCollector(object):
     """Wrapper class for script expected stdout"""
 
@@ -87,8 +363,22 @@ class OutputCollector(object):
         self.tasks_format_id = "oamg-format"
         self.entries = entries
         self.report_json = None
+        self.report_format = REPORT_FORMAT
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create the output from the dictionary returned by to_dict."""
+        output = cls(
+            status=data.get("status", ""),
+            message=data.get("message", ""),
+            report=data.get("report", ""),
+            alert=data.get("alert", False),
+            error=data.get("error", False),
+        )
+        output.report_json = data.get("report_json")
+        return output
 
-    def to_dict(self):
+    def to_dict(self, report_format=None):
         # If we have entries, then we change report_json to be a dictionary
         # with the needed values, otherwise, we leave it as `None` to be
         # transformed to `null` in json.
@@ -99,15 +389,344 @@ class OutputCollector(object):
                 "entries": self.entries,
             }
 
+        report_json = self.report_json
+        if (report_format or self.report_format) == "compact":
+            report_json = self._get_compact_report_json()
+
         return {
             "status": self.status,
             "alert": self.alert,
             "error": self.error,
             "message": self.message,
             "report": self.report,
-            "report_json": self.report_json,
+            "report_json": report_json,
         }
 
+    def _get_compact_report_json(self):
+        """Return a copy of report_json with the entries in compact format."""
+        if not isinstance(self.report_json, dict) or not isinstance(
+            self.report_json.get("entries"), list
+        ):
+            return self.report_json
+
+        report_json = dict(self.report_json)
+        strings, entries = compact_report_entries(report_json["entries"])
+        report_json.update(
+            {
+                "tasks_format_version": self.tasks_format_version,
+                "tasks_format_id": COMPACT_TASKS_FORMAT_ID,
+                "strings": strings,
+                "entries": entries,
+            }
+        )
+        return report_json
+
+    def encode(self, transport=None):
+        """
+        Return the output in the format of the requested transport, the
+        uncompressed 1.0 format is returned for the "plain" transport.
+        """
+        transport = transport or REPORT_TRANSPORT
+        data = self.to_dict()
+        if transport == "plain":
+            return data
+
+        if transport not in REPORT_TRANSPORT_ENCODINGS:
+            logger.warning(
+                "Unknown report transport '%s', sending the report uncompressed.",
+                transport,
+            )
+            return data
+
+        report_json = data["report_json"]
+        if report_json is not None:
+            report_json = _compress_text(json.dumps(report_json))
+
+        data.update(
+            {
+                "tasks_format_version": "1.1",
+                "tasks_format_id": self.tasks_format_id,
+                "report_encoding": REPORT_TRANSPORT_ENCODINGS[transport],
+                "report": _compress_text(data["report"]),
+                "report_json": report_json,
+            }
+        )
+        return data
+
+
+class _StringTable(object):
+    """Table of the unique strings of the values encoded in compact format."""
+
+    def __init__(self):
+        self.strings = []
+        self.indices = {}
+
+    def intern(self, value):
+        index = self.indices.get(value)
+        if index is None:
+            index = self.indices[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def encode(self, value):
+        if isinstance(value, dict):
+            return dict(
+                (str(self.intern(key)), self.encode(item))
+                for key, item in value.items()
+            )
+        if isinstance(value, list):
+            return [self.encode(item) for item in value]
+        if value is None or isinstance(value, bool):
+            return value
+        if isinstance(value, numbers.Number):
+            return {"#": value}
+        return self.intern(value)
+
+
+def compact_report_entries(entries):
+    """
+    Encode the report entries in compact format.
+
+    Every string is replaced with its index into a table of unique strings,
+    dictionary keys become the index as a string and numbers are wrapped as
+    {"#": number} to tell them apart from the indices. Lists, booleans and
+    nulls are kept. Returns the string table and the encoded entries, which
+    can be decoded with decode_compact_report_entries.
+    """
+    table = _StringTable()
+    entries = [table.encode(entry) for entry in entries]
+    return table.strings, entries
+
+
+def decode_compact_report_entries(strings, entries):
+    """Decode the report entries encoded by compact_report_entries."""
+    return [_decode_compact_value(strings, entry) for entry in entries]
+
+
+def _decode_compact_value(strings, value):
+    if isinstance(value, dict):
+        if list(value.keys()) == ["#"]:
+            return value["#"]
+        return dict(
+            (strings[int(key)], _decode_compact_value(strings, item))
+            for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return [_decode_compact_value(strings, item) for item in value]
+    if value is None or isinstance(value, bool):
+        return value
+    return strings[value]
+
+
+def get_output_frames(payload, frame_size):
+    """
+    Split the serialized output into frames of at most frame_size bytes.
+
+    The first frame is a header carrying the number of data frames, the size
+    and the sha256 checksum of the payload. Each data frame holds a numbered
+    piece of the payload, concatenating the pieces in order gives back the
+    payload. The payload is expected to be ASCII as produced by json.dumps.
+    """
+    frame_size = max(frame_size, OUTPUT_FRAME_MIN_SIZE)
+    if not isinstance(payload, bytes):
+        payload = payload.encode("utf-8")
+
+    # Split the escaped payload directly so that the frames don't have to be
+    # serialized piece by piece. The pieces must not cut an escape sequence.
+    escaped = json.dumps(payload.decode("utf-8"))[1:-1]
+    template = '%s {"frame": %d, "data": "%s"}'
+    overhead = len(template % (OUTPUT_FRAME_MARKER, len(escaped), ""))
+    piece_size = frame_size - overhead
+    pieces = []
+    start = 0
+    while start < len(escaped):
+        end = min(start + piece_size, len(escaped))
+        if end < len(escaped):
+            end = _get_escape_boundary(escaped, start, end)
+        pieces.append(escaped[start:end])
+        start = end
+
+    header = {
+        "frame": 0,
+        "frames": len(pieces),
+        "size": len(payload),
+        "sha256": hashlib.sha256(payload).hexdigest(),
+    }
+    yield "%s %s" % (OUTPUT_FRAME_MARKER, json.dumps(header, sort_keys=True))
+    for number, piece in enumerate(pieces, 1):
+        yield template % (OUTPUT_FRAME_MARKER, number, piece)
+
+
+def _get_escape_boundary(escaped, start, end):
+    """Move end back so that escaped[start:end] doesn't cut an escape."""
+    # An escape sequence is at most six characters long (\\uXXXX).
+    for position in range(max(start, end - 6), end):
+        if escaped[position] != "\\" or not _is_escape_start(escaped, start, position):
+            continue
+        length = 6 if escaped[position + 1] == "u" else 2
+        if position + length > end:
+            return position
+    return end
+
+
+def _is_escape_start(escaped, start, position):
+    """Check if the backslash at position starts an escape sequence."""
+    backslashes = 0
+    while (
+        position - backslashes > start and escaped[position - backslashes - 1] == "\\"
+    ):
+        backslashes += 1
+    return backslashes % 2 == 0
+
+
+def print_output(output):
+    """Print the output in one JSON block or split into frames."""
+    print("### JSON START ###")
+    if OUTPUT_FRAME_SIZE > 0:
+        for frame in get_output_frames(json.dumps(output.encode()), OUTPUT_FRAME_SIZE):
+            sys.stdout.write(frame + "\n")
+    else:
+        if OUTPUT_COMPACT:
+            encoder = json.JSONEncoder(separators=(",", ":"))
+        else:
+            encoder = json.JSONEncoder(indent=4)
+        write_json_chunks(encoder.iterencode(output.encode()))
+        sys.stdout.write("\n")
+    print("### JSON END ###")
+    sys.stdout.flush()
+
+
+def write_json_chunks(chunks, buffer_size=None):
+    """Write the chunks of an incremental encoder to stdout in buffered writes."""
+    buffer_size = buffer_size or OUTPUT_WRITE_BUFFER_SIZE
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= buffer_size:
+            sys.stdout.write("".join(pending))
+            pending = []
+            pending_size = 0
+    if pending:
+        sys.stdout.write("".join(pending))
+
+
+def _compress_text(text):
+    """Compress the text with gzip and return it as a base64 string."""
+    if not isinstance(text, bytes):
+        text = text.encode("utf-8")
+
+    buf = io.BytesIO()
+    # A fixed mtime keeps the compressed output stable between runs.
+    with gzip.GzipFile(filename="", mode="wb", fileobj=buf, mtime=0) as handler:
+        handler.write(text)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+class OutputSpool(object):
+    """
+    Command output streamed to a spool file on disk.
+
+    Only a bounded tail of the output and the lines explicitly kept are held
+    in memory, the complete output can be read back from the spool file with
+    `read()`.
+    """
+
+    def __init__(self, path, tail_lines=None):
+        self.path = path
+        self.size = 0
+        self.line_count = 0
+        self.kept_lines = []
+        self.tail = collections.deque(
+            maxlen=OUTPUT_TAIL_LINES if tail_lines is None else tail_lines
+        )
+        self._handler = open(path, mode="wb")
+
+    def write(self, raw_line, line, keep=False):
+        """
+        Write the raw line to the spool file and remember the decoded one.
+        Lines written with keep=True stay in memory after leaving the tail.
+        """
+        self._handler.write(raw_line)
+        self.size += len(raw_line)
+        self.line_count += 1
+        self.tail.append(line)
+        if keep:
+            self.kept_lines.append(line)
+
+    def close(self):
+        if not self._handler.closed:
+            self._handler.close()
+
+    @property
+    def truncated(self):
+        return self.line_count > len(self.tail)
+
+    def read(self):
+        """Read the complete output back from the spool file."""
+        with open(self.path, mode="rb") as handler:
+            return handler.read().decode("utf8")
+
+    def getvalue(self):
+        """Return the in-memory tail of the output."""
+        value = "".join(self.tail)
+        if self.truncated:
+            value = "[... %s earlier lines stored in %s ...]\n%s" % (
+                self.line_count - len(self.tail),
+                self.path,
+                value,
+            )
+        return value
+
+    def __contains__(self, text):
+        if any(text in line for line in self.kept_lines):
+            return True
+        return text in "".join(self.tail)
+
+    def __str__(self):
+        value = self.getvalue()
+        # Python 2 expects bytes from __str__
+        if sys.version_info[0] == 2:
+            return value.encode("utf8")
+        return value
+
+
+class LineMatcher(object):
+    """
+    Match command output lines against the registered patterns as they
+    arrive and fire the callbacks of the patterns that matched.
+    """
+
+    def __init__(self):
+        self.patterns = []
+        # Last line matched by each of the registered patterns
+        self.matched = {}
+
+    def register(self, name, pattern, callback=None, keep=False):
+        """
+        Register a pattern under the given name. The callback is called with
+        the name and the match object. Lines matching a pattern with keep set
+        are reported to be kept by `feed()`.
+        """
+        self.patterns.append((name, re.compile(pattern), callback, keep))
+
+    def feed(self, line):
+        """Match the line and return True if it should be kept in memory."""
+        keep_line = False
+        for name, regex, callback, keep in self.patterns:
+            match = regex.search(line)
+            if not match:
+                continue
+            self.matched[name] = line
+            keep_line = keep_line or keep
+            if callback:
+                callback(name, match)
+        return keep_line
+
+    def has_matched(self, name):
+        return name in self.matched
+
 
 def setup_sos_report():
     """Setup sos report log collection."""
@@ -206,14 +825,14 @@ def get_rhel_version():
     try:
         distribution_id = None
         version_id = None
-        with open("/etc/os-release", "r") as os_release_file:
+        with open(OS_RELEASE_PATH, "r") as os_release_file:
             for line in os_release_file:
                 if line.startswith("ID="):
                     distribution_id = line.split("=")[1].strip().strip('"')
                 elif line.startswith("VERSION_ID="):
                     version_id = line.split("=")[1].strip().strip('"')
     except IOError:
-        logger.warn("Couldn't read /etc/os-release")
+        logger.warn("Couldn't read %s", OS_RELEASE_PATH)
     return distribution_id, version_id
 
 
@@ -224,11 +843,115 @@ def is_non_eligible_releases(release):
     return release is None or major_version not in ALLOWED_RHEL_RELEASES
 
 
+class _CommandTimeout(Exception):
+    def __init__(self, reason):
+        super(_CommandTimeout, self).__init__(reason)
+        self.reason = reason
+
+
+def _iter_output_with_deadline(process, deadline, stall_timeout):
+    """
+    Read the process output line by line. Raise _CommandTimeout once the
+    deadline passes or the process stays silent for more than stall_timeout
+    seconds.
+    """
+    stdout_fd = process.stdout.fileno()
+    pending = b""
+    last_output_at = time.time()
+    while True:
+        now = time.time()
+        if deadline and now >= deadline:
+            raise _CommandTimeout("deadline")
+        if stall_timeout and now >= last_output_at + stall_timeout:
+            raise _CommandTimeout("stall")
+
+        waits = [deadline - now] if deadline else []
+        if stall_timeout:
+            waits.append(last_output_at + stall_timeout - now)
+        ready, _, _ = select.select([stdout_fd], [], [], min(waits))
+        if not ready:
+            continue
+
+        chunk = os.read(stdout_fd, 65536)
+        if not chunk:
+            break
+        last_output_at = time.time()
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+
+    if pending:
+        yield pending
+
+
+def _kill_process_group(process):
+    """Terminate the whole process group, SIGKILL it after a grace period."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+    grace_deadline = time.time() + KILL_GRACE_PERIOD
+    while process.poll() is None and time.time() < grace_deadline:
+        time.sleep(0.1)
+
+    # Children can outlive the group leader, kill whatever is left of it.
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    process.wait()
+
+
+def _get_timeout_error(cmd, phase, reason, timeout, output):
+    if reason == "deadline":
+        description = "exceeded the deadline of %s seconds" % timeout
+    else:
+        description = "produced no output for %s seconds" % timeout
+    return ProcessTimeoutError(
+        message="The %s phase timed out" % phase,
+        report="Command '%s' in the %s phase %s and was killed. Output: %s"
+        % (" ".join(cmd), phase, description, output.rstrip("\n")),
+        phase=phase,
+        reason=reason,
+        timeout=timeout,
+    )
+
+
+def _read_output(process, deadline, stall_timeout, matcher, spool, lines):
+    """
+    Feed the output lines of the process to the matcher and store them in the
+    spool, or in lines without a spool. Raise _CommandTimeout when the
+    deadline or the stall_timeout expires.
+    """
+    if deadline or stall_timeout:
+        output_lines = _iter_output_with_deadline(process, deadline, stall_timeout)
+    else:
+        output_lines = iter(process.stdout.readline, b"")
+
+    for raw_line in output_lines:
+        line = raw_line.decode("utf8")
+        keep = matcher.feed(line) if matcher else False
+        if spool:
+            spool.write(raw_line, line, keep)
+        else:
+            lines.append(line)
+
+
 # Code taken from
 # https://github.com/oamg/convert2rhel/blob/v1.4.1/convert2rhel/utils.py#L345
 # and modified to adapt the needs of the tools that are being executed in this
 # script.
-def run_subprocess(cmd, print_cmd=True, env=None, wait=True):
+def run_subprocess(
+    cmd,
+    print_cmd=True,
+    env=None,
+    wait=True,
+    spool=None,
+    matcher=None,
+    phase=None,
+):
     """
     Call the passed command and optionally log the called command
     (print_cmd=True) and environment variables in form of dictionary(env=None).
@@ -237,6 +960,16 @@ def run_subprocess(cmd, print_cmd=True, env=None, wait=True):
 
     The cmd is specified as a list starting with the command and followed by a
     list of arguments. Example: ["yum", "install", "<package>"]
+
+    When a spool is passed, the output is streamed to its file and only the
+    in-memory tail of the output is returned, the complete output stays
+    available through the spool. Each line is fed to the matcher, if any, as
+    soon as it is read.
+
+    Commands run as part of a phase are subject to the deadline of the phase
+    from COMMAND_TIMEOUTS and to STALL_TIMEOUT. Such commands run in their own
+    process group which is killed when a timeout expires and
+    ProcessTimeoutError is raised.
     """
     if isinstance(cmd, str):
         raise TypeError("cmd should be a list, not a str")
@@ -244,29 +977,341 @@ def run_subprocess(cmd, print_cmd=True, env=None, wait=True):
     if print_cmd:
         logger.info("Calling command '%s'", " ".join(cmd))
 
+    timeout = time_budget.get_timeout(COMMAND_TIMEOUTS.get(phase, 0)) if phase else 0
+    stall_timeout = STALL_TIMEOUT if phase else 0
+    deadline = time.time() + timeout if timeout else None
+
+    popen_kwargs = {}
+    if timeout or stall_timeout:
+        # Run the command in its own process group to be able to kill it
+        # together with its children.
+        popen_kwargs["preexec_fn"] = os.setsid
+
     process = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1, env=env
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+        env=env,
+        **popen_kwargs
     )
 
-    output = ""
-
     if not wait:
-        return output, None
+        return "", None
 
-    for line in iter(process.stdout.readline, b""):
-        line = line.decode("utf8")
-        output += line
+    lines = []
+    try:
+        _read_output(process, deadline, stall_timeout, matcher, spool, lines)
+    except _CommandTimeout as timeout_error:
+        _kill_process_group(process)
+        raise _get_timeout_error(  # pylint: disable=raise-missing-from
+            cmd,
+            phase,
+            timeout_error.reason,
+            timeout if timeout_error.reason == "deadline" else stall_timeout,
+            spool.getvalue() if spool else "".join(lines),
+        )
+    finally:
+        if spool:
+            spool.close()
 
     # Call wait() to wait for the process to terminate so that we can
     # get the return code.
     process.wait()
 
-    return output, process.returncode
+    if spool:
+        logger.info("Output of the command stored at %s", spool.path)
+        return spool.getvalue(), process.returncode
+    return "".join(lines), process.returncode
+
+
+def _start_commands(pending, running, parallelism, env, popen_kwargs):
+    """Start the pending commands until parallelism commands are running."""
+    while pending and len(running) < parallelism:
+        index, cmd = pending.popleft()
+        logger.info("Calling command '%s'", " ".join(cmd))
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            **popen_kwargs
+        )
+        running[process.stdout.fileno()] = (index, cmd, process, [], time.time())
+
+
+def _read_ready_commands(ready, running, results):
+    """Read the output of the ready commands and reap the finished ones."""
+    for stdout_fd in ready:
+        index, _, process, chunks, _ = running[stdout_fd]
+        chunk = os.read(stdout_fd, 65536)
+        if chunk:
+            chunks.append(chunk)
+            continue
+        del running[stdout_fd]
+        process.stdout.close()
+        process.wait()
+        results[index] = (b"".join(chunks).decode("utf8"), process.returncode)
+
+
+def _kill_expired_command(running, timeout, phase):
+    """Kill the first command running for longer than the timeout."""
+    for stdout_fd, (_, cmd, process, chunks, started_at) in list(running.items()):
+        if time.time() >= started_at + timeout:
+            del running[stdout_fd]
+            _kill_process_group(process)
+            raise _get_timeout_error(
+                cmd, phase, "deadline", timeout, b"".join(chunks).decode("utf8")
+            )
+
+
+def run_many(cmds, parallelism=None, env=None, phase=None):
+    """
+    Run independent commands concurrently, at most `parallelism` of them at
+    a time, and multiplex their output with select.
+
+    Returns a list of (output, returncode) tuples in the order of cmds. The
+    deadline of the phase applies to each command separately, stall
+    detection is not done as the commands are expected to be short.
+    """
+    parallelism = parallelism or PROBE_PARALLELISM
+    timeout = time_budget.get_timeout(COMMAND_TIMEOUTS.get(phase, 0)) if phase else 0
+    popen_kwargs = {"preexec_fn": os.setsid} if timeout else {}
+
+    results = [None] * len(cmds)
+    pending = collections.deque(enumerate(cmds))
+    # stdout file descriptor -> (index, cmd, process, output chunks, start)
+    running = {}
+    try:
+        while pending or running:
+            _start_commands(pending, running, parallelism, env, popen_kwargs)
+
+            wait = None
+            if timeout:
+                first_deadline = min(item[4] for item in running.values()) + timeout
+                wait = max(first_deadline - time.time(), 0)
+            ready, _, _ = select.select(list(running), [], [], wait)
+
+            _read_ready_commands(ready, running, results)
+            if timeout:
+                _kill_expired_command(running, timeout, phase)
+    finally:
+        # Do not leave any command behind when one of them failed
+        for _, _, process, _, _ in running.values():
+            if timeout:
+                _kill_process_group(process)
+            elif process.poll() is None:
+                process.kill()
+                process.wait()
+
+    return results
+
+
+class PackageIndex(object):
+    """
+    Index of the installed packages mapping the package name to a tuple of
+    (version, release, arch).
+
+    The index is built lazily from a single dump of the rpmdb and rebuilt
+    once the modification time of the rpmdb changes, for example after a
+    package was installed.
+    """
+
+    DUMP_COMMAND = [
+        "/usr/bin/rpm",
+        "-qa",
+        "--queryformat",
+        "%{NAME} %{VERSION} %{RELEASE} %{ARCH}\\n",
+    ]
+
+    def __init__(self):
+        self._packages = None
+        self._rpmdb_mtime = None
+
+    @staticmethod
+    def get_rpmdb_mtime():
+        """
+        Return the latest modification time of the rpmdb or None if it can't
+        be read. The Berkeley DB environment and lock files are ignored as
+        they are touched by read-only queries too.
+        """
+        try:
+            mtimes = [os.stat(RPMDB_PATH).st_mtime]
+            for name in os.listdir(RPMDB_PATH):
+                if not name.startswith(("__db", ".")):
+                    mtimes.append(os.stat(os.path.join(RPMDB_PATH, name)).st_mtime)
+        except OSError:
+            return None
+        return max(mtimes)
+
+    def update(self, output, rpmdb_mtime):
+        """Rebuild the index from the output of DUMP_COMMAND."""
+        self._packages = {}
+        self._rpmdb_mtime = rpmdb_mtime
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 4:
+                self._packages[fields[0]] = tuple(fields[1:])
+
+    def invalidate(self):
+        self._packages = None
+        self._rpmdb_mtime = None
+
+    def is_stale(self):
+        return self._packages is None or self.get_rpmdb_mtime() != self._rpmdb_mtime
+
+    def get(self, name):
+        """Return (version, release, arch) of the installed package or None."""
+        if self.is_stale():
+            rpmdb_mtime = self.get_rpmdb_mtime()
+            output, returncode = run_subprocess(self.DUMP_COMMAND, phase="setup")
+            if returncode:
+                logger.warning(
+                    "Listing installed packages failed with exit code %s.",
+                    returncode,
+                )
+            self.update(output, rpmdb_mtime)
+        return self._packages.get(name)
+
+    def is_installed(self, name):
+        return self.get(name) is not None
+
+
+# Shared by all the installed package checks during the run of the script
+package_index = PackageIndex()
+
+
+class RunRecord(object):
+    """Timings of the phases and the report entries of the current run"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.timings = collections.OrderedDict()
+        # ReportDelta of the last parsed report, holding the entry digests
+        self.delta = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add the time spent in the block to the timing of the phase."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.time() - start
+
+
+# Record of the run of the script stored in the history database
+run_record = RunRecord()
+
+
+class TimeBudget(object):
+    """
+    Deadline of the run derived from the time budget, budget 0 means no
+    deadline. The reserve is kept aside for printing the result.
+    """
+
+    def __init__(self, budget, reserve=0):
+        self.budget = budget
+        self.reserve = reserve
+        self.started = time.time()
+        # Names of the optional steps skipped for lack of time
+        self.skipped = []
+
+    def start(self):
+        self.started = time.time()
+        self.skipped = []
+
+    def remaining(self):
+        """Seconds left before the reserve, None without a budget."""
+        if not self.budget:
+            return None
+        return max(self.started + self.budget - self.reserve - time.time(), 0)
+
+    def get_timeout(self, timeout):
+        """Cap the timeout, 0 meaning no timeout, to the remaining budget."""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        # The timeout can't be 0 as that disables it
+        remaining = max(int(remaining), 1)
+        return min(timeout, remaining) if timeout else remaining
+
+    def allows(self, step):
+        """
+        Return True if the optional step fits in the remaining budget,
+        otherwise record it as skipped.
+        """
+        remaining = self.remaining()
+        if remaining is None or remaining >= OPTIONAL_STEP_DURATIONS.get(step, 0):
+            return True
+        logger.warning(
+            "Skipping the %s step, only %d seconds of the time budget left.",
+            step,
+            remaining,
+        )
+        self.skipped.append(step)
+        return False
+
+    def require(self, phase):
+        """Raise ProcessError if the budget ran out before the phase."""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise ProcessError(
+                message="The time budget of the task ran out.",
+                report="Exiting before the %s phase because the time budget of "
+                "%s seconds ran out." % (phase, self.budget),
+            )
+
+    def annotate(self, output):
+        """Note the skipped steps in the result."""
+        if not self.skipped:
+            return
+        output.message += " Skipped because of the time budget: %s." % ", ".join(
+            self.skipped
+        )
+        if isinstance(output.report_json, dict):
+            output.report_json["skipped"] = list(self.skipped)
+
+
+# Deadline of the current run
+time_budget = TimeBudget(TIME_BUDGET, TIME_BUDGET_RESERVE)
+
+
+class PreflightProbes(object):
+    """Results of the independent checks run concurrently before leapp"""
+
+    def __init__(self, rhsm_repos_output=None):
+        # Output of `subscription-manager repos --list-enabled` or None
+        self.rhsm_repos_output = rhsm_repos_output
+
+
+def run_preflight_probes():
+    """
+    Build the installed package index and list the enabled
+    subscription-manager repositories concurrently.
+    """
+    logger.info("Running preflight probes ...")
+    rpmdb_mtime = PackageIndex.get_rpmdb_mtime()
+    # The index may already be built, e.g. for the system fingerprint
+    dump_packages = package_index.is_stale()
+    cmds = [PackageIndex.DUMP_COMMAND] if dump_packages else []
+    # The repositories are listed speculatively, the output is only used when
+    # subscription-manager turns out to be installed.
+    if os.path.exists(SUBSCRIPTION_MANAGER_PATH):
+        cmds.append([SUBSCRIPTION_MANAGER_PATH, "repos", "--list-enabled"])
+
+    results = run_many(cmds, phase="setup") if cmds else []
+
+    if dump_packages:
+        package_index.update(results.pop(0)[0], rpmdb_mtime)
+    probes = PreflightProbes()
+    if results:
+        probes.rhsm_repos_output = results[0][0]
+    return probes
 
 
 def _check_if_package_installed(pkg_name):
-    _, return_code = run_subprocess(["/usr/bin/rpm", "-q", pkg_name])
-    return return_code == 0
+    return package_index.is_installed(pkg_name)
 
 
 def _get_leapp_command_and_packages(version):
@@ -274,7 +1319,6 @@ def _get_leapp_command_and_packages(version):
         leapp_install_command = [
             "/usr/bin/yum",
             "install",
-            "leapp-upgrade",
             "-y",
             "--enablerepo=rhel-7-server-extras-rpms",
         ]
@@ -303,7 +1347,7 @@ def _get_leapp_command_and_packages(version):
             },
         ]
     if version.startswith("8"):
-        leapp_install_command = ["/usr/bin/dnf", "install", "leapp-upgrade", "-y"]
+        leapp_install_command = ["/usr/bin/dnf", "install", "-y"]
         rhui_packages = [
             {"src_pkg": "rh-amazon-rhui-client", "leapp_pkg": "leapp-rhui-aws"},
             {
@@ -335,35 +1379,66 @@ def _get_leapp_command_and_packages(version):
     return leapp_install_command, rhui_packages
 
 
-def setup_leapp(version):
-    leapp_install_command, rhel_rhui_packages = _get_leapp_command_and_packages(version)
-    if _check_if_package_installed("leapp-upgrade"):
-        logger.info("'leapp-upgrade' already installed, skipping ...")
-    else:
-        logger.info("Installing leapp ...")
-        output, returncode = run_subprocess(leapp_install_command)
-        if returncode:
-            raise ProcessError(
-                message="Installation of leapp failed",
-                report="Installation of leapp failed with code '%s' and output: %s."
-                % (returncode, output.rstrip("\n")),
-            )
-
+def get_installed_rhui_packages(version):
+    _, rhel_rhui_packages = _get_leapp_command_and_packages(version)
     logger.info("Check installed rhui packages ...")
-    for pkg in rhel_rhui_packages:
-        if _check_if_package_installed(pkg["src_pkg"]):
-            pkg["installed"] = True
-    return [pkg for pkg in rhel_rhui_packages if pkg.get("installed", False)]
+    return [
+        pkg for pkg in rhel_rhui_packages if _check_if_package_installed(pkg["src_pkg"])
+    ]
+
+
+def setup_leapp(version, rhui_pkgs=None):
+    """
+    Install leapp and the leapp packages corresponding to the given installed
+    rhui packages in a single transaction. Packages already installed are
+    skipped.
+    """
+    leapp_install_command, _ = _get_leapp_command_and_packages(version)
+    packages = ["leapp-upgrade"] + [pkg["leapp_pkg"] for pkg in rhui_pkgs or []]
+
+    to_install = []
+    for pkg in packages:
+        if pkg in to_install:
+            continue
+        if _check_if_package_installed(pkg):
+            logger.info("'%s' already installed, skipping ...", pkg)
+        else:
+            to_install.append(pkg)
 
+    if not to_install:
+        return
+
+    if "leapp-upgrade" not in to_install:
+        # The extras repository only provides leapp, it isn't defined on RHUI
+        # systems where yum fails on enabling an unknown repository.
+        leapp_install_command = [
+            arg for arg in leapp_install_command if not arg.startswith("--enablerepo=")
+        ]
+
+    logger.info("Installing %s ...", ", ".join(to_install))
+    output, returncode = run_subprocess(
+        leapp_install_command + to_install, phase="setup"
+    )
+    if returncode:
+        raise ProcessError(
+            message="Installation of leapp failed",
+            report="Installation of %s failed with code '%s' and output: %s."
+            % (", ".join(to_install), returncode, output.rstrip("\n")),
+        )
 
-def should_use_no_rhsm_check(rhui_installed, command):
+
+def should_use_no_rhsm_check(rhui_installed, command, probes=None):
     logger.info("Checking if subscription manager and repositories are available ...")
     rhsm_repo_check_fail = True
     rhsm_installed_check = _check_if_package_installed("subscription-manager")
     if rhsm_installed_check:
-        rhsm_repo_check, _ = run_subprocess(
-            ["/usr/sbin/subscription-manager", "repos", "--list-enabled"]
-        )
+        if probes and probes.rhsm_repos_output is not None:
+            rhsm_repo_check = probes.rhsm_repos_output
+        else:
+            rhsm_repo_check, _ = run_subprocess(
+                [SUBSCRIPTION_MANAGER_PATH, "repos", "--list-enabled"],
+                phase="rhui",
+            )
         rhsm_repo_check_fail = (
             "This system has no repositories available through subscriptions."
             in rhsm_repo_check
@@ -380,20 +1455,184 @@ def should_use_no_rhsm_check(rhui_installed, command):
     return False
 
 
-def install_leapp_pkg_corresponding_to_installed_rhui(rhui_pkgs):
-    logger.info("Installing leapp package corresponding to installed rhui packages")
-    for pkg in rhui_pkgs:
-        install_pkg = pkg["leapp_pkg"]
-        install_output, returncode = run_subprocess(
-            ["/usr/bin/yum", "install", "-y", install_pkg]
+def _get_preflight_entry(name, title, summary, groups):
+    """Return the inhibitor report entry of a failed preflight check."""
+    return {
+        "key": hashlib.sha1(("leapp-insights-tasks:" + name).encode()).hexdigest(),
+        "title": title,
+        "summary": summary,
+        "severity": "inhibitor",
+        "groups": ["inhibitor"] + groups,
+        "audience": "sysadmin",
+        "timeStamp": strftime("%Y-%m-%dT%H:%M:%S.000000Z", gmtime()),
+    }
+
+
+def check_free_space():
+    entries = []
+    for path, min_free in sorted(PREFLIGHT_MIN_FREE_SPACE.items()):
+        if not os.path.exists(path):
+            continue
+        stat = os.statvfs(path)
+        free = stat.f_bavail * stat.f_frsize
+        if free < min_free:
+            entries.append(
+                _get_preflight_entry(
+                    "free_space:" + path,
+                    "Not enough free space in %s" % path,
+                    "The upgrade needs at least %s MiB of free space in %s, "
+                    "only %s MiB are available."
+                    % (min_free // 1024**2, path, free // 1024**2),
+                    ["filesystem"],
+                )
+            )
+    return entries
+
+
+def check_leapp_data_files():
+    missing = [
+        name
+        for name in LEAPP_DATA_FILES
+        if not os.path.isfile(os.path.join(LEAPP_FILES_DIR, name))
+    ]
+    if not missing:
+        return []
+    return [
+        _get_preflight_entry(
+            "leapp_data_files",
+            "Leapp data files are missing",
+            "The files %s are missing in %s. Reinstall the leapp-upgrade package."
+            % (", ".join(missing), LEAPP_FILES_DIR),
+            ["sanity"],
         )
-        if returncode:
-            raise ProcessError(
-                message="Installation of %s (coresponding pkg to '%s') failed",
-                report="Installation of %s (coresponding pkg to '%s') failed with exit code %s and output: %s."
-                % (install_pkg, pkg, returncode, install_output.rstrip("\n")),
+    ]
+
+
+def check_enabled_repos():
+    """Check for an enabled repository in the yum repo files."""
+    section = re.compile(r"^\s*\[[^]]+\]")
+    enabled = re.compile(r"^\s*enabled\s*=\s*(\S*)")
+    if os.path.isdir(YUM_REPOS_DIR):
+        for name in sorted(os.listdir(YUM_REPOS_DIR)):
+            if not name.endswith(".repo"):
+                continue
+            repo_enabled = None
+            with open(os.path.join(YUM_REPOS_DIR, name)) as handler:
+                for line in handler:
+                    if section.match(line):
+                        # Repositories are enabled unless set otherwise
+                        if repo_enabled:
+                            return []
+                        repo_enabled = True
+                        continue
+                    match = enabled.match(line)
+                    if match and repo_enabled is not None:
+                        repo_enabled = match.group(1).lower() in ("1", "true", "yes")
+            if repo_enabled:
+                return []
+    return [
+        _get_preflight_entry(
+            "enabled_repos",
+            "No enabled repositories",
+            "No repository is enabled in %s. Enable the repositories of the "
+            "installed RHEL release." % YUM_REPOS_DIR,
+            ["repository"],
+        )
+    ]
+
+
+def check_source_release(version):
+    unsupported = os.environ.get(
+        "RHC_WORKER_LEAPP_UNSUPPORTED", os.environ.get("LEAPP_UNSUPPORTED", "")
+    )
+    if version in SUPPORTED_SOURCE_RELEASES or unsupported.strip() == "1":
+        return []
+    return [
+        _get_preflight_entry(
+            "source_release",
+            "The installed release is not supported for the upgrade",
+            "The upgrade from RHEL %s is not supported. Update the system to "
+            "one of the releases %s." % (version, ", ".join(SUPPORTED_SOURCE_RELEASES)),
+            ["sanity"],
+        )
+    ]
+
+
+# Checks of the local system, check_source_release is run with the installed
+# release on top of them.
+PREFLIGHT_CHECK_FUNCTIONS = [
+    check_free_space,
+    check_leapp_data_files,
+    check_enabled_repos,
+]
+
+
+def run_preflight_checks(version):
+    """
+    Run the preflight checks concurrently and return the report entries of
+    the blockers they found. A check that fails itself or doesn't finish
+    before the deadline of the preflight phase is skipped.
+    """
+    logger.info("Running preflight checks ...")
+    checks = PREFLIGHT_CHECK_FUNCTIONS + [
+        functools.partial(check_source_release, version)
+    ]
+    results = [[] for _ in checks]
+    timeout = time_budget.get_timeout(COMMAND_TIMEOUTS["preflight"])
+    deadline = time.time() + timeout if timeout else None
+
+    def run_check(index, check):
+        try:
+            results[index] = check()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning(
+                "Preflight check %s failed: %s",
+                getattr(check, "func", check).__name__,
+                err,
             )
 
+    threads = [
+        threading.Thread(target=run_check, args=(index, check))
+        for index, check in enumerate(checks)
+    ]
+    for thread in threads:
+        # A hung check must not keep the script from exiting
+        thread.daemon = True
+        thread.start()
+    entries = []
+    for index, thread in enumerate(threads):
+        thread.join(max(deadline - time.time(), 0) if deadline else None)
+        if thread.is_alive():
+            logger.warning(
+                "Preflight check %s didn't finish in %s seconds, skipping it.",
+                getattr(checks[index], "func", checks[index]).__name__,
+                timeout,
+            )
+            continue
+        entries.extend(results[index])
+    return entries
+
+
+def get_preflight_result(entries):
+    """Return the ERROR result of the blockers found by the preflight checks."""
+    summary = ReportSummary()
+    for entry in entries:
+        summary.add(entry)
+    output = OutputCollector(
+        status="ERROR",
+        alert=True,
+        message="The upgrade cannot proceed. The preflight checks found %s "
+        "inhibitor%s, leapp was not run."
+        % (len(entries), "" if len(entries) == 1 else "s"),
+        report="\n".join(
+            "Risk Factor: high (inhibitor)\nTitle: %s\nSummary: %s\n%s"
+            % (entry["title"], entry["summary"], "-" * 40)
+            for entry in entries
+        ),
+    )
+    output.report_json = {"entries": entries, "summary": summary.to_dict()}
+    return output
+
 
 def remove_previous_reports():
     logger.info("Removing previous leapp reports at /var/log/leapp/leapp-report.* ...")
@@ -405,7 +1644,35 @@ def remove_previous_reports():
         os.remove(TXT_REPORT_PATH)
 
 
+def _report_leapp_progress(name, match):
+    """Log the leapp output event and optionally print it as progress frame."""
+    value = match.groupdict().get("value")
+    if name == "actor":
+        logger.debug("Leapp %s: %s", name, value)
+    else:
+        logger.info("Leapp %s%s", name, ": %s" % value if value else "")
+
+    if PROGRESS_FRAMES:
+        frame = {
+            "event": name,
+            "value": value,
+            "time": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime()),
+        }
+        sys.stdout.write("%s %s\n" % (PROGRESS_FRAME_MARKER, json.dumps(frame)))
+        sys.stdout.flush()
+
+
+def _get_leapp_output_matcher():
+    matcher = LineMatcher()
+    for name, pattern, keep in LEAPP_OUTPUT_EVENTS:
+        matcher.register(name, pattern, _report_leapp_progress, keep)
+    return matcher
+
+
 def execute_operation(command):
+    """
+    Run the leapp command and return the OutputSpool holding its output.
+    """
     new_env = {}
     for key, value in os.environ.items():
         valid_prefix = "RHC_WORKER_"
@@ -416,40 +1683,369 @@ def execute_operation(command):
             new_env[key] = value
 
     logger.info("Executing %s ...", SCRIPT_TYPE.title())
-    output, _ = run_subprocess(command, env=new_env)
+    spool = OutputSpool(os.path.join(LOG_DIR, OUTPUT_SPOOL_FILENAME))
+    run_subprocess(
+        command,
+        env=new_env,
+        spool=spool,
+        matcher=_get_leapp_output_matcher(),
+        phase="execute",
+    )
 
-    return output
+    return spool
 
 
-def _find_highest_report_level(entries):
+class JsonReportReader(object):
     """
-    Gather status codes from entries.
+    Incremental reader of the leapp JSON report.
+
+    Iterating over the reader yields the report entries one at a time, so
+    only the entry being decoded and a read buffer are held in memory. The
+    other top-level values of the report are collected in `metadata`.
     """
-    logger.info("Collecting and combining report status.")
-    action_level_combined = [value["severity"] for value in entries]
 
-    valid_action_levels = [
-        level for level in action_level_combined if level in STATUS_CODE
-    ]
-    valid_action_levels.sort(key=lambda status: STATUS_CODE[status], reverse=True)
-    return STATUS_CODE_NAME_MAP[valid_action_levels[0]]
+    WHITESPACE = " \t\r\n"
+    # Characters continuing a JSON number, e.g. "0" read before ".25".
+    NUMBER_CHARS = "0123456789.eE+-"
+
+    def __init__(self, handler, chunk_size=None):
+        self.handler = handler
+        self.chunk_size = chunk_size or REPORT_READ_CHUNK_SIZE
+        self.metadata = {}
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """
+        Drop the consumed part of the buffer and read the next chunk. The
+        read size grows with the pending data so that a large value is
+        decoded in a logarithmic number of attempts.
+        """
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+        chunk = self.handler.read(max(self.chunk_size, len(self._buffer)))
+        if chunk:
+            self._buffer += chunk
+        else:
+            self._eof = True
+
+    def _peek(self):
+        """Skip whitespace and return the next character, "" at the end."""
+        while True:
+            while (
+                self._pos < len(self._buffer)
+                and self._buffer[self._pos] in self.WHITESPACE
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                break
+            self._fill()
+        return self._buffer[self._pos : self._pos + 1]
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError(
+                "Invalid JSON report: expected one of '%s', got '%s'" % (chars, char)
+            )
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+            # A number at the end of the buffer might continue in the next chunk
+            if not self._eof and (
+                end == len(self._buffer) or self._continues_number(value, end)
+            ):
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def _continues_number(self, value, end):
+        """Whether the number value decoded up to end is cut short."""
+        return (
+            isinstance(value, numbers.Number)
+            and not isinstance(value, bool)
+            and self._buffer[end] in self.NUMBER_CHARS
+        )
+
+    def _iter_array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(",]") == "]":
+                return
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(":")
+            if key == "entries":
+                for entry in self._iter_array():
+                    yield entry
+            else:
+                self.metadata[key] = self._decode_value()
+            if self._expect(",}") == "}":
+                return
 
 
-def parse_results(output, reboot_required=False):
-    logger.info("Processing %s results ...", SCRIPT_TYPE.title())
+class ReportSummary(object):
+    """
+    Aggregation of the report entries computed in a single pass: severity
+    histogram, per-group counts, the highest severity and the error and
+    inhibitor totals.
+    """
 
-    report_json = "Not found"
-    message = "Can't open json report at " + JSON_REPORT_PATH
-    alert = True
-    status = "ERROR"
+    def __init__(self):
+        self.total = 0
+        self.severities = dict((severity, 0) for severity in STATUS_CODE)
+        self.groups = {}
+        self.highest_severity = None
+
+    def add(self, entry):
+        self.total += 1
+        severity = entry.get("severity")
+        if severity in STATUS_CODE:
+            self.severities[severity] += 1
+            if (
+                self.highest_severity is None
+                or STATUS_CODE[severity] > STATUS_CODE[self.highest_severity]
+            ):
+                self.highest_severity = severity
+        for group in set(entry.get("groups") or []):
+            self.groups[group] = self.groups.get(group, 0) + 1
+
+    @property
+    def error_count(self):
+        return self.groups.get("error", 0)
+
+    @property
+    def inhibitor_count(self):
+        return self.groups.get("inhibitor", 0)
+
+    @property
+    def highest_level(self):
+        """Status name of the highest severity, None if no severity is known"""
+        return STATUS_CODE_NAME_MAP.get(self.highest_severity)
 
-    logger.info("Reading JSON report")
-    if os.path.exists(JSON_REPORT_PATH):
-        with open(JSON_REPORT_PATH, mode="r") as handler:
-            report_json = json.load(handler)
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "severities": self.severities,
+            "groups": self.groups,
+            "errors": self.error_count,
+            "inhibitors": self.inhibitor_count,
+            "highest_severity": self.highest_severity,
+        }
+
+
+class ReportEntrySelector(object):
+    """
+    Selection of the report entries sent in report_json. Entries below the
+    minimum severity are dropped, only the requested fields of the remaining
+    entries are kept and, if capped, only the most severe entries are kept in
+    the order of the report.
+    """
+
+    # Fields of the entries mapped to the entry positions in the index.
+    INDEX_FIELDS = ("groups", "severity", "actor")
+
+    def __init__(self, fields=None, min_severity=None, max_entries=0, index=False):
+        self.fields = fields
+        self.min_code = STATUS_CODE.get(min_severity)
+        self.max_entries = max_entries
+        self.with_index = index
+        self.total = 0
+        # Heap of (severity code, -position, entry, index keys), the least
+        # severe and latest entry is dropped first when the cap is exceeded.
+        self._selected = []
+
+    def add(self, entry):
+        position = self.total
+        self.total += 1
+        code = STATUS_CODE.get(entry.get("severity"), -1)
+        if self.min_code is not None and code < self.min_code:
+            return
+
+        # The index keys are taken before the projection, so that the index
+        # covers fields that are not sent.
+        keys = self._get_index_keys(entry) if self.with_index else ()
+        if self.fields:
+            entry = dict(
+                (field, entry[field]) for field in self.fields if field in entry
+            )
+        item = (code, -position, entry, keys)
+        if not self.max_entries:
+            self._selected.append(item)
+        elif len(self._selected) < self.max_entries:
+            heapq.heappush(self._selected, item)
+        else:
+            heapq.heappushpop(self._selected, item)
+
+    def _get_index_keys(self, entry):
+        keys = []
+        for field in self.INDEX_FIELDS:
+            values = entry.get(field)
+            if values is None:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            keys.extend((field, value) for value in set(values))
+        return keys
+
+    def _get_ordered(self):
+        if not self.max_entries:
+            return self._selected
+        return sorted(self._selected, key=lambda item: item[1], reverse=True)
+
+    @property
+    def entries(self):
+        return [item[2] for item in self._get_ordered()]
+
+    def get_index(self):
+        """
+        Map each group, severity and actor of the selected entries to the
+        positions of the entries in the entries list.
+        """
+        index = dict((field, {}) for field in self.INDEX_FIELDS)
+        for position, item in enumerate(self._get_ordered()):
+            for field, value in item[3]:
+                index[field].setdefault(value, []).append(position)
+        return index
+
+    @property
+    def omitted_count(self):
+        return self.total - len(self._selected)
+
+
+class ReportDelta(object):
+    """
+    Changes of the report entries against the entries of the last run. Each
+    entry is identified by its leapp key, or by its digest if it has none,
+    and compared by the digest of its content.
+    """
+
+    # Fields that differ between runs even if the entry didn't change.
+    IGNORED_FIELDS = ("id", "timeStamp")
+
+    def __init__(self, previous=None, enabled=False):
+        # Stored data of the last run, {"time": ..., "entries": {key: digest}}
+        self.previous = previous
+        self.enabled = enabled
+        # Digest, severity and title of the entries by key
+        self.entries = {}
+        self.added = []
+        self.changed = []
+        self.unchanged_count = 0
+        self.complete = False
+
+    @property
+    def digests(self):
+        return dict((key, entry[0]) for key, entry in self.entries.items())
+
+    @property
+    def previous_digests(self):
+        if not self.previous:
+            return None
+        return self.previous.get("entries")
+
+    @classmethod
+    def get_entry_digest(cls, entry):
+        content = dict(
+            (field, value)
+            for field, value in entry.items()
+            if field not in cls.IGNORED_FIELDS
+        )
+        serialized = json.dumps(content, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(serialized).hexdigest()[:16]
+
+    def add(self, entry):
+        """Record the entry and return True if it has to be sent."""
+        digest = self.get_entry_digest(entry)
+        key = entry.get("key") or digest
+        self.entries[key] = (digest, entry.get("severity"), entry.get("title"))
+
+        previous_digests = self.previous_digests
+        if previous_digests is None:
+            return True
+        if key not in previous_digests:
+            self.added.append(key)
+        elif previous_digests[key] != digest:
+            self.changed.append(key)
+        else:
+            self.unchanged_count += 1
+            return not self.enabled
+        return True
+
+    def to_dict(self):
+        previous_digests = self.previous_digests
+        if previous_digests is None:
+            return {"base": None}
+        return {
+            "base": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(self.previous["time"])),
+            "added": self.added,
+            "changed": self.changed,
+            "removed": sorted(set(previous_digests) - set(self.digests)),
+            "unchanged": self.unchanged_count,
+        }
+
+
+def load_entry_digests():
+    """Return the stored entry digests of the last run or None."""
+    path = os.path.join(LOG_DIR, ENTRY_DIGESTS_FILENAME)
+    try:
+        with open(path, "r") as handler:
+            data = json.load(handler)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("entries"), dict):
+        return None
+    return data
+
+
+def save_entry_digests(delta):
+    """Store the entry digests of this run if the report was read."""
+    if not delta.complete:
+        return
+    path = os.path.join(LOG_DIR, ENTRY_DIGESTS_FILENAME)
+    data = {"time": time.time(), "entries": delta.digests}
+    try:
+        with open(path + ".tmp", "w") as handler:
+            json.dump(data, handler)
+        os.rename(path + ".tmp", path)
+    except (IOError, OSError) as err:
+        logger.warning("Couldn't store the report entry digests: %s", err)
 
-        report_entries = report_json.get("entries", [])
-        for entry in report_entries:
+
+def _read_json_report(delta=None):
+    """
+    Read the leapp JSON report and return its report_json with the selected
+    entries, the summary, the index and the delta, and the ReportSummary.
+    """
+    selector = ReportEntrySelector(
+        REPORT_FIELDS, REPORT_MIN_SEVERITY, REPORT_MAX_ENTRIES, REPORT_INDEX
+    )
+    summary = ReportSummary()
+    with open(JSON_REPORT_PATH, mode="r") as handler:
+        reader = JsonReportReader(handler)
+        for entry in reader:
             groups = entry.get("groups", [])
             # NOTE: "severity" key in report is connected to tasks-frontend severity maps
             # Every change must come with change to severity maps otherwise UI will throw sentry errors
@@ -457,17 +2053,46 @@ def parse_results(output, reboot_required=False):
                 entry["severity"] = "inhibitor"
             elif "inhibitor" in groups:
                 entry["severity"] = "inhibitor"
+            summary.add(entry)
+            if delta is None or delta.add(entry):
+                selector.add(entry)
 
-        total_problems_count = len(report_entries)
-        error_count = len(
-            [entry for entry in report_entries if "error" in entry.get("groups")]
-        )
-        inhibitor_count = len(
-            [entry for entry in report_entries if "inhibitor" in entry.get("groups")]
+    logger.info("Collecting and combining report status.")
+    report_json = reader.metadata
+    report_json["entries"] = selector.entries
+    report_json["summary"] = summary.to_dict()
+    if REPORT_INDEX:
+        report_json["index"] = selector.get_index()
+    if delta is not None:
+        delta.complete = True
+        if delta.enabled:
+            report_json["delta"] = delta.to_dict()
+    if selector.omitted_count:
+        logger.info(
+            "Omitting %s of %s report entries.",
+            selector.omitted_count,
+            selector.total,
         )
+        report_json["omitted_entries"] = selector.omitted_count
+    return report_json, summary
+
+
+def parse_results(output, reboot_required=False, delta=None):
+    logger.info("Processing %s results ...", SCRIPT_TYPE.title())
+
+    report_json = "Not found"
+    message = "Can't open json report at " + JSON_REPORT_PATH
+    alert = True
+    status = "ERROR"
+
+    logger.info("Reading JSON report")
+    if os.path.exists(JSON_REPORT_PATH):
+        report_json, summary = _read_json_report(delta)
+        inhibitor_count = summary.inhibitor_count
+        error_count = summary.error_count
 
         if inhibitor_count == 0 and error_count == 0:
-            if total_problems_count == 0:
+            if summary.total == 0:
                 message = "No problems found. The system is ready for upgrade."
             else:
                 message = "The upgrade can proceed. However, there is one or more warnings about issues that might occur after the upgrade."
@@ -478,8 +2103,8 @@ def parse_results(output, reboot_required=False):
                 % (
                     inhibitor_count + error_count,
                     "" if inhibitor_count + error_count == 1 else "s",
-                    len(report_entries),
-                    "" if len(report_entries) == 1 else "s",
+                    summary.total,
+                    "" if summary.total == 1 else "s",
                 )
             )
 
@@ -489,11 +2114,7 @@ def parse_results(output, reboot_required=False):
                 "After reboot check inventory to verify the system is registered with new RHEL major version."
             )
         alert = inhibitor_count > 0 or error_count > 0
-        status = (
-            _find_highest_report_level(report_entries)
-            if len(report_entries) > 0
-            else "SUCCESS"
-        )
+        status = summary.highest_level or "SUCCESS"
 
     output.status = status
     output.report_json = report_json
@@ -503,16 +2124,339 @@ def parse_results(output, reboot_required=False):
     logger.info("Reading TXT report")
     report_txt = "Not found"
     if os.path.exists(TXT_REPORT_PATH):
-        with open(TXT_REPORT_PATH, mode="r") as handler:
-            report_txt = handler.read()
+        report_txt = read_text_report(TXT_REPORT_PATH, REPORT_TXT_MAX_BYTES)
 
     output.report = report_txt
 
 
+def read_text_report(path, max_bytes=0):
+    """
+    Read the text report in chunks. Reports larger than max_bytes keep only a
+    head and a tail window of half of max_bytes each, joined by a marker with
+    the original size and sha256 checksum of the report.
+    """
+    head_size = max_bytes // 2
+    tail_size = max_bytes - head_size
+    chunks = []
+    head = b""
+    # Chunks of the tail window, trimmed as whole chunks to keep it cheap
+    tail_chunks = collections.deque()
+    tail_length = 0
+    size = 0
+    checksum = hashlib.sha256()
+    with open(path, mode="rb") as handler:
+        while True:
+            chunk = handler.read(REPORT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            checksum.update(chunk)
+            if not max_bytes:
+                chunks.append(chunk)
+                continue
+            if len(head) < head_size:
+                missing = head_size - len(head)
+                head, chunk = head + chunk[:missing], chunk[missing:]
+            tail_chunks.append(chunk)
+            tail_length += len(chunk)
+            while tail_length - len(tail_chunks[0]) >= tail_size:
+                tail_length -= len(tail_chunks.popleft())
+
+    if not max_bytes:
+        return b"".join(chunks).decode("utf-8", "replace")
+    tail = b"".join(tail_chunks)[-tail_size:]
+    if size <= max_bytes:
+        return (head + tail).decode("utf-8", "replace")
+
+    logger.warning(
+        "The TXT report has %s bytes, sending only its first %s and last %s bytes.",
+        size,
+        head_size,
+        tail_size,
+    )
+    marker = (
+        "\n\n[... %s bytes of the report omitted, the original report has %s bytes "
+        "and sha256 %s ...]\n\n" % (size - max_bytes, size, checksum.hexdigest())
+    )
+    return head.decode("utf-8", "replace") + marker + tail.decode("utf-8", "replace")
+
+
+def _get_files_digest(paths):
+    """Return the sha256 checksum of the names and contents of the files."""
+    checksum = hashlib.sha256()
+    for path in sorted(paths):
+        checksum.update(path.encode("utf-8") + b"\0")
+        try:
+            with open(path, "rb") as handler:
+                checksum.update(handler.read())
+        except IOError:
+            checksum.update(b"\0missing")
+        checksum.update(b"\0")
+    return checksum.hexdigest()
+
+
+def _get_dir_listing(path):
+    """
+    Return the sorted relative paths, sizes and modification times of the
+    files under path, e.g. the leapp data files downloaded to fix an
+    inhibitor.
+    """
+    listing = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            listing.append(
+                [os.path.relpath(file_path, path), stat.st_size, stat.st_mtime]
+            )
+    return sorted(listing)
+
+
+def _get_loaded_modules():
+    """Return the sorted names of the loaded kernel modules."""
+    try:
+        with open(PROC_MODULES_PATH, "r") as handler:
+            return sorted(line.split(" ", 1)[0] for line in handler if line.strip())
+    except IOError:
+        return []
+
+
+def _get_boot_id():
+    try:
+        with open(BOOT_ID_PATH, "r") as handler:
+            return handler.read().strip()
+    except IOError:
+        return None
+
+
+def get_system_fingerprint():
+    """
+    Return a fingerprint of the system state the leapp analysis depends on:
+    the rpmdb modification time, the installed leapp-upgrade package, the yum
+    repositories, the OS release, the leapp answers and the configuration in
+    FINGERPRINT_FILES, the leapp data files, the boot and the loaded kernel
+    modules and the content_vars affecting the result.
+    """
+    try:
+        repo_paths = [
+            os.path.join(YUM_REPOS_DIR, name)
+            for name in os.listdir(YUM_REPOS_DIR)
+            if name.endswith(".repo")
+        ]
+    except OSError:
+        repo_paths = []
+
+    content_vars = sorted(
+        (key, value)
+        for key, value in os.environ.items()
+        if key.startswith("RHC_WORKER_LEAPP_")
+        and key[len("RHC_WORKER_") :] not in FINGERPRINT_IGNORED_CONTENT_VARS
+    )
+    state = [
+        ["rpmdb_mtime", PackageIndex.get_rpmdb_mtime()],
+        ["leapp-upgrade", package_index.get("leapp-upgrade")],
+        ["repos", _get_files_digest(repo_paths)],
+        ["os-release", _get_files_digest([OS_RELEASE_PATH])],
+        ["files", _get_files_digest(FINGERPRINT_FILES)],
+        ["leapp_files", _get_dir_listing(LEAPP_FILES_DIR)],
+        ["boot_id", _get_boot_id()],
+        ["modules", _get_loaded_modules()],
+        ["content_vars", content_vars],
+    ]
+    return hashlib.sha256(json.dumps(state).encode("utf-8")).hexdigest()
+
+
+def save_preupgrade_result(output, fingerprint):
+    """Store the result of the pre-upgrade analysis with the fingerprint."""
+    path = os.path.join(LOG_DIR, PREUPGRADE_RESULT_FILENAME)
+    data = {
+        "fingerprint": fingerprint,
+        "time": time.time(),
+        "output": output.to_dict(report_format="default"),
+    }
+    try:
+        # Write to a temporary file first so that a concurrent reader never
+        # sees a partially written result.
+        with open(path + ".tmp", "w") as handler:
+            json.dump(data, handler)
+        os.rename(path + ".tmp", path)
+    except (IOError, OSError) as err:
+        logger.warning("Couldn't store the pre-upgrade result: %s", err)
+
+
+def load_preupgrade_result():
+    """Return the stored pre-upgrade result or None if there is none."""
+    path = os.path.join(LOG_DIR, PREUPGRADE_RESULT_FILENAME)
+    try:
+        with open(path, "r") as handler:
+            data = json.load(handler)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("output"), dict):
+        return None
+    return data
+
+
+def _restore_preupgrade_result(data):
+    """
+    Return the stored pre-upgrade result as OutputCollector marked as cached
+    and the time it was created at.
+    """
+    output = OutputCollector.from_dict(data["output"])
+    created_time = strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(data.get("time", 0)))
+    if isinstance(output.report_json, dict):
+        output.report_json["cached"] = {
+            "time": created_time,
+            "fingerprint": data.get("fingerprint"),
+        }
+    return output, created_time
+
+
+def get_cached_result(fingerprint, ttl):
+    """
+    Return the stored pre-upgrade result as OutputCollector if it was
+    computed for the same fingerprint less than ttl seconds ago, None
+    otherwise. The returned output is marked as cached.
+    """
+    data = load_preupgrade_result()
+    if not data:
+        return None
+    if data.get("fingerprint") != fingerprint:
+        logger.info("The system changed since the stored pre-upgrade result.")
+        return None
+    if not 0 <= time.time() - data.get("time", 0) <= ttl:
+        logger.info("The stored pre-upgrade result is older than %s seconds.", ttl)
+        return None
+
+    output, created_time = _restore_preupgrade_result(data)
+    output.message = "Cached result of the analysis from %s. %s" % (
+        created_time,
+        output.message,
+    )
+    return output
+
+
+def _count_inhibitors(report_json):
+    """Count the inhibitors and errors of a stored report_json."""
+    if not isinstance(report_json, dict):
+        return 0
+    summary = report_json.get("summary")
+    if isinstance(summary, dict):
+        return summary.get("inhibitors", 0) + summary.get("errors", 0)
+    return sum(
+        1
+        for entry in report_json.get("entries") or []
+        if isinstance(entry, dict)
+        and set(entry.get("groups") or []) & set(["inhibitor", "error"])
+    )
+
+
+def get_inhibited_preupgrade_result(fingerprint, max_age=0):
+    """
+    Return an ERROR result with the entries of the stored pre-upgrade result
+    if it was computed for the same fingerprint less than max_age seconds ago,
+    0 meaning no limit, and reported inhibitors, None otherwise.
+    """
+    data = load_preupgrade_result()
+    if not data or data.get("fingerprint") != fingerprint:
+        return None
+    if max_age and not 0 <= time.time() - data.get("time", 0) <= max_age:
+        logger.info("The stored pre-upgrade result is older than %s seconds.", max_age)
+        return None
+    inhibitor_count = _count_inhibitors(data["output"].get("report_json"))
+    if not inhibitor_count:
+        return None
+
+    output, created_time = _restore_preupgrade_result(data)
+    output.status = "ERROR"
+    output.alert = True
+    output.message = (
+        "The upgrade cannot proceed. The pre-upgrade analysis from %s found "
+        "%s inhibitor%s and no tracked change of the system was detected "
+        "since. Resolve the inhibitor%s and run the pre-upgrade analysis "
+        "again, or set the LEAPP_IGNORE_PREUPGRADE_RESULT content_var to true "
+        "to run the upgrade anyway."
+        % (
+            created_time,
+            inhibitor_count,
+            "" if inhibitor_count == 1 else "s",
+            "" if inhibitor_count == 1 else "s",
+        )
+    )
+    return output
+
+
+def execute_phase(command):
+    """
+    Run the leapp command on fresh reports. Returns True if the system has to
+    be rebooted to continue the upgrade.
+    """
+    with run_record.phase("execute"):
+        remove_previous_reports()
+        leapp_output = execute_operation(command)
+    return REBOOT_GUIDANCE_MESSAGE in leapp_output
+
+
+def parse_phase(output, reboot_required, previous_digests):
+    """
+    Collect the results of the leapp reports in the output, comparing the
+    entries with the previous entry digests. Returns the ReportDelta to be
+    saved once the output is the one emitted.
+    """
+    with run_record.phase("parse"):
+        delta = ReportDelta(previous_digests, REPORT_DELTA)
+        parse_results(output, reboot_required, delta)
+    run_record.delta = delta
+    return delta
+
+
+def run_preupgrade_then_upgrade(output, preupgrade_command, upgrade_command):
+    """
+    Run the pre-upgrade analysis and, if it found no inhibitors or errors,
+    the upgrade with the same setup. The output holds the result of the
+    upgrade with the outcome of the analysis in report_json, or the result of
+    the analysis if the upgrade didn't start. Returns True if the system has
+    to be rebooted to continue the upgrade.
+    """
+    # Both reports are compared with the last emitted result, only the
+    # digests of the result emitted now are saved.
+    previous_digests = load_entry_digests()
+    delta = parse_phase(output, execute_phase(preupgrade_command), previous_digests)
+    save_preupgrade_result(output, get_system_fingerprint())
+    if output.alert:
+        logger.info("The pre-upgrade analysis didn't pass, skipping the upgrade.")
+        save_entry_digests(delta)
+        return False
+
+    preupgrade = {"status": output.status, "message": output.message}
+    if isinstance(output.report_json, dict) and "summary" in output.report_json:
+        preupgrade["summary"] = output.report_json["summary"]
+
+    logger.info("The pre-upgrade analysis passed, continuing with the upgrade.")
+    reboot_required = execute_phase(upgrade_command)
+    save_entry_digests(parse_phase(output, reboot_required, previous_digests))
+    if isinstance(output.report_json, dict):
+        output.report_json["preupgrade"] = preupgrade
+    return reboot_required
+
+
 def update_insights_inventory(output):
     """Call insights-client to update insights inventory."""
     logger.info("Updating system status in Red Hat Insights.")
-    _, returncode = run_subprocess(cmd=["/usr/bin/insights-client"])
+    try:
+        _, returncode = run_subprocess(
+            cmd=["/usr/bin/insights-client"], phase="inventory"
+        )
+    except ProcessTimeoutError as exception:
+        # The inventory update is optional, a timeout keeps the result of the
+        # operation like a failure of insights-client.
+        logger.info(exception.report)
+        output.message += " Failed to update Insights Inventory."
+        output.alert = True
+        return
 
     if returncode:
         logger.info("System registration failed with exit code %s.", returncode)
@@ -528,16 +2472,667 @@ def reboot_system():
     run_subprocess(["/usr/sbin/shutdown", "-r", "1"], wait=False)
 
 
+class RunLock(object):
+    """
+    Host-wide lock serializing the runs of the script. A run of the same
+    operation waits for the lock holder and reuses its result, a conflicting
+    operation fails right away.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = None
+        self._handler = None
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as handler:
+                data = json.load(handler)
+        except (IOError, OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _read_holder(self):
+        """
+        Return the record of the run holding the lock. None if the lock file
+        still has the record of a finished or killed run, e.g. before the new
+        holder wrote its own.
+        """
+        data = self._read()
+        if not data or "output" in data or not self._is_running(data.get("pid")):
+            return None
+        return data
+
+    @staticmethod
+    def _is_running(pid):
+        if not isinstance(pid, int):
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as err:
+            return err.errno == errno.EPERM
+        return True
+
+    def _write(self, data):
+        content = json.dumps(data)
+        self._handler.seek(0)
+        self._handler.truncate()
+        self._handler.write(content)
+        self._handler.flush()
+
+    def _try_lock(self):
+        try:
+            fcntl.flock(self._handler.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def acquire(self, timeout):
+        """
+        Acquire the lock, waiting at most timeout seconds for the concurrent
+        run of the same operation. Returns the result of that run as
+        OutputCollector if it finished meanwhile, None otherwise.
+        """
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self._handler = open(self.path, "a+")
+
+        holder = None
+        deadline = time.time() + timeout
+        while not self._try_lock():
+            data = self._read_holder()
+            if data and data.get("script_type") != SCRIPT_TYPE:
+                self.release()
+                raise ProcessError(
+                    message="Another operation %s is running on the system."
+                    % data.get("script_type"),
+                    report="Exiting because the %s operation started at %s by "
+                    "the process %s is running."
+                    % (data.get("script_type"), data.get("started"), data.get("pid")),
+                )
+            if data:
+                holder = data
+            if time.time() >= deadline:
+                self.release()
+                raise ProcessError(
+                    message="The concurrent %s operation didn't finish in time."
+                    % SCRIPT_TYPE.title(),
+                    report="Exiting because the lock %s wasn't released in %s "
+                    "seconds." % (self.path, timeout),
+                )
+            time.sleep(RUN_LOCK_POLL_INTERVAL)
+
+        result = self._get_coalesced_result(holder)
+        if result:
+            # The record of the holder stays in the lock file, so that the
+            # other invocations waiting for it reuse its result as well.
+            return result
+
+        self.owner = {
+            "pid": os.getpid(),
+            "script_type": SCRIPT_TYPE,
+            "started": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime()),
+        }
+        self._write(self.owner)
+        return None
+
+    def _get_coalesced_result(self, holder):
+        """
+        Return the result left in the lock file by the run the invocation
+        waited for as OutputCollector, None if that run didn't leave any.
+        """
+        data = self._read()
+        if not (
+            holder
+            and data
+            and data.get("pid") == holder.get("pid")
+            and data.get("started") == holder.get("started")
+            and isinstance(data.get("output"), dict)
+        ):
+            return None
+        result = OutputCollector.from_dict(data["output"])
+        result.message = "Result of the concurrent run started at %s. %s" % (
+            data["started"],
+            result.message,
+        )
+        if isinstance(result.report_json, dict):
+            result.report_json["coalesced"] = {
+                "time": data["started"],
+                "pid": data["pid"],
+            }
+        return result
+
+    def save_result(self, output):
+        """Leave the result of the run to the invocations waiting for it."""
+        if self._handler is None:
+            return
+        data = dict(self.owner, output=output.to_dict(report_format="default"))
+        try:
+            self._write(data)
+        except (IOError, OSError, TypeError, ValueError) as err:
+            logger.warning("Couldn't store the result in the lock file: %s", err)
+
+    def release(self):
+        if self._handler is None:
+            return
+        self._handler.close()
+        self._handler = None
+
+
+class PhaseCheckpoints(object):
+    """
+    Checkpoints of the phases completed by the run, stored with the data the
+    later phases need and the fingerprint of the system after the phase. The
+    checkpoints are disabled if path is None.
+    """
+
+    def __init__(self, path=None, phases=None):
+        self.path = path
+        self.phases = phases or {}
+
+    @classmethod
+    def load(cls, path, fingerprint, max_age):
+        """
+        Return the checkpoints stored at path if they were recorded for the
+        same script type and system fingerprint less than max_age seconds
+        ago, empty checkpoints otherwise.
+        """
+        try:
+            with open(path, "r") as handler:
+                data = json.load(handler)
+        except (IOError, OSError, ValueError):
+            return cls(path)
+        if (
+            not isinstance(data, dict)
+            or data.get("script_type") != SCRIPT_TYPE
+            or data.get("fingerprint") != fingerprint
+            or not 0 <= time.time() - data.get("time", 0) <= max_age
+            or not isinstance(data.get("phases"), dict)
+        ):
+            logger.info("Not resuming the previous run, the system changed.")
+            return cls(path)
+
+        if data["phases"]:
+            logger.info(
+                "Resuming the previous run, skipping the completed %s phases.",
+                ", ".join(sorted(data["phases"])),
+            )
+        return cls(path, data["phases"])
+
+    def done(self, name):
+        return name in self.phases
+
+    def get(self, name):
+        return self.phases[name]
+
+    def complete(self, name, data=None):
+        """Record the phase as completed with the data for the later phases."""
+        if self.path is None:
+            return
+        self.phases[name] = data
+        checkpoint = {
+            "script_type": SCRIPT_TYPE,
+            "fingerprint": get_system_fingerprint(),
+            "time": time.time(),
+            "phases": self.phases,
+        }
+        try:
+            data = json.dumps(checkpoint)
+            with open(self.path + ".tmp", "w") as handler:
+                handler.write(data)
+            os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError, TypeError, ValueError) as err:
+            logger.warning("Couldn't store the %s phase checkpoint: %s", name, err)
+
+    def clear(self):
+        """Remove the checkpoints once the run finished."""
+        if self.path is None:
+            return
+        self.phases = {}
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def load_checkpoints(fingerprint):
+    """Return the checkpoints of the run, disabled in the combined mode."""
+    if IS_PREUPGRADE_THEN_UPGRADE:
+        return PhaseCheckpoints()
+    path = os.path.join(LOG_DIR, CHECKPOINTS_FILENAME)
+    if not RESUME_FROM_CHECKPOINTS:
+        return PhaseCheckpoints(path)
+    return PhaseCheckpoints.load(path, fingerprint, CHECKPOINTS_MAX_AGE)
+
+
+class RunHistory(object):
+    """History of the runs of the script in a sqlite database."""
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            script_type TEXT,
+            started REAL,
+            finished REAL,
+            status TEXT,
+            message TEXT,
+            summary TEXT,
+            timings TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS run_entries (
+            run_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            digest TEXT,
+            severity TEXT,
+            title TEXT,
+            PRIMARY KEY (run_id, key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS run_entries_key ON run_entries (key, run_id)",
+    ]
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, record, output, retention):
+        """Store the run and drop the runs beyond the retention."""
+        summary = None
+        if isinstance(output.report_json, dict):
+            summary = output.report_json.get("summary")
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (script_type, started, finished, status, "
+                "message, summary, timings) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    SCRIPT_TYPE,
+                    record.started,
+                    time.time(),
+                    output.status,
+                    output.message,
+                    json.dumps(summary),
+                    json.dumps(record.timings),
+                ),
+            )
+            run_id = cursor.lastrowid
+            if record.delta is not None:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO run_entries (run_id, key, digest, "
+                    "severity, title) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (run_id, key) + entry
+                        for key, entry in record.delta.entries.items()
+                    ),
+                )
+            self.connection.execute(
+                "DELETE FROM runs WHERE id <= ?", (run_id - retention,)
+            )
+            self.connection.execute(
+                "DELETE FROM run_entries WHERE run_id <= ?", (run_id - retention,)
+            )
+        return run_id
+
+    def list_runs(self, limit):
+        return self.connection.execute(
+            "SELECT id, script_type, started, finished, status, summary "
+            "FROM runs ORDER BY id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def diff_runs(self, old_run, new_run):
+        """Return the added, removed and changed entries between two runs."""
+        added = self.connection.execute(
+            "SELECT new.key, new.severity, new.title FROM run_entries new "
+            "LEFT JOIN run_entries old ON old.run_id = ? AND old.key = new.key "
+            "WHERE new.run_id = ? AND old.key IS NULL ORDER BY new.key",
+            (old_run, new_run),
+        ).fetchall()
+        removed = self.connection.execute(
+            "SELECT old.key, old.severity, old.title FROM run_entries old "
+            "LEFT JOIN run_entries new ON new.run_id = ? AND new.key = old.key "
+            "WHERE old.run_id = ? AND new.key IS NULL ORDER BY old.key",
+            (new_run, old_run),
+        ).fetchall()
+        changed = self.connection.execute(
+            "SELECT new.key, new.severity, new.title FROM run_entries new "
+            "JOIN run_entries old ON old.run_id = ? AND old.key = new.key "
+            "WHERE new.run_id = ? AND old.digest != new.digest ORDER BY new.key",
+            (old_run, new_run),
+        ).fetchall()
+        return added, removed, changed
+
+    def entry_history(self, key):
+        """Return the runs that reported the entry, oldest first."""
+        return self.connection.execute(
+            "SELECT runs.id, runs.script_type, runs.started, run_entries.digest, "
+            "run_entries.severity, run_entries.title FROM run_entries "
+            "JOIN runs ON runs.id = run_entries.run_id "
+            "WHERE run_entries.key = ? ORDER BY runs.id",
+            (key,),
+        ).fetchall()
+
+
+def record_run_history(output):
+    """Store the run in the history database, failures are only logged."""
+    if HISTORY_RETENTION <= 0:
+        return
+    try:
+        history = RunHistory(os.path.join(LOG_DIR, HISTORY_DB_FILENAME))
+        try:
+            history.record(run_record, output, HISTORY_RETENTION)
+        finally:
+            history.close()
+    except (sqlite3.Error, OSError) as err:
+        logger.warning("Couldn't record the run in the history: %s", err)
+
+
+def _format_time(timestamp):
+    return strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(timestamp))
+
+
+def _print_runs(history, args):
+    for run_id, script_type, started, finished, status, summary in history.list_runs(
+        args.limit
+    ):
+        summary = json.loads(summary) if summary else None
+        if summary:
+            report = "%s inhibitors, %s entries" % (
+                summary["inhibitors"] + summary["errors"],
+                summary["total"],
+            )
+        else:
+            report = "no report"
+        print(
+            "%s\t%s\t%s\t%s\t%ss\t%s"
+            % (
+                run_id,
+                _format_time(started),
+                script_type,
+                status,
+                int(finished - started),
+                report,
+            )
+        )
+
+
+def _print_diff(history, args):
+    added, removed, changed = history.diff_runs(args.old_run, args.new_run)
+    for prefix, entries in (("+", added), ("-", removed), ("~", changed)):
+        for key, severity, title in entries:
+            print("%s %s\t%s\t%s" % (prefix, key, severity, title))
+
+
+def _print_entry(history, args):
+    previous_digest = None
+    for run_id, script_type, started, digest, severity, title in history.entry_history(
+        args.key
+    ):
+        if previous_digest is None:
+            change = "reported"
+        elif digest != previous_digest:
+            change = "changed"
+        else:
+            change = "unchanged"
+        previous_digest = digest
+        print(
+            "%s\t%s\t%s\t%s\t%s\t%s"
+            % (run_id, _format_time(started), script_type, change, severity, title)
+        )
+
+
+def history_main(argv=None):
+    """Query the history of the runs stored on this host."""
+    parser = argparse.ArgumentParser(
+        prog="leapp_script.py history",
+        description="Query the history of the leapp runs stored on this host.",
+    )
+    subparsers = parser.add_subparsers(dest="query")
+    # Optional by default on Python 3
+    subparsers.required = True
+    runs_parser = subparsers.add_parser("runs", help="list the latest runs")
+    runs_parser.add_argument("--limit", type=int, default=20)
+    runs_parser.set_defaults(func=_print_runs)
+    diff_parser = subparsers.add_parser(
+        "diff", help="show the entries added, removed and changed between two runs"
+    )
+    diff_parser.add_argument("old_run", type=int)
+    diff_parser.add_argument("new_run", type=int)
+    diff_parser.set_defaults(func=_print_diff)
+    entry_parser = subparsers.add_parser(
+        "entry", help="show the runs that reported an entry"
+    )
+    entry_parser.add_argument("key")
+    entry_parser.set_defaults(func=_print_entry)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(LOG_DIR, HISTORY_DB_FILENAME)
+    if not os.path.exists(path):
+        print("No history recorded in %s." % path)
+        return 1
+
+    history = RunHistory(path)
+    try:
+        args.func(history, args)
+    finally:
+        history.close()
+    return 0
+
+
 def main():
     """Main entrypoint for the script."""
+    time_budget.start()
+    run_lock = RunLock(os.path.join(LOG_DIR, RUN_LOCK_FILENAME))
+    lock_timeout = RUN_LOCK_TIMEOUT
+    if time_budget.remaining() is not None:
+        lock_timeout = min(lock_timeout, int(time_budget.remaining()))
+    try:
+        coalesced_output = run_lock.acquire(lock_timeout)
+    except ProcessError as exception:
+        print_output(
+            OutputCollector(
+                status="ERROR",
+                alert=True,
+                error=False,
+                message=exception.message,
+                report=exception.report,
+            )
+        )
+        return
+    try:
+        if coalesced_output:
+            print_output(coalesced_output)
+        else:
+            run(run_lock)
+    finally:
+        run_lock.release()
+
+
+class RunState(object):
+    """State of the operation passed between the phases of the run"""
+
+    def __init__(self, version):
+        self.version = version
+        self.output = OutputCollector()
+        self.commands = {
+            "preupgrade": ["/usr/bin/leapp", "preupgrade", "--report-schema=1.2.0"],
+            "upgrade": ["/usr/bin/leapp", "upgrade", "--report-schema=1.2.0"],
+        }
+        self.probes = None
+        # Installed RHUI packages and whether leapp runs with --no-rhsm
+        self.rhui = {"rhui_pkgs": [], "use_no_rhsm": False}
+        self.reboot_required = False
+        # Set by a phase producing the final result on its own
+        self.stopped = False
+
+    @property
+    def operation_command(self):
+        return self.commands["upgrade" if IS_UPGRADE else "preupgrade"]
+
+
+def _run_rhui_phase(state):
+    with run_record.phase("setup"):
+        rhui_pkgs = get_installed_rhui_packages(state.version)
+
+        # Check for RHUI PKGs
+        use_no_rhsm = should_use_no_rhsm_check(
+            len(rhui_pkgs) > 1, state.operation_command, state.probes
+        )
+    if use_no_rhsm and IS_PREUPGRADE_THEN_UPGRADE:
+        state.commands["upgrade"].append("--no-rhsm")
+    state.rhui = {"rhui_pkgs": rhui_pkgs, "use_no_rhsm": use_no_rhsm}
+    return state.rhui
+
+
+def _restore_rhui_phase(state, data):
+    state.rhui = data
+    if data["use_no_rhsm"]:
+        state.operation_command.append("--no-rhsm")
+
+
+def _run_setup_phase(state):
+    time_budget.require("setup")
+    with run_record.phase("setup"):
+        setup_leapp(
+            state.version,
+            state.rhui["rhui_pkgs"] if state.rhui["use_no_rhsm"] else None,
+        )
+
+
+def _run_execute_phase(state):
+    time_budget.require("execute")
+    if PREFLIGHT_CHECKS:
+        with run_record.phase("preflight"):
+            blockers = run_preflight_checks(state.version)
+        if blockers:
+            logger.info("Preflight checks found blockers, not running leapp.")
+            state.output = get_preflight_result(blockers)
+            state.stopped = True
+            return None
+    if IS_PREUPGRADE_THEN_UPGRADE:
+        state.reboot_required = run_preupgrade_then_upgrade(
+            state.output, state.commands["preupgrade"], state.commands["upgrade"]
+        )
+    else:
+        state.reboot_required = execute_phase(state.operation_command)
+    return {"reboot_required": state.reboot_required}
+
+
+def _restore_execute_phase(state, data):
+    state.reboot_required = data["reboot_required"]
+
+
+def _run_parse_phase(state):
+    if IS_PREUPGRADE_THEN_UPGRADE:
+        # Both reports were parsed in the execute phase
+        return None
+    save_entry_digests(
+        parse_phase(state.output, state.reboot_required, load_entry_digests())
+    )
+    data = {"output": state.output.to_dict(report_format="default")}
+    if IS_PREUPGRADE and isinstance(state.output.report_json, dict):
+        # Only results of a parsed report are stored, a failed run must not
+        # be served from the cache. The fingerprint is taken after the run
+        # as setting up leapp changes the installed packages.
+        save_preupgrade_result(state.output, get_system_fingerprint())
+    return data
+
+
+def _restore_parse_phase(state, data):
+    state.output = OutputCollector.from_dict(data["output"])
+
+
+def _run_inventory_phase(state):
+    if time_budget.allows("inventory"):
+        with run_record.phase("inventory"):
+            update_insights_inventory(state.output)
+
+
+def _run_reboot_phase(state):
+    logger.info("Operation %s finished successfully.", SCRIPT_TYPE.title())
+    if state.reboot_required:
+        reboot_system()
+
+
+# Phases of the run as (name, run, restore) tuples. The run function returns
+# the data stored in the checkpoint of the phase, the restore function, if
+# any, applies that data to the state when the phase is skipped on resume.
+RUN_PHASES = [
+    ("rhui", _run_rhui_phase, _restore_rhui_phase),
+    ("setup", _run_setup_phase, None),
+    ("execute", _run_execute_phase, _restore_execute_phase),
+    ("parse", _run_parse_phase, _restore_parse_phase),
+    ("inventory", _run_inventory_phase, None),
+    ("reboot", _run_reboot_phase, None),
+]
+
+
+def get_stored_result():
+    """
+    Return the stored result answering the operation without running leapp:
+    the cached pre-upgrade result or the inhibited pre-upgrade result
+    refusing the upgrade. None otherwise.
+    """
+    # The fingerprint only needs the local package index, so the stored
+    # results are checked before any other probe.
+    if IS_PREUPGRADE and RESULT_CACHE_TTL > 0:
+        cached_output = get_cached_result(get_system_fingerprint(), RESULT_CACHE_TTL)
+        if cached_output:
+            logger.info("Returning the cached pre-upgrade result.")
+            return cached_output
+    if IS_UPGRADE and not IGNORE_PREUPGRADE_RESULT:
+        inhibited_output = get_inhibited_preupgrade_result(
+            get_system_fingerprint(), PREUPGRADE_RESULT_MAX_AGE
+        )
+        if inhibited_output:
+            logger.info(
+                "Skipping the upgrade, the stored pre-upgrade result of the "
+                "unchanged system reported inhibitors."
+            )
+            return inhibited_output
+    return None
+
+
+def run_phases(state):
+    """
+    Run the phases of the operation, skipping those completed by a previous
+    run of the unchanged system. Returns the output of the operation.
+    """
+    stored_output = get_stored_result()
+    if stored_output:
+        return stored_output
+
+    with run_record.phase("probes"):
+        state.probes = run_preflight_probes()
+    checkpoints = load_checkpoints(get_system_fingerprint())
+    for name, run_phase, restore_phase in RUN_PHASES:
+        if checkpoints.done(name):
+            if restore_phase:
+                restore_phase(state, checkpoints.get(name))
+            continue
+        data = run_phase(state)
+        if state.stopped:
+            return state.output
+        checkpoints.complete(name, data)
+
+    time_budget.annotate(state.output)
+    checkpoints.clear()
+    return state.output
+
+
+def run(run_lock):
+    """Run the operation while holding the run lock."""
     setup_sos_report()
     archive_old_logger_files()
     setup_logger_handler()
     try:
         # Exit if invalid value for SCRIPT_TYPE
-        if SCRIPT_TYPE not in ["PREUPGRADE", "UPGRADE"]:
+        if SCRIPT_TYPE not in ALLOWED_SCRIPT_TYPES:
             raise ProcessError(
-                message="Allowed values for RHC_WORKER_LEAPP_SCRIPT_TYPE are 'PREUPGRADE' and 'UPGRADE'.",
+                message="Allowed values for RHC_WORKER_LEAPP_SCRIPT_TYPE are 'PREUPGRADE', 'UPGRADE' and 'PREUPGRADE_THEN_UPGRADE'.",
                 report="Exiting because RHC_WORKER_LEAPP_SCRIPT_TYPE='%s'"
                 % SCRIPT_TYPE,
             )
@@ -554,25 +3149,8 @@ def main():
                 % (dist, version),
             )
 
-        output = OutputCollector()
-        preupgrade_command = ["/usr/bin/leapp", "preupgrade", "--report-schema=1.2.0"]
-        upgrade_command = ["/usr/bin/leapp", "upgrade", "--report-schema=1.2.0"]
-        operation_command = preupgrade_command if IS_PREUPGRADE else upgrade_command
-        rhui_pkgs = setup_leapp(version)
-
-        # Check for RHUI PKGs
-        use_no_rhsm = should_use_no_rhsm_check(len(rhui_pkgs) > 1, operation_command)
-        if use_no_rhsm:
-            install_leapp_pkg_corresponding_to_installed_rhui(rhui_pkgs)
-
-        remove_previous_reports()
-        leapp_output = execute_operation(operation_command)
-        upgrade_reboot_required = REBOOT_GUIDANCE_MESSAGE in leapp_output
-        parse_results(output, upgrade_reboot_required)
-        update_insights_inventory(output)
-        logger.info("Operation %s finished successfully.", SCRIPT_TYPE.title())
-        if upgrade_reboot_required:
-            reboot_system()
+        state = RunState(version)
+        output = run_phases(state)
     except ProcessError as exception:
         logger.error(exception.report)
         output = OutputCollector(
@@ -592,10 +3170,13 @@ def main():
             report=str(exception),
         )
     finally:
-        print("### JSON START ###")
-        print(json.dumps(output.to_dict(), indent=4))
-        print("### JSON END ###")
+        # output is only unset when a BaseException escapes the handlers
+        print_output(output)  # pylint: disable=used-before-assignment
+        record_run_history(output)
+        run_lock.save_result(output)
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["history"]:
+        sys.exit(history_main(sys.argv[2:]))
     main()
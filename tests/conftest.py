@@ -0,0 +1,20 @@
+import pytest
+
+import scripts.leapp_script
+from scripts.leapp_script import package_index
+
+
+@pytest.fixture(autouse=True)
+def reset_package_index():
+    """The installed package index is shared by the whole run of the script."""
+    package_index.invalidate()
+    yield
+    package_index.invalidate()
+
+
+@pytest.fixture
+def log_dir(monkeypatch, tmpdir):
+    """Keep the state files of the script in a temporary LOG_DIR."""
+    path = tmpdir.mkdir("log")
+    monkeypatch.setattr(scripts.leapp_script, "LOG_DIR", str(path))
+    return path
@@ -1,13 +1,62 @@
 from mock import patch
 
-from scripts.leapp_script import _check_if_package_installed
+from scripts.leapp_script import (
+    _check_if_package_installed,
+    package_index,
+    PackageIndex,
+)
 
+RPMDB_DUMP = "".join(
+    [
+        "example-package 1.0 1.el8 noarch\n",
+        "subscription-manager 1.28.40 1.el8 x86_64\n",
+    ]
+)
 
+
+@patch("scripts.leapp_script.PackageIndex.get_rpmdb_mtime", return_value=1.0)
+@patch("scripts.leapp_script.run_subprocess")
+def test_check_if_package_installed(mock_run_subprocess, _):
+    mock_run_subprocess.return_value = (RPMDB_DUMP, 0)
+
+    assert _check_if_package_installed("example-package")
+    assert not _check_if_package_installed("missing-package")
+
+    mock_run_subprocess.assert_called_once_with(
+        PackageIndex.DUMP_COMMAND, phase="setup"
+    )
+    assert package_index.get("subscription-manager") == (
+        "1.28.40",
+        "1.el8",
+        "x86_64",
+    )
+
+
+@patch("scripts.leapp_script.PackageIndex.get_rpmdb_mtime")
 @patch("scripts.leapp_script.run_subprocess")
-def test_check_if_package_installed(mock_run_subprocess):
-    pkg_name = "example-package"
-    mock_run_subprocess.return_value = ("", 0)
-    result = _check_if_package_installed(pkg_name)
-    expected_command = ["/usr/bin/rpm", "-q", pkg_name]
-    mock_run_subprocess.assert_called_once_with(expected_command)
-    assert result
+def test_package_index_rebuilt_after_rpmdb_change(mock_run_subprocess, mock_mtime):
+    mock_mtime.return_value = 1.0
+    mock_run_subprocess.return_value = (RPMDB_DUMP, 0)
+    assert not _check_if_package_installed("leapp-upgrade")
+
+    mock_mtime.return_value = 2.0
+    mock_run_subprocess.return_value = (
+        RPMDB_DUMP + "leapp-upgrade 0.20.0 2.el8 noarch\n",
+        0,
+    )
+    assert _check_if_package_installed("leapp-upgrade")
+    assert mock_run_subprocess.call_count == 2
+
+
+def test_get_rpmdb_mtime(monkeypatch, tmpdir):
+    monkeypatch.setattr("scripts.leapp_script.RPMDB_PATH", str(tmpdir))
+    packages = tmpdir.join("Packages")
+    packages.write("")
+    packages.setmtime(1000)
+    tmpdir.join("__db.001").write("")
+    tmpdir.setmtime(500)
+
+    assert PackageIndex.get_rpmdb_mtime() == 1000
+
+    monkeypatch.setattr("scripts.leapp_script.RPMDB_PATH", str(tmpdir.join("none")))
+    assert PackageIndex.get_rpmdb_mtime() is None
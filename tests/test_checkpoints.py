@@ -0,0 +1,118 @@
+import json
+import time
+
+import pytest
+from mock import patch
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    CHECKPOINTS_FILENAME,
+    PhaseCheckpoints,
+    load_checkpoints,
+)
+
+
+@pytest.fixture(name="checkpoints_path")
+def checkpoints_path_fixture(monkeypatch, tmpdir):
+    monkeypatch.setattr(scripts.leapp_script, "LOG_DIR", str(tmpdir))
+    monkeypatch.setattr(scripts.leapp_script, "SCRIPT_TYPE", "UPGRADE")
+    with patch(
+        "scripts.leapp_script.get_system_fingerprint", return_value="fingerprint"
+    ):
+        yield str(tmpdir.join(CHECKPOINTS_FILENAME))
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_resume():
+    checkpoints = load_checkpoints("fingerprint")
+    assert not checkpoints.done("rhui")
+    checkpoints.complete("rhui", {"rhui_pkgs": [], "use_no_rhsm": False})
+    checkpoints.complete("setup")
+
+    resumed = load_checkpoints("fingerprint")
+
+    assert resumed.done("rhui")
+    assert resumed.done("setup")
+    assert not resumed.done("execute")
+    assert resumed.get("rhui") == {"rhui_pkgs": [], "use_no_rhsm": False}
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_changed_fingerprint():
+    load_checkpoints("fingerprint").complete("setup")
+
+    assert not load_checkpoints("other").done("setup")
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_other_script_type(monkeypatch):
+    load_checkpoints("fingerprint").complete("setup")
+    monkeypatch.setattr(scripts.leapp_script, "SCRIPT_TYPE", "PREUPGRADE")
+
+    assert not load_checkpoints("fingerprint").done("setup")
+
+
+def test_checkpoints_expired(checkpoints_path):
+    load_checkpoints("fingerprint").complete("setup")
+    with open(checkpoints_path) as handler:
+        data = json.load(handler)
+    data["time"] = time.time() - scripts.leapp_script.CHECKPOINTS_MAX_AGE - 1
+    with open(checkpoints_path, "w") as handler:
+        json.dump(data, handler)
+
+    assert not load_checkpoints("fingerprint").done("setup")
+
+
+@pytest.mark.parametrize(("content"), ("", "{", "[]", '{"phases": []}'))
+def test_checkpoints_invalid(checkpoints_path, content):
+    with open(checkpoints_path, "w") as handler:
+        handler.write(content)
+
+    assert not load_checkpoints("fingerprint").done("setup")
+
+
+def test_checkpoints_resume_disabled(checkpoints_path, monkeypatch):
+    load_checkpoints("fingerprint").complete("setup")
+    monkeypatch.setattr(scripts.leapp_script, "RESUME_FROM_CHECKPOINTS", False)
+
+    checkpoints = load_checkpoints("fingerprint")
+
+    assert not checkpoints.done("setup")
+    checkpoints.complete("execute", {"reboot_required": True})
+    with open(checkpoints_path) as handler:
+        assert list(json.load(handler)["phases"]) == ["execute"]
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_clear():
+    checkpoints = load_checkpoints("fingerprint")
+    checkpoints.complete("setup")
+    checkpoints.clear()
+
+    assert not checkpoints.done("setup")
+    assert not load_checkpoints("fingerprint").done("setup")
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_disabled():
+    checkpoints = PhaseCheckpoints()
+    checkpoints.complete("setup")
+    checkpoints.clear()
+
+    assert not checkpoints.done("setup")
+    assert not load_checkpoints("fingerprint").done("setup")
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_combined_mode(monkeypatch):
+    monkeypatch.setattr(scripts.leapp_script, "IS_PREUPGRADE_THEN_UPGRADE", True)
+
+    assert load_checkpoints("fingerprint").path is None
+
+
+@pytest.mark.usefixtures("checkpoints_path")
+def test_checkpoints_unserializable_data(caplog):
+    checkpoints = load_checkpoints("fingerprint")
+    checkpoints.complete("execute", {"reboot_required": object()})
+
+    assert "Couldn't store the execute phase checkpoint" in caplog.text
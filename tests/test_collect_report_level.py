@@ -1,9 +1,16 @@
 import pytest
 from scripts.leapp_script import (
-    _find_highest_report_level,
+    ReportSummary,
 )
 
 
+def _find_highest_report_level(entries):
+    summary = ReportSummary()
+    for entry in entries:
+        summary.add(entry)
+    return summary.highest_level
+
+
 @pytest.mark.parametrize(
     ("entries", "expected"),
     (
@@ -0,0 +1,104 @@
+import json
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    COMPACT_TASKS_FORMAT_ID,
+    OutputCollector,
+    compact_report_entries,
+    decode_compact_report_entries,
+)
+
+ENTRIES = [
+    {
+        "actor": "check_os_release",
+        "audience": "sysadmin",
+        "groups": ["inhibitor", "sanity"],
+        "severity": "inhibitor",
+        "summary": "Unsupported OS release",
+        "detail": {"remediations": [{"type": "hint", "context": "Update"}]},
+        "flags": [],
+        "key": "abc",
+    },
+    {
+        "actor": "check_os_release",
+        "audience": "sysadmin",
+        "groups": ["sanity"],
+        "severity": "low",
+        "summary": "Another entry",
+        "detail": {"remediations": [{"type": "hint", "context": "Update"}]},
+        "count": 3,
+        "ratio": 0.5,
+        "ok": True,
+        "missing": None,
+        "key": "def",
+    },
+]
+
+
+def test_compact_report_entries_round_trip():
+    strings, entries = compact_report_entries(ENTRIES)
+
+    assert decode_compact_report_entries(strings, entries) == ENTRIES
+    # Each unique string is stored once.
+    assert len(strings) == len(set(strings))
+    assert strings.count("check_os_release") == 1
+    assert strings.count("sanity") == 1
+
+
+def test_compact_report_entries_values():
+    strings, entries = compact_report_entries(ENTRIES)
+    entry = dict((strings[int(key)], value) for key, value in entries[1].items())
+
+    assert strings[entry["actor"]] == "check_os_release"
+    assert entry["count"] == {"#": 3}
+    assert entry["ratio"] == {"#": 0.5}
+    assert entry["ok"] is True
+    assert entry["missing"] is None
+    assert [strings[index] for index in entry["groups"]] == ["sanity"]
+
+
+def test_compact_report_entries_size():
+    strings, entries = compact_report_entries(ENTRIES * 100)
+
+    assert len(json.dumps([strings, entries])) < len(json.dumps(ENTRIES * 100))
+
+
+def test_compact_report_entries_empty():
+    assert compact_report_entries([]) == ([], [])
+    assert decode_compact_report_entries([], []) == []
+
+
+def test_output_compact_format(monkeypatch):
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_FORMAT", "compact")
+    output = OutputCollector(status="ERROR")
+    output.report_json = {"leapp_run_id": "1", "entries": ENTRIES, "summary": {}}
+
+    report_json = json.loads(json.dumps(output.to_dict()))["report_json"]
+
+    assert report_json["tasks_format_id"] == COMPACT_TASKS_FORMAT_ID
+    assert report_json["tasks_format_version"] == "1.0"
+    assert report_json["leapp_run_id"] == "1"
+    assert report_json["summary"] == {}
+    assert (
+        decode_compact_report_entries(report_json["strings"], report_json["entries"])
+        == ENTRIES
+    )
+    # The collected report is left untouched.
+    assert output.report_json["entries"] == ENTRIES
+
+
+def test_output_compact_format_without_entries(monkeypatch):
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_FORMAT", "compact")
+    output = OutputCollector(status="ERROR")
+
+    assert output.to_dict()["report_json"] is None
+
+    output.entries = {"hi": "world"}
+    assert output.to_dict()["report_json"]["entries"] == {"hi": "world"}
+
+
+def test_output_default_format():
+    output = OutputCollector(status="ERROR")
+    output.report_json = {"entries": ENTRIES}
+
+    assert output.to_dict()["report_json"] == {"entries": ENTRIES}
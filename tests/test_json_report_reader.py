@@ -0,0 +1,83 @@
+import json
+import pytest
+
+from scripts.leapp_script import JsonReportReader
+
+REPORT = {
+    "leapp_run_id": "2d5ab5f8-8e0b-4ea3-a1fb-5a1c2f3e7c5b",
+    "entries": [
+        {
+            "title": b"\xc3\x91on-ascii title".decode("utf-8"),
+            "groups": ["inhibitor", "repository"],
+            "severity": "high",
+            "detail": {"remediations": [{"type": "hint", "context": "x" * 300}]},
+            "timeStamp": "2024-01-01T00:00:00.000000Z",
+        },
+        {"title": "Second", "groups": [], "severity": "info", "id": 12345},
+    ],
+    "version": 1.5,
+}
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 64, 1024 * 1024))
+@pytest.mark.parametrize("indent", (None, 4))
+def test_json_report_reader(tmpdir, chunk_size, indent):
+    report_path = tmpdir.join("leapp-report.json")
+    content = json.dumps(REPORT, indent=indent, ensure_ascii=False)
+    report_path.write_binary(content.encode("utf-8"))
+
+    with open(str(report_path), mode="r") as handler:
+        reader = JsonReportReader(handler, chunk_size=chunk_size)
+        entries = list(reader)
+
+    assert entries == REPORT["entries"]
+    assert reader.metadata == {
+        "leapp_run_id": REPORT["leapp_run_id"],
+        "version": 1.5,
+    }
+
+
+@pytest.mark.parametrize(
+    ("content", "expected"),
+    (
+        ("{}", []),
+        ('{"entries": []}', []),
+        (' { "entries" : [ {"a": 1} , {"b": 2} ] } ', [{"a": 1}, {"b": 2}]),
+    ),
+)
+def test_json_report_reader_small_reports(tmpdir, content, expected):
+    report_path = tmpdir.join("leapp-report.json")
+    report_path.write(content)
+
+    with open(str(report_path), mode="r") as handler:
+        assert list(JsonReportReader(handler, chunk_size=2)) == expected
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 30))
+def test_json_report_reader_split_numbers(tmpdir, chunk_size):
+    content = (
+        '{"entries": [{"id": 12345678901234567890, "score": -1.5e+10}], '
+        '"x": 0.25, "y": 1E-3, "z": [7, true]}'
+    )
+    report_path = tmpdir.join("leapp-report.json")
+    report_path.write(content)
+
+    with open(str(report_path), mode="r") as handler:
+        reader = JsonReportReader(handler, chunk_size=chunk_size)
+        entries = list(reader)
+
+    assert entries == [{"id": 12345678901234567890, "score": -1.5e10}]
+    assert reader.metadata == {"x": 0.25, "y": 0.001, "z": [7, True]}
+
+
+@pytest.mark.parametrize(
+    "content",
+    ("", "[]", '{"entries": [{"a": 1}', '{"entries": [{"a": 1}} '),
+)
+def test_json_report_reader_invalid_report(tmpdir, content):
+    report_path = tmpdir.join("leapp-report.json")
+    report_path.write(content)
+
+    with open(str(report_path), mode="r") as handler:
+        with pytest.raises(ValueError):
+            list(JsonReportReader(handler))
@@ -0,0 +1,56 @@
+import json
+from mock import patch, Mock
+
+from scripts.leapp_script import (
+    LineMatcher,
+    PROGRESS_FRAME_MARKER,
+    REBOOT_GUIDANCE_MESSAGE,
+    _get_leapp_output_matcher,
+)
+
+
+def test_line_matcher_callbacks():
+    callback = Mock()
+    matcher = LineMatcher()
+    matcher.register("phase", r"phase `(?P<value>\w+)`", callback)
+    matcher.register("reboot", REBOOT_GUIDANCE_MESSAGE, keep=True)
+
+    assert not matcher.feed("==> Processing phase `FactsCollection`\n")
+    assert matcher.feed(REBOOT_GUIDANCE_MESSAGE + "\n")
+    assert not matcher.feed("something else\n")
+
+    callback.assert_called_once()
+    name, match = callback.call_args[0]
+    assert name == "phase"
+    assert match.group("value") == "FactsCollection"
+    assert matcher.has_matched("reboot")
+    assert not matcher.has_matched("error")
+
+
+@patch("scripts.leapp_script.PROGRESS_FRAMES", True)
+def test_leapp_output_matcher_progress_frames(capsys):
+    matcher = _get_leapp_output_matcher()
+
+    matcher.feed("==> Processing phase `FactsCollection`\n")
+    matcher.feed("====> * scan_source_files\n")
+    matcher.feed("        Scan files.\n")
+
+    frames = [
+        json.loads(line[len(PROGRESS_FRAME_MARKER) :])
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith(PROGRESS_FRAME_MARKER)
+    ]
+    assert [(frame["event"], frame["value"]) for frame in frames] == [
+        ("phase", "FactsCollection"),
+        ("actor", "scan_source_files"),
+    ]
+
+
+@patch("scripts.leapp_script.PROGRESS_FRAMES", False)
+def test_leapp_output_matcher_no_progress_frames(capsys):
+    matcher = _get_leapp_output_matcher()
+
+    assert matcher.feed("UPGRADE INHIBITED\n")
+
+    assert PROGRESS_FRAME_MARKER not in capsys.readouterr().out
+    assert matcher.has_matched("inhibited")
@@ -1,11 +1,64 @@
+import json
+import os
+
+import pytest
 from mock import patch, Mock
+
+import scripts.leapp_script
 from scripts.leapp_script import (
     main,
     OutputCollector,
     REBOOT_GUIDANCE_MESSAGE,
+    load_preupgrade_result,
+    save_preupgrade_result,
+    update_insights_inventory,
 )
 
 
+@pytest.fixture(autouse=True)
+def system_state(monkeypatch, tmpdir):
+    """Keep the state files of the script away from the real LOG_DIR."""
+    monkeypatch.setattr(scripts.leapp_script, "LOG_DIR", str(tmpdir))
+    with patch(
+        "scripts.leapp_script.get_system_fingerprint", return_value="fingerprint"
+    ) as mock_fingerprint:
+        yield mock_fingerprint
+
+
+@pytest.fixture(name="run_environment")
+def run_environment_fixture():
+    """
+    Patch the setup of an eligible RHEL 8.10 system without RHUI packages and
+    the commands changing the system. Tests patch again what they assert on.
+    """
+    with patch("scripts.leapp_script.setup_sos_report"), patch(
+        "scripts.leapp_script.archive_old_logger_files"
+    ), patch("scripts.leapp_script.setup_logger_handler"), patch(
+        "scripts.leapp_script.get_rhel_version", return_value=("rhel", "8.10")
+    ), patch(
+        "scripts.leapp_script.is_non_eligible_releases", return_value=False
+    ), patch(
+        "scripts.leapp_script.run_preflight_probes"
+    ), patch(
+        "scripts.leapp_script.get_installed_rhui_packages", return_value=[]
+    ), patch(
+        "scripts.leapp_script.should_use_no_rhsm_check", return_value=False
+    ), patch(
+        "scripts.leapp_script.remove_previous_reports"
+    ), patch(
+        "scripts.leapp_script.setup_leapp"
+    ), patch(
+        "scripts.leapp_script.execute_operation", return_value=""
+    ), patch(
+        "scripts.leapp_script.parse_results"
+    ), patch(
+        "scripts.leapp_script.update_insights_inventory"
+    ), patch(
+        "scripts.leapp_script.reboot_system"
+    ):
+        yield
+
+
 @patch("scripts.leapp_script.SCRIPT_TYPE", "TEST")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
 @patch("scripts.leapp_script.archive_old_logger_files", side_effect=Mock())
@@ -14,7 +67,7 @@ def test_main_invalid_script_type(
     mock_setup_logger_handler,
     mock_setup_sos_report,
     mock_archive_old_logger_files,
-    caplog
+    caplog,
 ):
     main()
     log = caplog.text
@@ -73,10 +126,11 @@ def test_main_non_eligible_release_preupgrade(
 @patch("scripts.leapp_script.is_non_eligible_releases")
 @patch("scripts.leapp_script.setup_leapp")
 @patch("scripts.leapp_script.should_use_no_rhsm_check")
-@patch("scripts.leapp_script.install_leapp_pkg_corresponding_to_installed_rhui")
+@patch("scripts.leapp_script.get_installed_rhui_packages")
 @patch("scripts.leapp_script.remove_previous_reports")
 @patch("scripts.leapp_script.execute_operation")
 @patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.run_preflight_probes")
 @patch("scripts.leapp_script.OutputCollector")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
 @patch("scripts.leapp_script.archive_old_logger_files", side_effect=Mock())
@@ -86,11 +140,12 @@ def test_main_eligible_release_preupgrade(
     mock_setup_sos_report,
     mock_archive_old_logger_files,
     mock_output_collector,
+    mock_run_preflight_probes,
     mock_update_insights_inventory,
     mock_execute_operation,
     mock_remove_previous_reports,
+    mock_get_installed_rhui_packages,
     mock_should_use_no_rhsm_check,
-    mock_install_rhui,
     mock_setup_leapp,
     mock_is_non_eligible_releases,
     mock_get_rhel_version,
@@ -99,7 +154,7 @@ def test_main_eligible_release_preupgrade(
 ):
     mock_get_rhel_version.return_value = ("rhel", "7.9")
     mock_is_non_eligible_releases.return_value = False
-    mock_setup_leapp.return_value = [{"leapp_pkg": "to_install"}]
+    mock_get_installed_rhui_packages.return_value = [{"leapp_pkg": "to_install"}]
     mock_should_use_no_rhsm_check.return_value = True
     mock_output_collector.return_value = OutputCollector(entries=["non-empty"])
 
@@ -107,9 +162,13 @@ def test_main_eligible_release_preupgrade(
 
     assert "Operation Preupgrade finished successfully." in caplog.text
 
-    mock_setup_leapp.assert_called_once()
+    mock_run_preflight_probes.assert_called_once_with()
+    mock_get_installed_rhui_packages.assert_called_once_with("7.9")
+    mock_setup_leapp.assert_called_once_with(
+        "7.9", mock_get_installed_rhui_packages.return_value
+    )
     mock_should_use_no_rhsm_check.assert_called_once()
-    mock_install_rhui.assert_called_once()
+    mock_get_installed_rhui_packages.assert_called_once()
     mock_remove_previous_reports.assert_called_once()
     mock_execute_operation.assert_called_once()
     mock_parse_results.assert_called_once()
@@ -117,6 +176,131 @@ def test_main_eligible_release_preupgrade(
     mock_setup_logger_handler.assert_called_once()
     mock_setup_sos_report.assert_called_once()
     mock_archive_old_logger_files.assert_called_once()
+    assert load_preupgrade_result()["fingerprint"] == "fingerprint"
+
+
+@pytest.mark.usefixtures("run_environment")
+@patch("scripts.leapp_script.SCRIPT_TYPE", "PREUPGRADE")
+@patch("scripts.leapp_script.IS_PREUPGRADE", True)
+@patch("scripts.leapp_script.RESULT_CACHE_TTL", 3600)
+@patch("scripts.leapp_script.run_preflight_probes")
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation")
+@patch("scripts.leapp_script.update_insights_inventory")
+def test_main_cached_preupgrade(
+    mock_update_insights_inventory,
+    mock_execute_operation,
+    mock_setup_leapp,
+    mock_run_preflight_probes,
+    capsys,
+):
+    save_preupgrade_result(
+        OutputCollector(status="WARNING", message="Stored", report="Report"),
+        "fingerprint",
+    )
+
+    main()
+
+    output = capsys.readouterr().out
+    assert '"status": "WARNING"' in output
+    assert "Cached result of the analysis from" in output
+    mock_run_preflight_probes.assert_not_called()
+    mock_setup_leapp.assert_not_called()
+    mock_execute_operation.assert_not_called()
+    mock_update_insights_inventory.assert_not_called()
+
+
+@pytest.mark.usefixtures("run_environment")
+@pytest.mark.parametrize(("ignore_preupgrade_result"), (False, True))
+@patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
+@patch("scripts.leapp_script.IS_UPGRADE", True)
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation", return_value="")
+@patch("scripts.leapp_script.update_insights_inventory")
+def test_main_upgrade_inhibited_preupgrade(
+    mock_update_insights_inventory,
+    mock_execute_operation,
+    mock_setup_leapp,
+    ignore_preupgrade_result,
+    monkeypatch,
+    capsys,
+):
+    monkeypatch.setattr(
+        scripts.leapp_script, "IGNORE_PREUPGRADE_RESULT", ignore_preupgrade_result
+    )
+    preupgrade_output = OutputCollector(status="ERROR", report="Report")
+    preupgrade_output.report_json = {
+        "entries": [{"groups": ["inhibitor"], "severity": "inhibitor"}],
+        "summary": {"inhibitors": 1, "errors": 0},
+    }
+    save_preupgrade_result(preupgrade_output, "fingerprint")
+
+    main()
+
+    output = capsys.readouterr().out
+    if ignore_preupgrade_result:
+        mock_setup_leapp.assert_called_once()
+        mock_execute_operation.assert_called_once()
+        mock_update_insights_inventory.assert_called_once()
+    else:
+        assert '"status": "ERROR"' in output
+        assert "found 1 inhibitor" in output
+        mock_setup_leapp.assert_not_called()
+        mock_execute_operation.assert_not_called()
+        mock_update_insights_inventory.assert_not_called()
+
+
+@pytest.mark.usefixtures("run_environment")
+@pytest.mark.parametrize(("preupgrade_alert"), (False, True))
+@patch("scripts.leapp_script.SCRIPT_TYPE", "PREUPGRADE_THEN_UPGRADE")
+@patch("scripts.leapp_script.IS_PREUPGRADE_THEN_UPGRADE", True)
+@patch("scripts.leapp_script.should_use_no_rhsm_check", return_value=True)
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation")
+@patch("scripts.leapp_script.parse_results")
+@patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.reboot_system")
+def test_main_preupgrade_then_upgrade(
+    mock_reboot_system,
+    mock_update_insights_inventory,
+    mock_parse_results,
+    mock_execute_operation,
+    mock_setup_leapp,
+    mock_should_use_no_rhsm_check,
+    preupgrade_alert,
+    capsys,
+):
+    mock_execute_operation.side_effect = ["Preupgrade", REBOOT_GUIDANCE_MESSAGE]
+
+    def parse_results(output, reboot_required, *_):
+        output.status = "SUCCESS" if reboot_required else "WARNING"
+        output.alert = not reboot_required and preupgrade_alert
+        output.message = "Upgrade" if reboot_required else "Preupgrade"
+        output.report_json = {"entries": [], "summary": {"total": 0}}
+
+    mock_parse_results.side_effect = parse_results
+
+    main()
+
+    output = capsys.readouterr().out
+    mock_should_use_no_rhsm_check.assert_called_once()
+    mock_setup_leapp.assert_called_once()
+    mock_update_insights_inventory.assert_called_once()
+    assert load_preupgrade_result()["output"]["message"] == "Preupgrade"
+    preupgrade_command = mock_execute_operation.call_args_list[0][0][0]
+    assert preupgrade_command[:2] == ["/usr/bin/leapp", "preupgrade"]
+    if preupgrade_alert:
+        assert mock_execute_operation.call_count == 1
+        mock_reboot_system.assert_not_called()
+        assert '"message": "Preupgrade"' in output
+    else:
+        assert mock_execute_operation.call_count == 2
+        upgrade_command = mock_execute_operation.call_args_list[1][0][0]
+        assert upgrade_command[:2] == ["/usr/bin/leapp", "upgrade"]
+        assert upgrade_command[-1] == "--no-rhsm"
+        mock_reboot_system.assert_called_once()
+        assert '"message": "Upgrade"' in output
+        assert '"preupgrade": {' in output
 
 
 @patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
@@ -127,10 +311,11 @@ def test_main_eligible_release_preupgrade(
 @patch("scripts.leapp_script.is_non_eligible_releases")
 @patch("scripts.leapp_script.setup_leapp")
 @patch("scripts.leapp_script.should_use_no_rhsm_check")
-@patch("scripts.leapp_script.install_leapp_pkg_corresponding_to_installed_rhui")
+@patch("scripts.leapp_script.get_installed_rhui_packages")
 @patch("scripts.leapp_script.remove_previous_reports")
 @patch("scripts.leapp_script.execute_operation")
 @patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.run_preflight_probes", Mock())
 @patch("scripts.leapp_script.OutputCollector")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
 @patch("scripts.leapp_script.archive_old_logger_files", side_effect=Mock())
@@ -143,8 +328,8 @@ def test_main_eligible_release_upgrade(
     mock_update_insights_inventory,
     mock_execute_operation,
     mock_remove_previous_reports,
+    mock_get_installed_rhui_packages,
     mock_should_use_no_rhsm_check,
-    mock_install_rhui,
     mock_setup_leapp,
     mock_is_non_eligible_releases,
     mock_get_rhel_version,
@@ -154,7 +339,7 @@ def test_main_eligible_release_upgrade(
 ):
     mock_get_rhel_version.return_value = ("rhel", "7.9")
     mock_is_non_eligible_releases.return_value = False
-    mock_setup_leapp.return_value = [{"leapp_pkg": "to_install"}]
+    mock_get_installed_rhui_packages.return_value = [{"leapp_pkg": "to_install"}]
     mock_should_use_no_rhsm_check.return_value = True
     mock_output_collector.return_value = OutputCollector(entries=["non-empty"])
     mock_execute_operation.return_value = (
@@ -167,7 +352,7 @@ def test_main_eligible_release_upgrade(
 
     mock_setup_leapp.assert_called_once()
     mock_should_use_no_rhsm_check.assert_called_once()
-    mock_install_rhui.assert_called_once()
+    mock_get_installed_rhui_packages.assert_called_once()
     mock_remove_previous_reports.assert_called_once()
     mock_execute_operation.assert_called_once()
     mock_parse_results.assert_called_once()
@@ -186,10 +371,11 @@ def test_main_eligible_release_upgrade(
 @patch("scripts.leapp_script.is_non_eligible_releases")
 @patch("scripts.leapp_script.setup_leapp")
 @patch("scripts.leapp_script.should_use_no_rhsm_check")
-@patch("scripts.leapp_script.install_leapp_pkg_corresponding_to_installed_rhui")
+@patch("scripts.leapp_script.get_installed_rhui_packages")
 @patch("scripts.leapp_script.remove_previous_reports")
 @patch("scripts.leapp_script.execute_operation")
 @patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.run_preflight_probes", Mock())
 @patch("scripts.leapp_script.OutputCollector")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
 @patch("scripts.leapp_script.archive_old_logger_files", side_effect=Mock())
@@ -202,8 +388,8 @@ def test_main_upgrade_not_sucessfull(
     mock_update_insights_inventory,
     mock_execute_operation,
     mock_remove_previous_reports,
+    mock_get_installed_rhui_packages,
     mock_should_use_no_rhsm_check,
-    mock_install_rhui,
     mock_setup_leapp,
     mock_is_non_eligible_releases,
     mock_get_rhel_version,
@@ -213,7 +399,7 @@ def test_main_upgrade_not_sucessfull(
 ):
     mock_get_rhel_version.return_value = ("rhel", "7.9")
     mock_is_non_eligible_releases.return_value = False
-    mock_setup_leapp.return_value = [{"leapp_pkg": "to_install"}]
+    mock_get_installed_rhui_packages.return_value = [{"leapp_pkg": "to_install"}]
     mock_should_use_no_rhsm_check.return_value = True
     mock_output_collector.return_value = OutputCollector(entries=["non-empty"])
     mock_execute_operation.return_value = "LOREM IPSUM\n" + "\nDOLOR SIT AMET"
@@ -224,7 +410,7 @@ def test_main_upgrade_not_sucessfull(
 
     mock_setup_leapp.assert_called_once()
     mock_should_use_no_rhsm_check.assert_called_once()
-    mock_install_rhui.assert_called_once()
+    mock_get_installed_rhui_packages.assert_called_once()
     mock_remove_previous_reports.assert_called_once()
     mock_execute_operation.assert_called_once()
     mock_parse_results.assert_called_once()
@@ -242,10 +428,11 @@ def test_main_upgrade_not_sucessfull(
 @patch("scripts.leapp_script.get_rhel_version")
 @patch("scripts.leapp_script.is_non_eligible_releases")
 @patch("scripts.leapp_script.should_use_no_rhsm_check")
-@patch("scripts.leapp_script.install_leapp_pkg_corresponding_to_installed_rhui")
+@patch("scripts.leapp_script.get_installed_rhui_packages", Mock(return_value=[]))
 @patch("scripts.leapp_script.remove_previous_reports")
 @patch("scripts.leapp_script.execute_operation")
 @patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.run_preflight_probes", Mock())
 @patch("scripts.leapp_script.OutputCollector")
 @patch("scripts.leapp_script.run_subprocess")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
@@ -261,7 +448,6 @@ def test_main_setup_leapp_not_sucessfull(
     mock_execute_operation,
     mock_remove_previous_reports,
     mock_should_use_no_rhsm_check,
-    mock_install_rhui,
     mock_is_non_eligible_releases,
     mock_get_rhel_version,
     mock_reboot_system,
@@ -275,10 +461,9 @@ def test_main_setup_leapp_not_sucessfull(
 
     main()
 
-    assert "Installation of leapp failed with code '1'" in caplog.text
+    assert "Installation of leapp-upgrade failed with code '1'" in caplog.text
 
-    mock_should_use_no_rhsm_check.assert_not_called()
-    mock_install_rhui.assert_not_called()
+    mock_should_use_no_rhsm_check.assert_called_once()
     mock_remove_previous_reports.assert_not_called()
     mock_execute_operation.assert_not_called()
     mock_parse_results.assert_not_called()
@@ -296,10 +481,12 @@ def test_main_setup_leapp_not_sucessfull(
 @patch("scripts.leapp_script.get_rhel_version")
 @patch("scripts.leapp_script.is_non_eligible_releases")
 @patch("scripts.leapp_script.should_use_no_rhsm_check")
-@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.get_installed_rhui_packages")
+@patch("scripts.leapp_script._check_if_package_installed", Mock(return_value=False))
 @patch("scripts.leapp_script.remove_previous_reports")
 @patch("scripts.leapp_script.execute_operation")
 @patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.run_preflight_probes", Mock())
 @patch("scripts.leapp_script.OutputCollector")
 @patch("scripts.leapp_script.run_subprocess")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
@@ -314,7 +501,7 @@ def test_main_install_corresponding_pkgs_not_sucessfull(
     mock_update_insights_inventory,
     mock_execute_operation,
     mock_remove_previous_reports,
-    mock_setup_leapp,
+    mock_get_installed_rhui_packages,
     mock_should_use_no_rhsm_check,
     mock_is_non_eligible_releases,
     mock_get_rhel_version,
@@ -325,17 +512,29 @@ def test_main_install_corresponding_pkgs_not_sucessfull(
     mock_get_rhel_version.return_value = ("rhel", "7.9")
     mock_is_non_eligible_releases.return_value = False
     mock_run_subprocess.return_value = ("Installation failed", 1)
-    mock_setup_leapp.return_value = [{"leapp_pkg": "to_install"}]
+    mock_get_installed_rhui_packages.return_value = [{"leapp_pkg": "to_install"}]
+    mock_should_use_no_rhsm_check.return_value = True
     mock_output_collector.return_value = OutputCollector(entries=["non-empty"])
 
     main()
 
     assert (
-        "Installation of to_install (coresponding pkg to '{'leapp_pkg': 'to_install'}') failed with exit code 1 and output: Installation failed."
+        "Installation of leapp-upgrade, to_install failed with code '1' and output: Installation failed."
         in caplog.text
     )
 
-    mock_setup_leapp.assert_called_once()
+    mock_get_installed_rhui_packages.assert_called_once()
+    mock_run_subprocess.assert_called_once_with(
+        [
+            "/usr/bin/yum",
+            "install",
+            "-y",
+            "--enablerepo=rhel-7-server-extras-rpms",
+            "leapp-upgrade",
+            "to_install",
+        ],
+        phase="setup",
+    )
     mock_should_use_no_rhsm_check.assert_called_once()
     mock_remove_previous_reports.assert_not_called()
     mock_execute_operation.assert_not_called()
@@ -355,9 +554,10 @@ def test_main_install_corresponding_pkgs_not_sucessfull(
 @patch("scripts.leapp_script.is_non_eligible_releases")
 @patch("scripts.leapp_script.setup_leapp")
 @patch("scripts.leapp_script.should_use_no_rhsm_check")
-@patch("scripts.leapp_script.install_leapp_pkg_corresponding_to_installed_rhui")
+@patch("scripts.leapp_script.get_installed_rhui_packages")
 @patch("scripts.leapp_script.remove_previous_reports")
 @patch("scripts.leapp_script.execute_operation")
+@patch("scripts.leapp_script.run_preflight_probes", Mock())
 @patch("scripts.leapp_script.OutputCollector")
 @patch("scripts.leapp_script.run_subprocess")
 @patch("scripts.leapp_script.setup_sos_report", side_effect=Mock())
@@ -371,8 +571,8 @@ def test_main_update_inventory_not_sucessfull(
     mock_output_collector,
     mock_execute_operation,
     mock_remove_previous_reports,
+    mock_get_installed_rhui_packages,
     mock_should_use_no_rhsm_check,
-    mock_install_rhui,
     mock_setup_leapp,
     mock_is_non_eligible_releases,
     mock_get_rhel_version,
@@ -382,7 +582,7 @@ def test_main_update_inventory_not_sucessfull(
 ):
     mock_get_rhel_version.return_value = ("rhel", "7.9")
     mock_is_non_eligible_releases.return_value = False
-    mock_setup_leapp.return_value = [{"leapp_pkg": "to_install"}]
+    mock_get_installed_rhui_packages.return_value = [{"leapp_pkg": "to_install"}]
     mock_should_use_no_rhsm_check.return_value = True
     mock_output_collector.return_value = OutputCollector(entries=["non-empty"])
     mock_execute_operation.return_value = "LOREM IPSUM\n" + "\nDOLOR SIT AMET"
@@ -395,7 +595,7 @@ def test_main_update_inventory_not_sucessfull(
 
     mock_setup_leapp.assert_called_once()
     mock_should_use_no_rhsm_check.assert_called_once()
-    mock_install_rhui.assert_called_once()
+    mock_get_installed_rhui_packages.assert_called_once()
     mock_remove_previous_reports.assert_called_once()
     mock_execute_operation.assert_called_once()
     mock_parse_results.assert_called_once()
@@ -403,3 +603,275 @@ def test_main_update_inventory_not_sucessfull(
     mock_setup_logger_handler.assert_called_once()
     mock_setup_sos_report.assert_called_once()
     mock_archive_old_logger_files.assert_called_once()
+
+
+@pytest.mark.usefixtures("run_environment")
+@patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
+@patch("scripts.leapp_script.IS_UPGRADE", True)
+@patch("scripts.leapp_script.should_use_no_rhsm_check", return_value=True)
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation", return_value="Upgrade")
+@patch("scripts.leapp_script.parse_results")
+@patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.reboot_system")
+def test_main_resume_from_checkpoints(
+    mock_reboot_system,
+    mock_update_insights_inventory,
+    mock_parse_results,
+    mock_execute_operation,
+    mock_setup_leapp,
+    mock_should_use_no_rhsm_check,
+    capsys,
+):
+    def parse_results(output, *_):
+        output.status = "WARNING"
+        output.message = "Upgrade"
+        output.report_json = {"entries": [], "summary": {"total": 0}}
+
+    mock_parse_results.side_effect = parse_results
+    mock_update_insights_inventory.side_effect = [
+        scripts.leapp_script.ProcessError("Inventory", "failed"),
+        None,
+    ]
+
+    main()
+    assert '"status": "ERROR"' in capsys.readouterr().out
+
+    main()
+
+    output = capsys.readouterr().out
+    assert '"message": "Upgrade"' in output
+    mock_should_use_no_rhsm_check.assert_called_once()
+    mock_setup_leapp.assert_called_once()
+    mock_execute_operation.assert_called_once()
+    mock_parse_results.assert_called_once()
+    assert mock_update_insights_inventory.call_count == 2
+    mock_reboot_system.assert_not_called()
+    assert not scripts.leapp_script.load_checkpoints("fingerprint").done("setup")
+
+
+@pytest.mark.usefixtures("run_environment")
+@patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
+@patch("scripts.leapp_script.IS_UPGRADE", True)
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation", return_value=REBOOT_GUIDANCE_MESSAGE)
+@patch("scripts.leapp_script.parse_results")
+@patch("scripts.leapp_script.update_insights_inventory")
+@patch("scripts.leapp_script.reboot_system")
+def test_main_resume_reboot_phase(
+    mock_reboot_system,
+    mock_update_insights_inventory,
+    mock_parse_results,
+    mock_execute_operation,
+    mock_setup_leapp,
+):
+    mock_reboot_system.side_effect = [
+        scripts.leapp_script.ProcessError("Reboot", "failed"),
+        None,
+    ]
+
+    main()
+    main()
+
+    mock_setup_leapp.assert_called_once()
+    mock_execute_operation.assert_called_once()
+    mock_parse_results.assert_called_once()
+    mock_update_insights_inventory.assert_called_once()
+    assert mock_reboot_system.call_count == 2
+    assert not scripts.leapp_script.load_checkpoints("fingerprint").done("execute")
+
+
+@patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
+@patch("scripts.leapp_script.setup_sos_report", Mock())
+@patch("scripts.leapp_script.archive_old_logger_files", Mock())
+@patch("scripts.leapp_script.setup_logger_handler", side_effect=Mock())
+def test_main_conflicting_operation_running(mock_setup_logger_handler, capsys):
+    with patch("scripts.leapp_script.SCRIPT_TYPE", "PREUPGRADE"):
+        holder = scripts.leapp_script.RunLock(
+            os.path.join(
+                scripts.leapp_script.LOG_DIR, scripts.leapp_script.RUN_LOCK_FILENAME
+            )
+        )
+        holder.acquire(0)
+
+    main()
+    holder.release()
+
+    output = capsys.readouterr().out
+    assert '"status": "ERROR"' in output
+    assert "Another operation PREUPGRADE is running" in output
+    mock_setup_logger_handler.assert_not_called()
+
+
+@pytest.mark.usefixtures("run_environment")
+@pytest.mark.parametrize(("remaining"), (60, 0))
+@patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
+@patch("scripts.leapp_script.IS_UPGRADE", True)
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation", return_value="Upgrade")
+@patch("scripts.leapp_script.parse_results")
+@patch("scripts.leapp_script.update_insights_inventory")
+def test_main_time_budget(
+    mock_update_insights_inventory,
+    mock_parse_results,
+    mock_execute_operation,
+    mock_setup_leapp,
+    remaining,
+    capsys,
+):
+    def parse_results(output, *_):
+        output.status = "WARNING"
+        output.message = "Upgrade."
+        output.report_json = {"entries": {}}
+
+    mock_parse_results.side_effect = parse_results
+
+    with patch.object(
+        scripts.leapp_script.time_budget, "remaining", return_value=remaining
+    ):
+        main()
+
+    output = capsys.readouterr().out
+    mock_update_insights_inventory.assert_not_called()
+    if remaining:
+        mock_execute_operation.assert_called_once()
+        assert "Upgrade. Skipped because of the time budget: inventory." in output
+        assert '"skipped": [' in output
+    else:
+        mock_setup_leapp.assert_not_called()
+        mock_execute_operation.assert_not_called()
+        assert '"status": "ERROR"' in output
+        assert "The time budget of the task ran out." in output
+
+
+@pytest.mark.usefixtures("run_environment")
+@patch("scripts.leapp_script.SCRIPT_TYPE", "UPGRADE")
+@patch("scripts.leapp_script.IS_UPGRADE", True)
+@patch("scripts.leapp_script.parse_results")
+# Run the inventory update patched by run_environment up to run_subprocess
+@patch("scripts.leapp_script.update_insights_inventory", update_insights_inventory)
+@patch("scripts.leapp_script.run_subprocess")
+def test_main_time_budget_inventory_timeout(
+    mock_run_subprocess, mock_parse_results, capsys
+):
+    def parse_results(output, *_):
+        output.status = "WARNING"
+        output.message = "Upgrade."
+        output.report_json = {"entries": [{"title": "Entry"}]}
+
+    def run_subprocess(cmd, phase):
+        timeout = scripts.leapp_script.time_budget.get_timeout(
+            scripts.leapp_script.COMMAND_TIMEOUTS[phase]
+        )
+        raise scripts.leapp_script.ProcessTimeoutError(
+            "The %s phase timed out" % phase, cmd[0], phase, "deadline", timeout
+        )
+
+    mock_parse_results.side_effect = parse_results
+    mock_run_subprocess.side_effect = run_subprocess
+
+    with patch.object(scripts.leapp_script.time_budget, "remaining", return_value=150):
+        main()
+
+    output = json.loads(
+        capsys.readouterr()
+        .out.split("### JSON START ###")[1]
+        .split("### JSON END ###")[0]
+    )
+    mock_run_subprocess.assert_called_once_with(
+        cmd=["/usr/bin/insights-client"], phase="inventory"
+    )
+    assert output["status"] == "WARNING"
+    assert output["alert"]
+    assert output["message"] == "Upgrade. Failed to update Insights Inventory."
+    assert output["report_json"]["entries"] == [{"title": "Entry"}]
+
+
+@pytest.mark.usefixtures("run_environment")
+@patch("scripts.leapp_script.SCRIPT_TYPE", "PREUPGRADE")
+@patch("scripts.leapp_script.IS_PREUPGRADE", True)
+@patch("scripts.leapp_script.PREFLIGHT_CHECKS", True)
+@patch("scripts.leapp_script.SUPPORTED_SOURCE_RELEASES", ["8.8"])
+@patch("scripts.leapp_script.setup_leapp")
+@patch("scripts.leapp_script.execute_operation")
+@patch("scripts.leapp_script.update_insights_inventory")
+def test_main_preflight_checks_blocker(
+    mock_update_insights_inventory,
+    mock_execute_operation,
+    mock_setup_leapp,
+    monkeypatch,
+    capsys,
+):
+    monkeypatch.delenv("RHC_WORKER_LEAPP_UNSUPPORTED", raising=False)
+    monkeypatch.delenv("LEAPP_UNSUPPORTED", raising=False)
+    mock_check = Mock(return_value=[])
+    monkeypatch.setattr(scripts.leapp_script, "PREFLIGHT_CHECK_FUNCTIONS", [mock_check])
+
+    main()
+
+    output = capsys.readouterr().out
+    mock_setup_leapp.assert_called_once()
+    mock_check.assert_called_once_with()
+    mock_execute_operation.assert_not_called()
+    mock_update_insights_inventory.assert_not_called()
+    assert '"status": "ERROR"' in output
+    assert "The preflight checks found 1 inhibitor, leapp was not run." in output
+    assert "The upgrade from RHEL 8.10 is not supported." in output
+
+
+@pytest.mark.usefixtures("run_environment")
+@pytest.mark.parametrize(("parsed"), (True, False))
+@patch("scripts.leapp_script.SCRIPT_TYPE", "PREUPGRADE")
+@patch("scripts.leapp_script.IS_PREUPGRADE", True)
+@patch("scripts.leapp_script.parse_results")
+def test_main_preupgrade_stores_parsed_result(mock_parse_results, parsed):
+    def parse_results(output, *_):
+        output.status = "WARNING" if parsed else "ERROR"
+        output.report_json = {"entries": {}} if parsed else "Not found"
+
+    mock_parse_results.side_effect = parse_results
+
+    main()
+
+    mock_parse_results.assert_called_once()
+    stored = load_preupgrade_result()
+    if parsed:
+        assert stored["output"]["status"] == "WARNING"
+    else:
+        assert stored is None
+
+
+@pytest.mark.usefixtures("run_environment")
+@patch("scripts.leapp_script.SCRIPT_TYPE", "PREUPGRADE_THEN_UPGRADE")
+@patch("scripts.leapp_script.IS_PREUPGRADE_THEN_UPGRADE", True)
+@patch("scripts.leapp_script.REPORT_DELTA", True)
+@patch("scripts.leapp_script.execute_operation")
+@patch("scripts.leapp_script.parse_results")
+def test_main_preupgrade_then_upgrade_delta(mock_parse_results, mock_execute_operation):
+    previous_digests = {"time": 0, "entries": {"old": "digest"}}
+    with open(
+        os.path.join(
+            scripts.leapp_script.LOG_DIR, scripts.leapp_script.ENTRY_DIGESTS_FILENAME
+        ),
+        "w",
+    ) as handler:
+        json.dump(previous_digests, handler)
+    mock_execute_operation.side_effect = ["Preupgrade", REBOOT_GUIDANCE_MESSAGE]
+    compared = []
+
+    def parse_results(output, reboot_required, delta=None):
+        compared.append(delta.previous)
+        delta.add({"key": "upgrade" if reboot_required else "preupgrade"})
+        delta.complete = True
+        output.status = "SUCCESS"
+        output.alert = False
+        output.message = "Message"
+        output.report_json = {"entries": {}}
+
+    mock_parse_results.side_effect = parse_results
+
+    main()
+
+    assert mock_execute_operation.call_count == 2
+    assert compared == [previous_digests] * 2
+    assert list(scripts.leapp_script.load_entry_digests()["entries"]) == ["upgrade"]
@@ -0,0 +1,119 @@
+import hashlib
+import json
+
+import pytest
+from mock import patch
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    OUTPUT_FRAME_MARKER,
+    OutputCollector,
+    get_output_frames,
+    print_output,
+    write_json_chunks,
+)
+
+
+def _parse_frames(frames):
+    parsed = []
+    for frame in frames:
+        assert frame.startswith(OUTPUT_FRAME_MARKER + " ")
+        parsed.append(json.loads(frame[len(OUTPUT_FRAME_MARKER) + 1 :]))
+    return parsed
+
+
+def _get_payload():
+    output = OutputCollector(
+        status="ERROR",
+        message='Quoted "message"',
+        report="Line\n\tindented \\ backslash\n" * 50
+        + b"\xc3\x91o ASCII".decode("utf-8"),
+    )
+    output.entries = {"title": "Entry \\u0041", "path": "C:\\\\leapp"}
+    return json.dumps(output.to_dict())
+
+
+@pytest.mark.parametrize(("frame_size"), (256, 257, 258, 259, 260, 300, 1000))
+def test_get_output_frames(frame_size):
+    payload = _get_payload()
+
+    frames = list(get_output_frames(payload, frame_size))
+
+    assert all(len(frame) <= frame_size for frame in frames)
+    parsed = _parse_frames(frames)
+    header = parsed[0]
+    assert header["frame"] == 0
+    assert header["frames"] == len(frames) - 1
+    assert header["size"] == len(payload)
+    assert header["sha256"] == hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    assert [frame["frame"] for frame in parsed[1:]] == list(range(1, len(frames)))
+    assert "".join(frame["data"] for frame in parsed[1:]) == payload
+
+
+def test_get_output_frames_minimum_size():
+    payload = _get_payload()
+
+    frames = list(get_output_frames(payload, 10))
+
+    assert max(len(frame) for frame in frames) <= 256
+    assert "".join(frame["data"] for frame in _parse_frames(frames)[1:]) == payload
+
+
+def test_get_output_frames_single_frame():
+    frames = _parse_frames(get_output_frames('{"status": "SUCCESS"}', 4096))
+
+    assert len(frames) == 2
+    assert frames[0]["frames"] == 1
+    assert frames[1]["data"] == '{"status": "SUCCESS"}'
+
+
+def test_print_output(capsys):
+    output = OutputCollector(status="SUCCESS", message="Done", report="Report")
+    output.entries = {"title": "Entry", "groups": ["a", "b"], "detail": {}}
+
+    print_output(output)
+
+    assert capsys.readouterr().out == (
+        "### JSON START ###\n%s\n### JSON END ###\n"
+        % json.dumps(output.to_dict(), indent=4)
+    )
+
+
+def test_print_output_compact(monkeypatch, capsys):
+    monkeypatch.setattr(scripts.leapp_script, "OUTPUT_COMPACT", True)
+    output = OutputCollector(status="SUCCESS", message="Done", report="Report")
+    output.entries = {"title": "Entry", "groups": ["a", "b"]}
+
+    print_output(output)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == [
+        "### JSON START ###",
+        json.dumps(output.to_dict(), separators=(",", ":")),
+        "### JSON END ###",
+    ]
+
+
+@pytest.mark.parametrize(("buffer_size"), (1, 5, 1000))
+def test_write_json_chunks(buffer_size):
+    with patch("sys.stdout.write") as mock_write:
+        write_json_chunks(["ab", "cd", "e", "fgh"], buffer_size)
+
+    written = [call[0][0] for call in mock_write.call_args_list]
+    assert "".join(written) == "abcdefgh"
+    assert all(len(chunk) >= buffer_size for chunk in written[:-1])
+
+
+def test_print_output_frames(monkeypatch, capsys):
+    monkeypatch.setattr(scripts.leapp_script, "OUTPUT_FRAME_SIZE", 256)
+    output = OutputCollector(status="SUCCESS", message="Done", report="x" * 1000)
+
+    print_output(output)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "### JSON START ###"
+    assert lines[-1] == "### JSON END ###"
+    frames = _parse_frames(lines[1:-1])
+    assert frames[0]["frames"] == len(frames) - 1 > 1
+    payload = "".join(frame["data"] for frame in frames[1:])
+    assert json.loads(payload) == output.to_dict()
@@ -0,0 +1,73 @@
+import base64
+import gzip
+import io
+import json
+
+import jsonschema
+import pytest
+
+import scripts.leapp_script
+from scripts.leapp_script import OutputCollector
+
+
+def _decompress(data):
+    handler = gzip.GzipFile(fileobj=io.BytesIO(base64.b64decode(data)))
+    return handler.read().decode("utf-8")
+
+
+def _get_output():
+    output = OutputCollector(status="WARNING", message="Test", report="Report text")
+    output.entries = {"title": "Entry", "severity": "medium"}
+    return output
+
+
+def test_encode_plain_is_default():
+    output = _get_output()
+
+    assert output.encode() == output.to_dict()
+
+
+@pytest.mark.parametrize(("transport"), ("plain", "unknown"))
+def test_encode_uncompressed(transport):
+    output = _get_output()
+
+    data = output.encode(transport)
+
+    assert data == output.to_dict()
+    with open("schemas/leapp_schema_1.0.json", "r") as schema:
+        jsonschema.validate(instance=data, schema=json.load(schema))
+
+
+def test_encode_gzip():
+    output = _get_output()
+
+    data = output.encode("gzip")
+
+    with open("schemas/leapp_schema_1.1.json", "r") as schema:
+        jsonschema.validate(instance=data, schema=json.load(schema))
+    assert data["tasks_format_version"] == "1.1"
+    assert data["report_encoding"] == "gzip+base64"
+    assert data["status"] == "WARNING"
+    assert data["message"] == "Test"
+    assert _decompress(data["report"]) == "Report text"
+    report_json = json.loads(_decompress(data["report_json"]))
+    assert report_json == output.to_dict()["report_json"]
+    with open("schemas/leapp_schema_1.0.json", "r") as schema:
+        report_json_schema = json.load(schema)["properties"]["report_json"]
+    jsonschema.validate(instance=report_json, schema=report_json_schema)
+
+
+def test_encode_gzip_without_entries(monkeypatch):
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_TRANSPORT", "gzip")
+    output = OutputCollector(status="ERROR", message="Failed", report="")
+
+    data = output.encode()
+
+    with open("schemas/leapp_schema_1.1.json", "r") as schema:
+        jsonschema.validate(instance=data, schema=json.load(schema))
+    assert data["report_json"] is None
+    assert _decompress(data["report"]) == ""
+
+
+def test_encode_gzip_is_stable():
+    assert _get_output().encode("gzip") == _get_output().encode("gzip")
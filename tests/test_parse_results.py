@@ -1,10 +1,13 @@
 import json
 import pytest
-from mock import mock_open, patch
+from mock import Mock, mock_open, patch
+
+import scripts.leapp_script
 
 from scripts.leapp_script import (
     parse_results,
     OutputCollector,
+    ReportDelta,
 )
 
 
@@ -16,8 +19,7 @@ from scripts.leapp_script import (
     ),
 )
 @patch("os.path.exists", return_value=True)
-@patch("scripts.leapp_script._find_highest_report_level", return_value="ERROR")
-def test_gather_report_files_exist(mock_find_level, mock_exists, groups_value):
+def test_gather_report_files_exist(mock_exists, groups_value):
     test_txt_content = "Test data"
     test_json_content = json.dumps({"entries": [{"groups": [groups_value]}]})
     output = OutputCollector()
@@ -28,12 +30,13 @@ def test_gather_report_files_exist(mock_find_level, mock_exists, groups_value):
         )(file, mode)
         parse_results(output)
 
-    assert mock_find_level.call_count == 1
     assert output.status == "ERROR"
     assert mock_exists.call_count == 2
     assert output.report == test_txt_content
     assert output.report_json.get("entries") is not None
     assert output.report_json.get("entries")[0]["severity"] == "inhibitor"
+    assert output.report_json["summary"]["groups"] == {groups_value: 1}
+    assert output.report_json["summary"]["highest_severity"] == "inhibitor"
 
     num_errors = test_json_content.count("error")
     num_inhibitor = test_json_content.count("inhibitor")
@@ -57,10 +60,7 @@ def test_gather_report_files_exist(mock_find_level, mock_exists, groups_value):
     ),
 )
 @patch("os.path.exists", return_value=True)
-@patch("scripts.leapp_script._find_highest_report_level", return_value="ERROR")
-def test_gather_report_files_exist_with_reboot(
-    mock_find_level, mock_exists, json_report_mock
-):
+def test_gather_report_files_exist_with_reboot(mock_exists, json_report_mock):
     test_txt_content = "Test data"
     test_json_content = json.dumps(json_report_mock)
     output = OutputCollector()
@@ -73,8 +73,8 @@ def test_gather_report_files_exist_with_reboot(
         parse_results(output, reboot_required)
 
     mock_entries = json_report_mock.get("entries")
-    assert mock_find_level.call_count == len(mock_entries)
-    assert output.status == "SUCCESS" if not mock_entries else "ERROR"
+    assert output.status == ("ERROR" if mock_entries else "SUCCESS")
+    assert output.report_json["summary"]["total"] == len(mock_entries)
     assert mock_exists.call_count == 2
     assert output.report == test_txt_content
     assert output.report_json.get("entries") == mock_entries
@@ -95,3 +95,119 @@ def test_gather_report_files_not_exist(mock_exists):
     assert output.report != ""
     assert output.report_json != ""
     assert output.message != ""
+
+
+@patch("os.path.exists", Mock(return_value=True))
+def test_gather_report_files_summary():
+    report = {
+        "leapp_run_id": "run-id",
+        "entries": [
+            {"groups": ["inhibitor", "repository"], "severity": "high"},
+            {"groups": ["error"], "severity": "medium"},
+            {"groups": ["repository"], "severity": "low"},
+            {"groups": [], "severity": "info"},
+        ],
+    }
+    output = OutputCollector()
+    with patch("__builtin__.open") as mock_open_reports:
+        return_values = [json.dumps(report), "Test data"]
+        mock_open_reports.side_effect = lambda file, mode: mock_open(
+            read_data=return_values.pop(0)
+        )(file, mode)
+        parse_results(output)
+
+    assert output.status == "ERROR"
+    assert output.alert
+    assert output.report_json["leapp_run_id"] == "run-id"
+    assert output.report_json["summary"] == {
+        "total": 4,
+        "severities": {"inhibitor": 2, "high": 0, "medium": 0, "low": 1, "info": 1},
+        "groups": {"inhibitor": 1, "error": 1, "repository": 2},
+        "errors": 1,
+        "inhibitors": 1,
+        "highest_severity": "inhibitor",
+    }
+    assert output.message == (
+        "The upgrade cannot proceed. "
+        "Your system has 2 inhibitors out of 4 potential problems."
+    )
+
+
+@patch("os.path.exists", Mock(return_value=True))
+def test_gather_report_files_selected_entries(monkeypatch):
+    monkeypatch.setattr(
+        scripts.leapp_script, "REPORT_FIELDS", ["title", "severity", "key"]
+    )
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_MIN_SEVERITY", "medium")
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_MAX_ENTRIES", 2)
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_INDEX", True)
+    report = {
+        "entries": [
+            {"title": "A", "key": "a", "severity": "low", "detail": {}},
+            {"title": "B", "key": "b", "severity": "medium", "detail": {}},
+            {"title": "C", "key": "c", "severity": "high", "flags": []},
+            {"title": "D", "key": "d", "severity": "info", "groups": ["error"]},
+        ],
+    }
+    output = OutputCollector()
+    with patch("__builtin__.open") as mock_open_reports:
+        return_values = [json.dumps(report), "Test data"]
+        mock_open_reports.side_effect = lambda file, mode: mock_open(
+            read_data=return_values.pop(0)
+        )(file, mode)
+        parse_results(output)
+
+    assert output.report_json["entries"] == [
+        {"title": "C", "key": "c", "severity": "high"},
+        {"title": "D", "key": "d", "severity": "inhibitor"},
+    ]
+    assert output.report_json["omitted_entries"] == 2
+    assert output.report_json["index"] == {
+        "groups": {"error": [1]},
+        "severity": {"high": [0], "inhibitor": [1]},
+        "actor": {},
+    }
+    assert output.report_json["summary"]["total"] == 4
+    assert output.status == "ERROR"
+    assert output.message == (
+        "The upgrade cannot proceed. "
+        "Your system has 1 inhibitor out of 4 potential problems."
+    )
+
+
+@pytest.mark.parametrize(("enabled"), (False, True))
+@patch("os.path.exists", Mock(return_value=True))
+def test_gather_report_files_delta(enabled):
+    report = {
+        "entries": [
+            {"key": "a", "title": "A", "severity": "low"},
+            {"key": "b", "title": "B", "severity": "high"},
+        ],
+    }
+    previous = ReportDelta()
+    previous.add({"key": "a", "title": "A", "severity": "low"})
+    previous.add({"key": "c", "title": "C", "severity": "low"})
+    delta = ReportDelta({"time": 0, "entries": previous.digests}, enabled)
+    output = OutputCollector()
+    with patch("__builtin__.open") as mock_open_reports:
+        return_values = [json.dumps(report), "Test data"]
+        mock_open_reports.side_effect = lambda file, mode: mock_open(
+            read_data=return_values.pop(0)
+        )(file, mode)
+        parse_results(output, delta=delta)
+
+    assert delta.complete
+    assert output.report_json["summary"]["total"] == 2
+    assert output.status == "ERROR"
+    if enabled:
+        assert output.report_json["entries"] == report["entries"][1:]
+        assert output.report_json["delta"] == {
+            "base": "1970-01-01T00:00:00Z",
+            "added": ["b"],
+            "changed": [],
+            "removed": ["c"],
+            "unchanged": 1,
+        }
+    else:
+        assert output.report_json["entries"] == report["entries"]
+        assert "delta" not in output.report_json
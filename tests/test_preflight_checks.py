@@ -0,0 +1,164 @@
+import threading
+
+import pytest
+from mock import patch
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    check_enabled_repos,
+    check_free_space,
+    check_leapp_data_files,
+    check_source_release,
+    get_preflight_result,
+    run_preflight_checks,
+)
+
+
+class StatVfs(object):
+    def __init__(self, free):
+        self.f_bavail = free
+        self.f_frsize = 1
+
+
+@pytest.mark.parametrize(
+    ("free", "expected_titles"),
+    (
+        (4 * 1024**3, []),
+        (
+            50 * 1024**2,
+            ["Not enough free space in /boot", "Not enough free space in /var"],
+        ),
+    ),
+)
+@patch("scripts.leapp_script.os.path.exists", return_value=True)
+def test_check_free_space(mock_exists, free, expected_titles):
+    with patch("scripts.leapp_script.os.statvfs", return_value=StatVfs(free)):
+        entries = check_free_space()
+
+    mock_exists.assert_any_call("/var")
+    assert [entry["title"] for entry in entries] == expected_titles
+    for entry in entries:
+        assert entry["severity"] == "inhibitor"
+        assert entry["groups"] == ["inhibitor", "filesystem"]
+
+
+def test_check_leapp_data_files(monkeypatch, tmpdir):
+    monkeypatch.setattr(scripts.leapp_script, "LEAPP_FILES_DIR", str(tmpdir))
+    tmpdir.join("repomap.json").write("{}")
+
+    entries = check_leapp_data_files()
+
+    assert len(entries) == 1
+    assert "pes-events.json" in entries[0]["summary"]
+    assert "repomap.json" not in entries[0]["summary"]
+
+    tmpdir.join("pes-events.json").write("{}")
+    assert not check_leapp_data_files()
+
+
+@pytest.mark.parametrize(
+    ("repo_files", "blocked"),
+    (
+        ({}, True),
+        ({"redhat.repo": "[rhel]\nenabled=0\n"}, True),
+        ({"redhat.repo": "[rhel]\nenabled = 0\n[appstream]\nname=AppStream\n"}, False),
+        ({"redhat.repo": "[rhel]\nenabled=1\n"}, False),
+        ({"redhat.repo": "[rhel]\nenabled=0\n", "epel.repo": "[epel]\n"}, False),
+        ({"redhat.repo.rpmsave": "[rhel]\nenabled=1\n"}, True),
+    ),
+)
+def test_check_enabled_repos(monkeypatch, tmpdir, repo_files, blocked):
+    monkeypatch.setattr(scripts.leapp_script, "YUM_REPOS_DIR", str(tmpdir))
+    for name, content in repo_files.items():
+        tmpdir.join(name).write(content)
+
+    entries = check_enabled_repos()
+
+    assert bool(entries) == blocked
+
+
+@pytest.mark.parametrize(
+    ("version", "unsupported", "blocked"),
+    (("8.10", "", False), ("8.6", "", True), ("8.6", "1", False)),
+)
+def test_check_source_release(monkeypatch, version, unsupported, blocked):
+    monkeypatch.setenv("RHC_WORKER_LEAPP_UNSUPPORTED", unsupported)
+
+    entries = check_source_release(version)
+
+    assert bool(entries) == blocked
+    if blocked:
+        assert "RHEL 8.6" in entries[0]["summary"]
+
+
+def test_check_source_release_configured(monkeypatch):
+    monkeypatch.setenv("RHC_WORKER_LEAPP_UNSUPPORTED", "")
+    monkeypatch.setattr(scripts.leapp_script, "SUPPORTED_SOURCE_RELEASES", ["8.6"])
+
+    assert not check_source_release("8.6")
+    assert "releases 8.6." in check_source_release("8.10")[0]["summary"]
+
+
+def test_run_preflight_checks(monkeypatch, caplog):
+    def failing_check():
+        raise OSError("No such file")
+
+    monkeypatch.setattr(
+        scripts.leapp_script,
+        "PREFLIGHT_CHECK_FUNCTIONS",
+        [
+            lambda: [{"title": "First"}],
+            failing_check,
+            lambda: [],
+            lambda: [{"title": "Second"}, {"title": "Third"}],
+        ],
+    )
+    monkeypatch.delenv("RHC_WORKER_LEAPP_UNSUPPORTED", raising=False)
+    monkeypatch.delenv("LEAPP_UNSUPPORTED", raising=False)
+
+    entries = run_preflight_checks("8.6")
+
+    assert [entry["title"] for entry in entries] == [
+        "First",
+        "Second",
+        "Third",
+        "The installed release is not supported for the upgrade",
+    ]
+    assert "Preflight check failing_check failed: No such file" in caplog.text
+
+
+def test_run_preflight_checks_timeout(monkeypatch, caplog):
+    release = threading.Event()
+
+    def hung_check():
+        release.wait()
+        return [{"title": "Late"}]
+
+    monkeypatch.setitem(scripts.leapp_script.COMMAND_TIMEOUTS, "preflight", 1)
+    monkeypatch.setattr(
+        scripts.leapp_script,
+        "PREFLIGHT_CHECK_FUNCTIONS",
+        [hung_check, lambda: [{"title": "First"}]],
+    )
+
+    try:
+        entries = run_preflight_checks("8.10")
+    finally:
+        release.set()
+
+    assert [entry["title"] for entry in entries] == ["First"]
+    assert "Preflight check hung_check didn't finish in 1 seconds" in caplog.text
+
+
+def test_get_preflight_result():
+    entries = check_source_release("7.6") + check_source_release("8.6")
+
+    output = get_preflight_result(entries)
+
+    assert output.status == "ERROR"
+    assert output.alert
+    assert "found 2 inhibitors, leapp was not run" in output.message
+    assert output.report.count("Risk Factor: high (inhibitor)") == 2
+    assert output.report_json["entries"] == entries
+    assert output.report_json["summary"]["inhibitors"] == 2
+    assert output.report_json["summary"]["highest_severity"] == "inhibitor"
@@ -0,0 +1,71 @@
+from mock import patch
+
+from scripts.leapp_script import (
+    package_index,
+    PackageIndex,
+    PreflightProbes,
+    run_preflight_probes,
+    should_use_no_rhsm_check,
+)
+
+
+@patch("scripts.leapp_script.PackageIndex.get_rpmdb_mtime", return_value=1.0)
+@patch("scripts.leapp_script.os.path.exists", return_value=True)
+@patch("scripts.leapp_script.run_many")
+@patch("scripts.leapp_script.run_subprocess")
+def test_run_preflight_probes(mock_run_subprocess, mock_run_many, _, __):
+    mock_run_many.return_value = [
+        ("subscription-manager 1.28.40 1.el8 x86_64\n", 0),
+        ("repos", 0),
+    ]
+
+    probes = run_preflight_probes()
+
+    cmds = mock_run_many.call_args[0][0]
+    assert cmds[0] == PackageIndex.DUMP_COMMAND
+    assert cmds[1][1:] == ["repos", "--list-enabled"]
+    assert probes.rhsm_repos_output == "repos"
+    # The index is served from the probe without another rpm call
+    assert package_index.is_installed("subscription-manager")
+    assert not package_index.is_installed("leapp-upgrade")
+    mock_run_subprocess.assert_not_called()
+
+
+@patch("scripts.leapp_script.PackageIndex.get_rpmdb_mtime", return_value=1.0)
+@patch("scripts.leapp_script.os.path.exists", return_value=True)
+@patch("scripts.leapp_script.run_many")
+def test_run_preflight_probes_fresh_package_index(mock_run_many, _, __):
+    package_index.update("leapp-upgrade 0.20 1 noarch\n", 1.0)
+    mock_run_many.return_value = [("repos", 0)]
+
+    probes = run_preflight_probes()
+
+    cmds = mock_run_many.call_args[0][0]
+    assert [cmd[1:] for cmd in cmds] == [["repos", "--list-enabled"]]
+    assert probes.rhsm_repos_output == "repos"
+    assert package_index.is_installed("leapp-upgrade")
+
+
+@patch("scripts.leapp_script.os.path.exists", return_value=False)
+@patch("scripts.leapp_script.run_many")
+def test_run_preflight_probes_no_subscription_manager(mock_run_many, _):
+    mock_run_many.return_value = [("", 0)]
+
+    probes = run_preflight_probes()
+
+    assert mock_run_many.call_args[0][0] == [PackageIndex.DUMP_COMMAND]
+    assert probes.rhsm_repos_output is None
+
+
+@patch("scripts.leapp_script._check_if_package_installed", return_value=True)
+@patch("scripts.leapp_script.run_subprocess")
+def test_should_use_no_rhsm_check_uses_probes(mock_run_subprocess, _):
+    probes = PreflightProbes(
+        rhsm_repos_output="Repo ID: rhui-rhel-8-for-x86_64-baseos-rhui-rpms",
+    )
+
+    command = ["upgrade"]
+    assert should_use_no_rhsm_check(True, command, probes)
+
+    assert command == ["upgrade", "--no-rhsm"]
+    mock_run_subprocess.assert_not_called()
@@ -0,0 +1,57 @@
+import hashlib
+
+import pytest
+
+import scripts.leapp_script
+from scripts.leapp_script import read_text_report
+
+
+def _write_report(tmpdir, content):
+    path = tmpdir.join("leapp-report.txt")
+    path.write_binary(content)
+    return str(path)
+
+
+@pytest.mark.parametrize(("max_bytes"), (0, 26, 27, 100))
+def test_read_text_report_whole(tmpdir, max_bytes):
+    content = b"abcdefghijklmnopqrstuvwxyz"
+    path = _write_report(tmpdir, content)
+
+    assert read_text_report(path, max_bytes) == content.decode("utf-8")
+
+
+@pytest.mark.parametrize(("max_bytes"), (10, 11, 1000))
+@pytest.mark.parametrize(("chunk_size"), (1, 3, 64 * 1024))
+def test_read_text_report_truncated(tmpdir, monkeypatch, max_bytes, chunk_size):
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_READ_CHUNK_SIZE", chunk_size)
+    content = b"".join(b"line %d\n" % number for number in range(1000))
+    path = _write_report(tmpdir, content)
+
+    report = read_text_report(path, max_bytes)
+
+    head_size = max_bytes // 2
+    tail_size = max_bytes - head_size
+    marker = (
+        "\n\n[... %s bytes of the report omitted, the original report has %s bytes "
+        "and sha256 %s ...]\n\n"
+        % (
+            len(content) - max_bytes,
+            len(content),
+            hashlib.sha256(content).hexdigest(),
+        )
+    )
+    assert report == (
+        content[:head_size].decode("utf-8")
+        + marker
+        + content[-tail_size:].decode("utf-8")
+    )
+
+
+def test_read_text_report_cut_character(tmpdir):
+    content = b"\xc3\x91" * 10
+    path = _write_report(tmpdir, content)
+
+    report = read_text_report(path, 5)
+
+    assert report.startswith(b"\xc3\x91".decode("utf-8"))
+    assert "bytes of the report omitted" in report
@@ -0,0 +1,100 @@
+import pytest
+
+from scripts.leapp_script import (
+    ENTRY_DIGESTS_FILENAME,
+    ReportDelta,
+    load_entry_digests,
+    save_entry_digests,
+)
+
+ENTRIES = [
+    {"key": "a", "title": "A", "id": "1", "timeStamp": "2024-01-01"},
+    {"key": "b", "title": "B", "id": "2", "timeStamp": "2024-01-01"},
+    {"title": "No key", "id": "3", "timeStamp": "2024-01-01"},
+]
+
+
+def _record(entries, previous=None, enabled=True):
+    delta = ReportDelta(previous, enabled)
+    sent = [entry for entry in entries if delta.add(entry)]
+    return delta, sent
+
+
+def test_get_entry_digest_ignores_run_fields():
+    entry = dict(ENTRIES[0], id="other", timeStamp="2025-01-01")
+
+    assert ReportDelta.get_entry_digest(entry) == ReportDelta.get_entry_digest(
+        ENTRIES[0]
+    )
+    assert ReportDelta.get_entry_digest(
+        dict(ENTRIES[0], title="Changed")
+    ) != ReportDelta.get_entry_digest(ENTRIES[0])
+
+
+def test_delta_without_previous_run():
+    delta, sent = _record(ENTRIES)
+
+    assert sent == ENTRIES
+    assert delta.to_dict() == {"base": None}
+    assert sorted(delta.digests) == sorted(
+        ["a", "b", ReportDelta.get_entry_digest(ENTRIES[2])]
+    )
+
+
+def test_delta_against_previous_run():
+    previous, _ = _record(ENTRIES)
+    entries = [
+        dict(ENTRIES[0], id="4"),
+        dict(ENTRIES[1], title="Changed"),
+        {"key": "c", "title": "C"},
+    ]
+
+    delta, sent = _record(entries, {"time": 0, "entries": previous.digests})
+
+    assert sent == entries[1:]
+    assert delta.to_dict() == {
+        "base": "1970-01-01T00:00:00Z",
+        "added": ["c"],
+        "changed": ["b"],
+        "removed": [ReportDelta.get_entry_digest(ENTRIES[2])],
+        "unchanged": 1,
+    }
+
+
+def test_delta_disabled_sends_all_entries():
+    previous, _ = _record(ENTRIES)
+
+    delta, sent = _record(
+        ENTRIES, {"time": 0, "entries": previous.digests}, enabled=False
+    )
+
+    assert sent == ENTRIES
+    assert delta.unchanged_count == 3
+
+
+def test_save_and_load_entry_digests(log_dir):
+    delta, _ = _record(ENTRIES)
+    delta.complete = True
+
+    save_entry_digests(delta)
+
+    data = load_entry_digests()
+    assert data["entries"] == delta.digests
+    assert "time" in data
+    assert log_dir.listdir() == [log_dir.join(ENTRY_DIGESTS_FILENAME)]
+
+
+def test_save_entry_digests_incomplete(log_dir):
+    delta, _ = _record(ENTRIES)
+
+    save_entry_digests(delta)
+
+    assert load_entry_digests() is None
+    assert not log_dir.listdir()
+
+
+@pytest.mark.parametrize(("content"), ("", "not json", "[]", '{"entries": []}'))
+def test_load_entry_digests_invalid(log_dir, content):
+    log_dir.join(ENTRY_DIGESTS_FILENAME).write(content)
+
+    assert load_entry_digests() is None
@@ -0,0 +1,110 @@
+import pytest
+
+from scripts.leapp_script import ReportEntrySelector
+
+ENTRIES = [
+    {"key": "1", "severity": "info", "detail": {"a": 1}},
+    {"key": "2", "severity": "high", "detail": {"b": 2}},
+    {"key": "3", "severity": "low", "flags": []},
+    {"key": "4", "severity": "inhibitor"},
+    {"key": "5", "severity": "high"},
+    {"key": "6"},
+]
+
+
+def _select(**kwargs):
+    selector = ReportEntrySelector(**kwargs)
+    for entry in ENTRIES:
+        selector.add(entry)
+    return selector
+
+
+def test_select_all():
+    selector = _select()
+
+    assert selector.entries == ENTRIES
+    assert selector.total == 6
+    assert selector.omitted_count == 0
+
+
+def test_select_fields():
+    selector = _select(fields=["key", "flags"])
+
+    assert selector.entries == [
+        {"key": "1"},
+        {"key": "2"},
+        {"key": "3", "flags": []},
+        {"key": "4"},
+        {"key": "5"},
+        {"key": "6"},
+    ]
+
+
+@pytest.mark.parametrize(
+    ("min_severity", "keys"),
+    (
+        ("info", ["1", "2", "3", "4", "5"]),
+        ("low", ["2", "3", "4", "5"]),
+        ("high", ["2", "4", "5"]),
+        ("inhibitor", ["4"]),
+        ("", ["1", "2", "3", "4", "5", "6"]),
+        ("unknown", ["1", "2", "3", "4", "5", "6"]),
+    ),
+)
+def test_select_min_severity(min_severity, keys):
+    selector = _select(min_severity=min_severity)
+
+    assert [entry["key"] for entry in selector.entries] == keys
+    assert selector.omitted_count == 6 - len(keys)
+
+
+@pytest.mark.parametrize(
+    ("max_entries", "keys"),
+    (
+        (1, ["4"]),
+        (2, ["2", "4"]),
+        (3, ["2", "4", "5"]),
+        (4, ["2", "3", "4", "5"]),
+        (10, ["1", "2", "3", "4", "5", "6"]),
+    ),
+)
+def test_select_max_entries(max_entries, keys):
+    selector = _select(max_entries=max_entries)
+
+    assert [entry["key"] for entry in selector.entries] == keys
+    assert selector.omitted_count == 6 - len(keys)
+
+
+def test_index():
+    entries = [
+        {"key": "1", "severity": "info", "groups": ["a", "b"], "actor": "x"},
+        {"key": "2", "severity": "high", "groups": ["b"], "actor": "y"},
+        {"key": "3", "severity": "high", "groups": [], "actor": "x"},
+        {"key": "4"},
+    ]
+    selector = ReportEntrySelector(index=True)
+    for entry in entries:
+        selector.add(entry)
+
+    assert selector.get_index() == {
+        "groups": {"a": [0], "b": [0, 1]},
+        "severity": {"info": [0], "high": [1, 2]},
+        "actor": {"x": [0, 2], "y": [1]},
+    }
+
+
+def test_index_selected_entries():
+    selector = _select(fields=["key"], min_severity="low", max_entries=3, index=True)
+
+    assert [entry["key"] for entry in selector.entries] == ["2", "4", "5"]
+    assert selector.get_index() == {
+        "groups": {},
+        "severity": {"high": [0, 2], "inhibitor": [1]},
+        "actor": {},
+    }
+
+
+def test_index_disabled():
+    selector = _select()
+
+    assert selector.get_index() == {"groups": {}, "severity": {}, "actor": {}}
@@ -0,0 +1,281 @@
+import json
+import os
+
+import pytest
+from mock import patch
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    OutputCollector,
+    PREUPGRADE_RESULT_FILENAME,
+    get_cached_result,
+    get_inhibited_preupgrade_result,
+    get_system_fingerprint,
+    load_preupgrade_result,
+    save_preupgrade_result,
+)
+
+
+@pytest.fixture(name="system")
+def system_fixture(monkeypatch, tmpdir):
+    repos = tmpdir.mkdir("yum.repos.d")
+    repos.join("redhat.repo").write("[rhel]\nenabled=1\n")
+    os_release = tmpdir.join("os-release")
+    os_release.write('ID="rhel"\nVERSION_ID="8.10"\n')
+    monkeypatch.setattr(scripts.leapp_script, "YUM_REPOS_DIR", str(repos))
+    monkeypatch.setattr(scripts.leapp_script, "OS_RELEASE_PATH", str(os_release))
+    answerfile = tmpdir.join("answerfile.userchoices")
+    monkeypatch.setattr(scripts.leapp_script, "FINGERPRINT_FILES", [str(answerfile)])
+    boot_id = tmpdir.join("boot_id")
+    boot_id.write("2d8c1d3e-boot\n")
+    monkeypatch.setattr(scripts.leapp_script, "BOOT_ID_PATH", str(boot_id))
+    modules = tmpdir.join("modules")
+    modules.write("floppy 69632 0 - Live 0x0\nxfs 1503232 2 - Live 0x0\n")
+    monkeypatch.setattr(scripts.leapp_script, "PROC_MODULES_PATH", str(modules))
+    leapp_files = tmpdir.mkdir("files")
+    leapp_files.join("pes-events.json").write("{}")
+    monkeypatch.setattr(scripts.leapp_script, "LEAPP_FILES_DIR", str(leapp_files))
+    monkeypatch.setenv("RHC_WORKER_LEAPP_SCRIPT_TYPE", "PREUPGRADE")
+    with patch(
+        "scripts.leapp_script.PackageIndex.get_rpmdb_mtime", return_value=1000.0
+    ), patch(
+        "scripts.leapp_script.package_index.get", return_value=("0.20", "1", "noarch")
+    ):
+        yield tmpdir
+
+
+@pytest.mark.usefixtures("system")
+def test_get_system_fingerprint_stable():
+    assert get_system_fingerprint() == get_system_fingerprint()
+
+
+def test_get_system_fingerprint_repos(system):
+    fingerprint = get_system_fingerprint()
+    system.join("yum.repos.d", "redhat.repo").write("[rhel]\nenabled=0\n")
+
+    assert get_system_fingerprint() != fingerprint
+
+    system.join("yum.repos.d", "redhat.repo").write("[rhel]\nenabled=1\n")
+    assert get_system_fingerprint() == fingerprint
+
+    system.join("yum.repos.d", "other.repo").write("")
+    assert get_system_fingerprint() != fingerprint
+
+
+def test_get_system_fingerprint_os_release(system):
+    fingerprint = get_system_fingerprint()
+    system.join("os-release").write('ID="rhel"\nVERSION_ID="8.8"\n')
+
+    assert get_system_fingerprint() != fingerprint
+
+
+@pytest.mark.usefixtures("system")
+def test_get_system_fingerprint_packages():
+    fingerprint = get_system_fingerprint()
+
+    with patch(
+        "scripts.leapp_script.package_index.get", return_value=("0.21", "1", "noarch")
+    ):
+        assert get_system_fingerprint() != fingerprint
+    with patch(
+        "scripts.leapp_script.PackageIndex.get_rpmdb_mtime", return_value=2000.0
+    ):
+        assert get_system_fingerprint() != fingerprint
+
+
+def test_get_system_fingerprint_answerfile(system):
+    fingerprint = get_system_fingerprint()
+
+    system.join("answerfile.userchoices").write(
+        "[remove_pam_pkcs11_module_check]\nconfirm = True\n"
+    )
+
+    assert get_system_fingerprint() != fingerprint
+
+
+def test_get_system_fingerprint_leapp_files(system):
+    fingerprint = get_system_fingerprint()
+
+    system.join("files", "repomap.json").write('{"mapping": []}')
+
+    assert get_system_fingerprint() != fingerprint
+
+
+def test_get_system_fingerprint_boot(system):
+    fingerprint = get_system_fingerprint()
+    system.join("modules").write("xfs 1503232 3 - Live 0x0\n")
+    assert get_system_fingerprint() != fingerprint
+
+    fingerprint = get_system_fingerprint()
+    system.join("boot_id").write("7f3a9b21-boot\n")
+    assert get_system_fingerprint() != fingerprint
+
+
+@pytest.mark.usefixtures("system")
+def test_get_system_fingerprint_content_vars(monkeypatch):
+    fingerprint = get_system_fingerprint()
+
+    monkeypatch.setenv("RHC_WORKER_LEAPP_REPORT_TRANSPORT", "gzip")
+    monkeypatch.setenv("RHC_WORKER_LEAPP_RESULT_CACHE_TTL", "60")
+    monkeypatch.setenv("RHC_WORKER_OTHER", "value")
+    assert get_system_fingerprint() == fingerprint
+
+    monkeypatch.setenv("RHC_WORKER_LEAPP_UNSUPPORTED", "1")
+    assert get_system_fingerprint() != fingerprint
+
+
+def test_save_and_load_preupgrade_result(log_dir):
+    output = OutputCollector(status="WARNING", message="Message", report="Report")
+    output.report_json = {"entries": [{"title": "Entry"}]}
+
+    save_preupgrade_result(output, "fingerprint")
+
+    data = load_preupgrade_result()
+    assert data["fingerprint"] == "fingerprint"
+    assert data["output"] == output.to_dict()
+    assert OutputCollector.from_dict(data["output"]).to_dict() == output.to_dict()
+    assert log_dir.listdir() == [log_dir.join(PREUPGRADE_RESULT_FILENAME)]
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_save_preupgrade_result_default_format(monkeypatch):
+    monkeypatch.setattr(scripts.leapp_script, "REPORT_FORMAT", "compact")
+    output = OutputCollector(status="WARNING")
+    output.report_json = {"entries": [{"title": "Entry"}]}
+
+    save_preupgrade_result(output, "fingerprint")
+
+    assert load_preupgrade_result()["output"]["report_json"] == output.report_json
+
+
+@pytest.mark.parametrize(("content"), ("", "not json", "[]", '{"output": null}'))
+def test_load_preupgrade_result_invalid(log_dir, content):
+    log_dir.join(PREUPGRADE_RESULT_FILENAME).write(content)
+
+    assert load_preupgrade_result() is None
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_load_preupgrade_result_missing():
+    assert load_preupgrade_result() is None
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_get_cached_result():
+    output = OutputCollector(status="WARNING", message="Message", report="Report")
+    output.report_json = {"entries": []}
+    save_preupgrade_result(output, "fingerprint")
+
+    cached = get_cached_result("fingerprint", 60)
+
+    assert cached.status == "WARNING"
+    assert cached.report == "Report"
+    assert cached.message.startswith("Cached result of the analysis from ")
+    assert cached.message.endswith(". Message")
+    assert cached.report_json["cached"]["fingerprint"] == "fingerprint"
+    assert cached.report_json["entries"] == []
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_get_cached_result_changed():
+    save_preupgrade_result(OutputCollector(status="SUCCESS"), "fingerprint")
+
+    assert get_cached_result("other", 60) is None
+
+
+def test_get_cached_result_expired(log_dir):
+    save_preupgrade_result(OutputCollector(status="SUCCESS"), "fingerprint")
+    path = log_dir.join(PREUPGRADE_RESULT_FILENAME)
+    data = json.loads(path.read())
+    data["time"] -= 61
+    path.write(json.dumps(data))
+
+    assert get_cached_result("fingerprint", 60) is None
+    assert get_cached_result("fingerprint", 120) is not None
+
+
+def test_get_cached_result_missing(log_dir):
+    assert get_cached_result("fingerprint", 60) is None
+    assert not os.listdir(str(log_dir))
+
+
+def _save_inhibited_result(report_json):
+    output = OutputCollector(status="ERROR", message="Inhibited", report="Report")
+    output.report_json = report_json
+    save_preupgrade_result(output, "fingerprint")
+
+
+@pytest.mark.usefixtures("log_dir")
+@pytest.mark.parametrize(
+    ("report_json", "message"),
+    (
+        (
+            {"entries": [], "summary": {"inhibitors": 1, "errors": 0}},
+            "found 1 inhibitor and",
+        ),
+        (
+            {"entries": [], "summary": {"inhibitors": 2, "errors": 1}},
+            "found 3 inhibitors and",
+        ),
+        (
+            {"entries": [{"groups": ["inhibitor"]}, {"groups": ["error"]}, {}]},
+            "found 2 inhibitors and",
+        ),
+    ),
+)
+def test_get_inhibited_preupgrade_result(report_json, message):
+    _save_inhibited_result(report_json)
+
+    output = get_inhibited_preupgrade_result("fingerprint")
+
+    assert output.status == "ERROR"
+    assert output.alert
+    assert output.report == "Report"
+    assert output.message.startswith("The upgrade cannot proceed.")
+    assert message in output.message
+    assert "no tracked change of the system was detected" in output.message
+    assert "LEAPP_IGNORE_PREUPGRADE_RESULT" in output.message
+    assert output.report_json["entries"] == report_json["entries"]
+    assert output.report_json["cached"]["fingerprint"] == "fingerprint"
+
+
+@pytest.mark.usefixtures("log_dir")
+@pytest.mark.parametrize(
+    ("report_json"),
+    (
+        None,
+        "Not found",
+        {"entries": [], "summary": {"inhibitors": 0, "errors": 0}},
+        {"entries": [{"groups": ["repository"]}]},
+    ),
+)
+def test_get_inhibited_preupgrade_result_not_inhibited(report_json):
+    _save_inhibited_result(report_json)
+
+    assert get_inhibited_preupgrade_result("fingerprint") is None
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_get_inhibited_preupgrade_result_changed():
+    _save_inhibited_result({"entries": [], "summary": {"inhibitors": 1}})
+
+    assert get_inhibited_preupgrade_result("other") is None
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_get_inhibited_preupgrade_result_expired():
+    output = OutputCollector(status="ERROR")
+    output.report_json = {"entries": [{"groups": ["inhibitor"]}]}
+    with patch("scripts.leapp_script.time.time", return_value=1000.0):
+        save_preupgrade_result(output, "fingerprint")
+
+    with patch("scripts.leapp_script.time.time", return_value=1000.0 + 3600):
+        assert get_inhibited_preupgrade_result("fingerprint", 3600)
+    with patch("scripts.leapp_script.time.time", return_value=1000.0 + 3601):
+        assert get_inhibited_preupgrade_result("fingerprint", 3600) is None
+        assert get_inhibited_preupgrade_result("fingerprint")
+
+
+@pytest.mark.usefixtures("log_dir")
+def test_get_inhibited_preupgrade_result_missing():
+    assert get_inhibited_preupgrade_result("fingerprint") is None
@@ -1,16 +1,22 @@
+import pytest
 from mock import patch, ANY
 
-from scripts.leapp_script import execute_operation
+from scripts.leapp_script import OutputSpool, execute_operation
 
 
+@pytest.mark.usefixtures("log_dir")
 @patch("scripts.leapp_script.run_subprocess", return_value=(b"", 0))
 def test_execute_simple_command(mock_popen):
     output = execute_operation(["fake command"])
 
-    mock_popen.assert_called_once_with(["fake command"], env=ANY)
-    assert output == ""
+    mock_popen.assert_called_once_with(
+        ["fake command"], env=ANY, spool=output, matcher=ANY, phase="execute"
+    )
+    assert isinstance(output, OutputSpool)
+    assert output.getvalue() == ""
 
 
+@pytest.mark.usefixtures("log_dir")
 def test_execure_custom_variables():
     mock_env = {"FOO": "BAR", "BAR": "BAZ", "RHC_WORKER_LALA": "LAND"}
     command = ["/usr/bin/leapp", "preupgrade"]
@@ -21,5 +27,8 @@ def test_execure_custom_variables():
     mock_popen.assert_called_once_with(
         command,
         env={"FOO": "BAR", "BAR": "BAZ", "LALA": "LAND"},
+        spool=result,
+        matcher=ANY,
+        phase="execute",
     )
-    assert result == ""
+    assert result.getvalue() == ""
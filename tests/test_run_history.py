@@ -0,0 +1,183 @@
+import os
+
+import pytest
+from mock import patch
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    HISTORY_DB_FILENAME,
+    OutputCollector,
+    ReportDelta,
+    RunHistory,
+    RunRecord,
+    history_main,
+    record_run_history,
+)
+
+
+@pytest.fixture(name="history")
+def history_fixture(log_dir):
+    run_history = RunHistory(str(log_dir.join(HISTORY_DB_FILENAME)))
+    yield run_history
+    run_history.close()
+
+
+def _record(history, entries, retention=100, status="WARNING"):
+    record = RunRecord()
+    record.delta = ReportDelta()
+    for entry in entries:
+        record.delta.add(entry)
+    with record.phase("execute"):
+        pass
+    output = OutputCollector(status=status, message="Message")
+    output.report_json = {
+        "entries": entries,
+        "summary": {"total": len(entries), "inhibitors": 1, "errors": 0},
+    }
+    return history.record(record, output, retention)
+
+
+def test_run_record_phase():
+    record = RunRecord()
+
+    with patch("scripts.leapp_script.time.time", side_effect=[10, 12, 20, 21]):
+        with record.phase("execute"):
+            pass
+        with record.phase("execute"):
+            pass
+
+    assert record.timings == {"execute": 3}
+
+
+def test_run_record_phase_exception():
+    record = RunRecord()
+
+    with pytest.raises(ValueError):
+        with record.phase("setup"):
+            raise ValueError()
+
+    assert "setup" in record.timings
+
+
+def test_record_and_list_runs(history):
+    first = _record(history, [{"key": "a", "title": "A", "severity": "low"}])
+    second = _record(history, [])
+
+    runs = history.list_runs(10)
+
+    assert [run[0] for run in runs] == [second, first]
+    assert runs[0][4] == "WARNING"
+
+
+def test_retention(history):
+    run_ids = [_record(history, [{"key": "a"}], retention=3) for _ in range(5)]
+
+    assert [run[0] for run in history.list_runs(10)] == run_ids[:1:-1]
+    assert [run[0] for run in history.entry_history("a")] == run_ids[2:]
+
+
+def test_diff_runs(history):
+    old = _record(
+        history,
+        [
+            {"key": "a", "title": "A", "severity": "low"},
+            {"key": "b", "title": "B", "severity": "low"},
+            {"key": "c", "title": "C", "severity": "low"},
+        ],
+    )
+    new = _record(
+        history,
+        [
+            {"key": "a", "title": "A", "severity": "low"},
+            {"key": "b", "title": "B", "severity": "high"},
+            {"key": "d", "title": "D", "severity": "inhibitor"},
+        ],
+    )
+
+    added, removed, changed = history.diff_runs(old, new)
+
+    assert added == [("d", "inhibitor", "D")]
+    assert removed == [("c", "low", "C")]
+    assert changed == [("b", "high", "B")]
+
+
+def test_entry_history(history):
+    _record(history, [])
+    second = _record(history, [{"key": "a", "title": "A", "severity": "low"}])
+    third = _record(history, [{"key": "a", "title": "A", "severity": "high"}])
+
+    entries = history.entry_history("a")
+
+    assert [(entry[0], entry[4]) for entry in entries] == [
+        (second, "low"),
+        (third, "high"),
+    ]
+
+
+def test_entry_history_uses_index(history):
+    plan = history.connection.execute(
+        "EXPLAIN QUERY PLAN SELECT run_id FROM run_entries WHERE key = ?", ("a",)
+    ).fetchall()
+
+    assert "run_entries_key" in str(plan)
+
+
+def test_record_run_history(log_dir):
+    record_run_history(OutputCollector(status="ERROR", message="Failed"))
+
+    history = RunHistory(str(log_dir.join(HISTORY_DB_FILENAME)))
+    runs = history.list_runs(10)
+    history.close()
+    assert len(runs) == 1
+    assert runs[0][4] == "ERROR"
+
+
+def test_record_run_history_disabled(log_dir, monkeypatch):
+    monkeypatch.setattr(scripts.leapp_script, "HISTORY_RETENTION", 0)
+
+    record_run_history(OutputCollector(status="ERROR"))
+
+    assert not log_dir.listdir()
+
+
+def test_record_run_history_failure(log_dir, monkeypatch, caplog):
+    monkeypatch.setattr(scripts.leapp_script, "LOG_DIR", str(log_dir.join("missing")))
+
+    record_run_history(OutputCollector(status="ERROR"))
+
+    assert "Couldn't record the run in the history" in caplog.text
+
+
+def test_history_main(history, capsys):
+    old = _record(history, [{"key": "a", "title": "A", "severity": "low"}])
+    new = _record(history, [{"key": "b", "title": "B", "severity": "high"}])
+
+    assert history_main(["runs"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split("\t")[0] for line in lines] == [str(new), str(old)]
+    assert lines[0].endswith("1 inhibitors, 1 entries")
+
+    assert history_main(["diff", str(old), str(new)]) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "+ b\thigh\tB",
+        "- a\tlow\tA",
+    ]
+
+    assert history_main(["entry", "a"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert lines[0].split("\t")[3:] == ["reported", "low", "A"]
+
+
+def test_history_main_no_query(capsys):
+    with pytest.raises(SystemExit) as exception:
+        history_main([])
+
+    assert exception.value.code == 2
+    assert "usage: leapp_script.py history" in capsys.readouterr().err
+
+
+def test_history_main_no_history(log_dir, capsys):
+    assert history_main(["runs"]) == 1
+    assert "No history recorded" in capsys.readouterr().out
+    assert not os.listdir(str(log_dir))
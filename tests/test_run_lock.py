@@ -0,0 +1,146 @@
+import fcntl
+import json
+
+import pytest
+from mock import patch
+
+import scripts.leapp_script
+from scripts.leapp_script import (
+    OutputCollector,
+    ProcessError,
+    RUN_LOCK_FILENAME,
+    RunLock,
+)
+
+
+@pytest.fixture(name="lock_path")
+def lock_path_fixture(monkeypatch, tmpdir):
+    monkeypatch.setattr(scripts.leapp_script, "SCRIPT_TYPE", "PREUPGRADE")
+    return str(tmpdir.join("log", RUN_LOCK_FILENAME))
+
+
+def test_run_lock_acquire(lock_path):
+    run_lock = RunLock(lock_path)
+
+    assert run_lock.acquire(0) is None
+
+    with open(lock_path) as handler:
+        data = json.load(handler)
+    assert data["script_type"] == "PREUPGRADE"
+    assert "started" in data
+    run_lock.release()
+
+    assert RunLock(lock_path).acquire(0) is None
+
+
+def test_run_lock_conflicting_operation(lock_path, monkeypatch):
+    holder = RunLock(lock_path)
+    holder.acquire(0)
+    monkeypatch.setattr(scripts.leapp_script, "SCRIPT_TYPE", "UPGRADE")
+
+    with patch("scripts.leapp_script.time.sleep") as mock_sleep:
+        with pytest.raises(ProcessError) as exception:
+            RunLock(lock_path).acquire(60)
+
+    mock_sleep.assert_not_called()
+    assert "Another operation PREUPGRADE is running" in exception.value.message
+    holder.release()
+
+
+def test_run_lock_timeout(lock_path):
+    holder = RunLock(lock_path)
+    holder.acquire(0)
+
+    with pytest.raises(ProcessError) as exception:
+        RunLock(lock_path).acquire(0)
+
+    assert "didn't finish in time" in exception.value.message
+    holder.release()
+
+
+def test_run_lock_coalesce(lock_path):
+    holder = RunLock(lock_path)
+    holder.acquire(0)
+
+    def finish_holder(_seconds):
+        output = OutputCollector(status="WARNING", message="Analysis done")
+        output.report_json = {"entries": {}}
+        holder.save_result(output)
+        holder.release()
+
+    waiter = RunLock(lock_path)
+    with patch("scripts.leapp_script.time.sleep", side_effect=finish_holder):
+        output = waiter.acquire(60)
+
+    assert output.status == "WARNING"
+    assert output.message.startswith("Result of the concurrent run started at")
+    assert output.message.endswith("Analysis done")
+    assert output.report_json["coalesced"]["pid"] == holder.owner["pid"]
+    waiter.release()
+
+
+def test_run_lock_coalesce_several_waiters(lock_path):
+    holder = RunLock(lock_path)
+    holder.acquire(0)
+    first_waiter = RunLock(lock_path)
+    second_waiter = RunLock(lock_path)
+    outputs = {}
+
+    def wait_second(_seconds):
+        outputs["second"] = second_waiter.acquire(60)
+
+    def finish_holder(_seconds):
+        holder.save_result(OutputCollector(status="WARNING", message="Done"))
+        holder.release()
+
+    def finish_second(_seconds):
+        second_waiter.release()
+
+    # Each poll of a waiter lets the next participant make its move
+    steps = [wait_second, finish_holder, finish_second]
+    with patch(
+        "scripts.leapp_script.time.sleep",
+        side_effect=lambda seconds: steps.pop(0)(seconds),
+    ):
+        outputs["first"] = first_waiter.acquire(60)
+
+    assert sorted(outputs) == ["first", "second"]
+    for output in outputs.values():
+        assert output.status == "WARNING"
+        assert output.message.endswith("Done")
+    with open(lock_path) as handler:
+        assert json.load(handler)["pid"] == holder.owner["pid"]
+    first_waiter.release()
+
+
+def test_run_lock_holder_without_result(lock_path):
+    holder = RunLock(lock_path)
+    holder.acquire(0)
+
+    def kill_holder(_seconds):
+        holder.release()
+
+    waiter = RunLock(lock_path)
+    with patch("scripts.leapp_script.time.sleep", side_effect=kill_holder):
+        assert waiter.acquire(60) is None
+    waiter.release()
+
+
+def test_run_lock_stale_record(lock_path, monkeypatch):
+    finished = RunLock(lock_path)
+    finished.acquire(0)
+    finished.save_result(OutputCollector(status="WARNING", message="Done"))
+    finished.release()
+    monkeypatch.setattr(scripts.leapp_script, "SCRIPT_TYPE", "UPGRADE")
+    # The new holder didn't write its record yet
+    holder = open(lock_path, "a+")
+    fcntl.flock(holder.fileno(), fcntl.LOCK_EX)
+
+    def release_holder(_seconds):
+        holder.close()
+
+    waiter = RunLock(lock_path)
+    with patch("scripts.leapp_script.time.sleep", side_effect=release_holder):
+        assert waiter.acquire(60) is None
+    assert waiter.owner["script_type"] == "UPGRADE"
+    waiter.release()
@@ -0,0 +1,40 @@
+import time
+import pytest
+from mock import patch
+
+from scripts.leapp_script import run_many, ProcessTimeoutError
+
+
+def test_run_many_keeps_order():
+    cmds = [
+        ["/bin/sh", "-c", "sleep 0.2; echo first"],
+        ["/bin/sh", "-c", "echo second; exit 1"],
+        ["/bin/sh", "-c", "echo third"],
+    ]
+
+    results = run_many(cmds, parallelism=2)
+
+    assert results == [("first\n", 0), ("second\n", 1), ("third\n", 0)]
+
+
+def test_run_many_runs_concurrently():
+    cmds = [["/bin/sh", "-c", "sleep 1; echo done"]] * 4
+
+    started_at = time.time()
+    results = run_many(cmds, parallelism=4)
+
+    assert results == [("done\n", 0)] * 4
+    assert time.time() - started_at < 3
+
+
+@patch("scripts.leapp_script.COMMAND_TIMEOUTS", {"setup": 1})
+@patch("scripts.leapp_script.KILL_GRACE_PERIOD", 1)
+def test_run_many_deadline():
+    cmds = [["/bin/sh", "-c", "echo fast"], ["/bin/sh", "-c", "echo slow; sleep 30"]]
+
+    with pytest.raises(ProcessTimeoutError) as exception:
+        run_many(cmds, phase="setup")
+
+    assert exception.value.phase == "setup"
+    assert exception.value.reason == "deadline"
+    assert "Output: slow" in exception.value.report
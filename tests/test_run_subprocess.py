@@ -3,7 +3,13 @@ import subprocess
 import pytest
 from mock import patch
 
-from scripts.leapp_script import run_subprocess
+from scripts.leapp_script import (
+    run_subprocess,
+    ProcessTimeoutError,
+    LineMatcher,
+    OutputSpool,
+    REBOOT_GUIDANCE_MESSAGE,
+)
 
 
 class SubprocessMock(object):
@@ -95,3 +101,80 @@ def test_run_subprocess_custom_not_wait():
         stderr=subprocess.STDOUT,
         stdout=subprocess.PIPE,
     )
+
+
+def test_run_subprocess_spool(tmpdir):
+    spool_path = str(tmpdir.join("output.log"))
+    lines = [
+        "line 1\n".encode("utf-8"),
+        (REBOOT_GUIDANCE_MESSAGE + "\n").encode("utf-8"),
+        "line 3\n".encode("utf-8"),
+        "line 4\n".encode("utf-8"),
+    ]
+    matcher = LineMatcher()
+    matcher.register("reboot", REBOOT_GUIDANCE_MESSAGE, keep=True)
+    with patch("subprocess.Popen", return_value=SubprocessMock(lines, 0)), patch(
+        "scripts.leapp_script.OUTPUT_TAIL_LINES", 2
+    ):
+        spool = OutputSpool(spool_path)
+        output, returncode = run_subprocess(
+            ["test", "hi"], spool=spool, matcher=matcher
+        )
+
+    assert returncode == 0
+    assert output == (
+        "[... 2 earlier lines stored in %s ...]\nline 3\nline 4\n" % spool_path
+    )
+    assert spool.read() == "".join(line.decode("utf-8") for line in lines)
+    assert spool.line_count == 4
+    assert list(spool.tail) == ["line 3\n", "line 4\n"]
+    assert REBOOT_GUIDANCE_MESSAGE in spool
+    assert matcher.has_matched("reboot")
+    assert "line 1" not in spool
+
+
+def test_output_spool_not_truncated(tmpdir):
+    spool = OutputSpool(str(tmpdir.join("output.log")), tail_lines=5)
+    spool.write(b"output\n", "output\n")
+    spool.close()
+
+    assert not spool.truncated
+    assert spool.getvalue() == "output\n"
+    assert spool.size == 7
+
+
+@patch("scripts.leapp_script.COMMAND_TIMEOUTS", {"setup": 1})
+@patch("scripts.leapp_script.STALL_TIMEOUT", 0)
+@patch("scripts.leapp_script.KILL_GRACE_PERIOD", 1)
+def test_run_subprocess_deadline():
+    with pytest.raises(ProcessTimeoutError) as exception:
+        run_subprocess(["/bin/sh", "-c", "echo started; sleep 30"], phase="setup")
+
+    assert exception.value.phase == "setup"
+    assert exception.value.reason == "deadline"
+    assert exception.value.timeout == 1
+    assert exception.value.message == "The setup phase timed out"
+    assert "exceeded the deadline of 1 seconds" in exception.value.report
+    assert "Output: started" in exception.value.report
+
+
+@patch("scripts.leapp_script.COMMAND_TIMEOUTS", {"setup": 30})
+@patch("scripts.leapp_script.STALL_TIMEOUT", 1)
+@patch("scripts.leapp_script.KILL_GRACE_PERIOD", 1)
+def test_run_subprocess_stall():
+    with pytest.raises(ProcessTimeoutError) as exception:
+        run_subprocess(["/bin/sh", "-c", "sleep 30 & wait"], phase="setup")
+
+    assert exception.value.reason == "stall"
+    assert exception.value.timeout == 1
+    assert "produced no output for 1 seconds" in exception.value.report
+
+
+@patch("scripts.leapp_script.COMMAND_TIMEOUTS", {"setup": 30})
+@patch("scripts.leapp_script.STALL_TIMEOUT", 5)
+def test_run_subprocess_with_deadline_finishes():
+    output, returncode = run_subprocess(
+        ["/bin/sh", "-c", "echo first; echo -n second; exit 3"], phase="setup"
+    )
+
+    assert (output, returncode) == ("first\nsecond", 3)
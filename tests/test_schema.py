@@ -1,6 +1,6 @@
 import json
 import jsonschema
-from scripts.leapp_script import OutputCollector, STATUS_CODE_NAME_MAP
+from scripts.leapp_script import OutputCollector, ReportSummary, STATUS_CODE_NAME_MAP
 
 
 def test_output_schema():
@@ -32,3 +32,17 @@ def test_output_schema_entries_report():
         schema_json = json.load(schema)
     # If some difference between generated json and its schema invoke exception
     jsonschema.validate(instance=full_output, schema=schema_json)
+
+
+def test_output_schema_summary():
+    """Test that the report summary matches the schema."""
+    summary = ReportSummary()
+    summary.add({"groups": ["inhibitor"], "severity": "inhibitor"})
+    output_collector = OutputCollector(status="ERROR")
+    output_collector.entries = {"hi": "world"}
+    full_output = output_collector.to_dict()
+    full_output["report_json"]["summary"] = summary.to_dict()
+
+    with open("schemas/leapp_schema_1.0.json", "r") as schema:
+        schema_json = json.load(schema)
+    jsonschema.validate(instance=full_output, schema=schema_json)
@@ -1,6 +1,15 @@
 import pytest
 from mock import patch
-from scripts.leapp_script import setup_leapp, ProcessError
+from scripts.leapp_script import get_installed_rhui_packages, setup_leapp, ProcessError
+
+RHEL7_COMMAND = [
+    "/usr/bin/yum",
+    "install",
+    "-y",
+    "--enablerepo=rhel-7-server-extras-rpms",
+]
+RHEL8_COMMAND = ["/usr/bin/dnf", "install", "-y"]
+
 
 @pytest.mark.parametrize(
     ("installed"),
@@ -11,26 +20,55 @@ from scripts.leapp_script import setup_leapp, ProcessError
 )
 @patch("scripts.leapp_script.run_subprocess")
 @patch("scripts.leapp_script._check_if_package_installed")
-def test_setup_leapp_success(mock_check_if_package_installed, mock_run_subprocess, installed):
+def test_setup_leapp_success(
+    mock_check_if_package_installed, mock_run_subprocess, installed
+):
     mock_run_subprocess.return_value = ("Installation successful", 0)
     mock_check_if_package_installed.return_value = installed
 
-    rhel7_command = [
-        "/usr/bin/yum",
-        "install",
-        "leapp-upgrade",
-        "-y",
-        "--enablerepo=rhel-7-server-extras-rpms",
-    ]
-    rhel8_command = ["/usr/bin/dnf", "install", "leapp-upgrade", "-y"]
-
-    for version, command in [("7", rhel7_command), ("8", rhel8_command)]:
-        result = setup_leapp(version)
+    for version, command in [("7", RHEL7_COMMAND), ("8", RHEL8_COMMAND)]:
+        setup_leapp(version)
         if installed:
-            assert command not in mock_run_subprocess.call_args_list
+            mock_run_subprocess.assert_not_called()
         else:
-            mock_run_subprocess.assert_called_with(command)
-        assert all(pkg.get("installed", False) for pkg in result)
+            mock_run_subprocess.assert_called_with(
+                command + ["leapp-upgrade"], phase="setup"
+            )
+
+
+@patch("scripts.leapp_script.run_subprocess")
+@patch("scripts.leapp_script._check_if_package_installed")
+def test_setup_leapp_single_transaction(
+    mock_check_if_package_installed, mock_run_subprocess
+):
+    mock_run_subprocess.return_value = ("Installation successful", 0)
+    mock_check_if_package_installed.side_effect = lambda pkg: pkg == "leapp-rhui-aws"
+    rhui_pkgs = [
+        {"src_pkg": "rhui-azure-rhel8-sap-ha", "leapp_pkg": "leapp-rhui-azure-sap"},
+        {"src_pkg": "rhui-azure-rhel8-sapapps", "leapp_pkg": "leapp-rhui-azure-sap"},
+        {"src_pkg": "rh-amazon-rhui-client", "leapp_pkg": "leapp-rhui-aws"},
+    ]
+
+    setup_leapp("8", rhui_pkgs)
+
+    mock_run_subprocess.assert_called_once_with(
+        RHEL8_COMMAND + ["leapp-upgrade", "leapp-rhui-azure-sap"], phase="setup"
+    )
+
+
+@patch("scripts.leapp_script.run_subprocess")
+@patch("scripts.leapp_script._check_if_package_installed")
+def test_setup_leapp_rhui_only_rhel7(
+    mock_check_if_package_installed, mock_run_subprocess
+):
+    mock_run_subprocess.return_value = ("Installation successful", 0)
+    mock_check_if_package_installed.side_effect = lambda pkg: pkg == "leapp-upgrade"
+
+    setup_leapp("7", [{"leapp_pkg": "leapp-rhui-aws"}])
+
+    mock_run_subprocess.assert_called_once_with(
+        ["/usr/bin/yum", "install", "-y", "leapp-rhui-aws"], phase="setup"
+    )
 
 
 @patch("scripts.leapp_script.run_subprocess")
@@ -39,21 +77,29 @@ def test_setup_leapp_failure(mock_check_if_package_installed, mock_run_subproces
     mock_run_subprocess.return_value = ("Installation failed", 1)
     mock_check_if_package_installed.return_value = False
 
-    rhel7_command = [
-        "/usr/bin/yum",
-        "install",
-        "leapp-upgrade",
-        "-y",
-        "--enablerepo=rhel-7-server-extras-rpms",
-    ]
-    rhel8_command = ["/usr/bin/dnf", "install", "leapp-upgrade", "-y"]
-
-    for version, command in [("7", rhel7_command), ("8", rhel8_command)]:
+    for version, command in [("7", RHEL7_COMMAND), ("8", RHEL8_COMMAND)]:
         with pytest.raises(ProcessError) as e_info:
-            setup_leapp(version)
+            setup_leapp(version, [{"leapp_pkg": "leapp-rhui-aws"}])
 
-        mock_run_subprocess.assert_called_with(command)
+        mock_run_subprocess.assert_called_with(
+            command + ["leapp-upgrade", "leapp-rhui-aws"], phase="setup"
+        )
         assert (
             str(e_info.value)
-            == "Installation of leapp failed with code '1' and output: Installation failed."
+            == "Installation of leapp-upgrade, leapp-rhui-aws failed with code '1' and output: Installation failed."
         )
+
+
+@patch("scripts.leapp_script._check_if_package_installed")
+def test_get_installed_rhui_packages(mock_check_if_package_installed):
+    mock_check_if_package_installed.side_effect = lambda pkg: pkg in (
+        "rhui-azure-rhel8",
+        "rhui-azure-rhel8-sapapps",
+    )
+
+    result = get_installed_rhui_packages("8.10")
+
+    assert [pkg["leapp_pkg"] for pkg in result] == [
+        "leapp-rhui-azure",
+        "leapp-rhui-azure-sap",
+    ]
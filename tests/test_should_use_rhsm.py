@@ -7,7 +7,7 @@ def test_should_use_no_rhsm_rhsm_and_rhui_installed(
     mock_run_subprocess,
 ):
     mock_run_subprocess.side_effect = [
-        ("/path/to/subscription-manager\n", 0),
+        ("subscription-manager 1.28.40 1.el8 x86_64\n", 0),
         ("output_of_subscription_manager_repos_command", 0),
     ]
 
@@ -24,7 +24,7 @@ def test_should_use_no_rhsm_rhsm_installed_rhui_not(
     mock_run_subprocess,
 ):
     mock_run_subprocess.side_effect = [
-        ("/path/to/subscription-manager\n", 0),
+        ("subscription-manager 1.28.40 1.el8 x86_64\n", 0),
         ("output_of_subscription_manager_repos_command", 0),
     ]
 
@@ -39,7 +39,7 @@ def test_should_use_no_rhsm_rhsm_installed_rhui_not(
 @patch("scripts.leapp_script.run_subprocess")
 def test_should_use_no_rhsm_rhsm_not_installed(mock_run_subprocess):
     mock_run_subprocess.side_effect = [
-        ("error_message", 1),
+        ("", 0),
     ]
 
     rhui_installed = True
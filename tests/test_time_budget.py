@@ -0,0 +1,77 @@
+import pytest
+from mock import patch
+
+from scripts.leapp_script import OutputCollector, ProcessError, TimeBudget
+
+
+@pytest.fixture(name="clock")
+def clock_fixture():
+    with patch("scripts.leapp_script.time.time", return_value=1000.0) as mock_time:
+        yield mock_time
+
+
+def test_time_budget_disabled(clock):
+    time_budget = TimeBudget(0, 30)
+    clock.return_value = 1000000.0
+
+    assert time_budget.remaining() is None
+    assert time_budget.get_timeout(0) == 0
+    assert time_budget.get_timeout(900) == 900
+    assert time_budget.allows("inventory")
+    time_budget.require("execute")
+
+
+def test_time_budget_remaining(clock):
+    time_budget = TimeBudget(600, 30)
+    clock.return_value = 1100.0
+
+    assert time_budget.remaining() == 470
+    assert time_budget.get_timeout(0) == 470
+    assert time_budget.get_timeout(900) == 470
+    assert time_budget.get_timeout(60) == 60
+
+
+def test_time_budget_exhausted(clock):
+    time_budget = TimeBudget(600, 30)
+    clock.return_value = 2000.0
+
+    assert time_budget.remaining() == 0
+    assert time_budget.get_timeout(900) == 1
+    with pytest.raises(ProcessError) as exception:
+        time_budget.require("execute")
+    assert "before the execute phase" in exception.value.report
+
+
+def test_time_budget_skips_optional_step(clock):
+    time_budget = TimeBudget(600, 30)
+    clock.return_value = 1500.0
+
+    assert not time_budget.allows("inventory")
+    assert time_budget.skipped == ["inventory"]
+
+    output = OutputCollector(status="WARNING", message="Analysis done.")
+    output.report_json = {"entries": {}}
+    time_budget.annotate(output)
+
+    assert output.message == (
+        "Analysis done. Skipped because of the time budget: inventory."
+    )
+    assert output.report_json["skipped"] == ["inventory"]
+
+
+def test_time_budget_start(clock):
+    time_budget = TimeBudget(600, 30)
+    clock.return_value = 1500.0
+    time_budget.allows("inventory")
+
+    time_budget.start()
+
+    assert time_budget.remaining() == 570
+    assert not time_budget.skipped
+
+
+def test_time_budget_annotate_nothing_skipped():
+    output = OutputCollector(status="WARNING", message="Analysis done.")
+    TimeBudget(600, 30).annotate(output)
+
+    assert output.message == "Analysis done."
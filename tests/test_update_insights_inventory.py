@@ -1,5 +1,9 @@
 from mock import patch
-from scripts.leapp_script import update_insights_inventory, OutputCollector
+from scripts.leapp_script import (
+    update_insights_inventory,
+    OutputCollector,
+    ProcessTimeoutError,
+)
 
 
 def test_update_insights_inventory_successfully():
@@ -10,7 +14,9 @@ def test_update_insights_inventory_successfully():
         update_insights_inventory(output)
         assert "Failed to update Insights Inventory." not in output.message
 
-    mock_popen.assert_called_once_with(cmd=["/usr/bin/insights-client"])
+    mock_popen.assert_called_once_with(
+        cmd=["/usr/bin/insights-client"], phase="inventory"
+    )
 
 
 def test_update_insights_inventory_non_success():
@@ -21,4 +27,21 @@ def test_update_insights_inventory_non_success():
         update_insights_inventory(output)
         assert "Failed to update Insights Inventory." in output.message
 
-    mock_popen.assert_called_once_with(cmd=["/usr/bin/insights-client"])
+    mock_popen.assert_called_once_with(
+        cmd=["/usr/bin/insights-client"], phase="inventory"
+    )
+
+
+def test_update_insights_inventory_timeout():
+    output = OutputCollector(status="WARNING", message="Upgrade")
+    output.report_json = {"entries": [{"title": "Entry"}]}
+    timeout_error = ProcessTimeoutError(
+        "The inventory phase timed out", "killed", "inventory", "deadline", 900
+    )
+    with patch("scripts.leapp_script.run_subprocess", side_effect=timeout_error):
+        update_insights_inventory(output)
+
+    assert output.status == "WARNING"
+    assert output.message == "Upgrade Failed to update Insights Inventory."
+    assert output.alert
+    assert output.report_json == {"entries": [{"title": "Entry"}]}